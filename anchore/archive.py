@@ -0,0 +1,127 @@
+'''
+Create cloudformation template for the Anchore Engine catalog archive bucket
+'''
+from troposphere import (
+    Sub, Ref, GetAtt, Parameter,
+    Output, Export, Template
+)
+from troposphere.s3 import (
+    Bucket,
+    BucketEncryption,
+    ServerSideEncryptionRule,
+    ServerSideEncryptionByDefault,
+    PublicAccessBlockConfiguration,
+    LifecycleConfiguration,
+    LifecycleRule,
+    LifecycleRuleTransition,
+    AbortIncompleteMultipartUpload,
+)
+import anchore.constants as constants
+
+class ArchiveTemplate():
+    '''
+    Create S3 archive bucket template
+    '''
+    def __init__(self):
+        self.cfn_template = Template()
+
+    def add_descriptions(self, descriptions):
+        '''
+        Add descriptions to template
+        '''
+        self.cfn_template.set_description(descriptions)
+        return self.cfn_template
+
+    def add_version(self, version):
+        '''
+        Add a version of the template file to template
+        '''
+        self.cfn_template.set_version(version)
+        return self.cfn_template
+
+    def add_parameters(self):
+        '''
+        Add parameters to generated template
+        '''
+        self.cfn_template.add_parameter(
+            Parameter(
+                "Environment",
+                Type="String",
+            )
+        )
+        self.cfn_template.add_parameter(
+            Parameter(
+                "ArchiveTransitionDays",
+                Type="Number",
+                Default="30",
+                Description="Days before archived documents move to intelligent tiering storage",
+            )
+        )
+        return self.cfn_template
+
+    def add_outputs(self):
+        '''
+        Add outputs to generated template
+        '''
+        self.cfn_template.add_output(
+            Output(
+                constants.ARCHIVE_BUCKET,
+                Description="Anchore catalog archive bucket",
+                Export=Export(Sub('${Environment}-ARCHIVE-BUCKET')),
+                Value=Ref(constants.ARCHIVE_BUCKET),
+            )
+        )
+        self.cfn_template.add_output(
+            Output(
+                f'{constants.ARCHIVE_BUCKET}Arn',
+                Description="Anchore catalog archive bucket ARN",
+                Export=Export(Sub('${Environment}-ARCHIVE-BUCKET-ARN')),
+                Value=GetAtt(constants.ARCHIVE_BUCKET, 'Arn'),
+            )
+        )
+        return self.cfn_template
+
+    def add_archive_bucket(self):
+        '''
+        Add the private, encrypted bucket holding analysis documents
+
+        The bucket is retained when the stack is deleted so the
+        archive survives a redeployment.
+        '''
+        self.cfn_template.add_resource(Bucket(
+            title=constants.ARCHIVE_BUCKET,
+            DeletionPolicy='Retain',
+            BucketEncryption=BucketEncryption(
+                ServerSideEncryptionConfiguration=[
+                    ServerSideEncryptionRule(
+                        ServerSideEncryptionByDefault=ServerSideEncryptionByDefault(
+                            SSEAlgorithm='AES256'
+                        )
+                    )
+                ]
+            ),
+            PublicAccessBlockConfiguration=PublicAccessBlockConfiguration(
+                BlockPublicAcls=True,
+                BlockPublicPolicy=True,
+                IgnorePublicAcls=True,
+                RestrictPublicBuckets=True
+            ),
+            LifecycleConfiguration=LifecycleConfiguration(
+                Rules=[
+                    LifecycleRule(
+                        Id='ArchiveTiering',
+                        Status='Enabled',
+                        Transitions=[
+                            LifecycleRuleTransition(
+                                StorageClass='INTELLIGENT_TIERING',
+                                TransitionInDays=Ref('ArchiveTransitionDays')
+                            )
+                        ],
+                        AbortIncompleteMultipartUpload=AbortIncompleteMultipartUpload(
+                            DaysAfterInitiation=int('7')
+                        )
+                    )
+                ]
+            )
+        ))
+        return self.cfn_template
@@ -20,6 +20,28 @@ sysctl -w net.ipv4.conf.all.route_localnet=1
 iptables -t nat -A PREROUTING -p tcp -d 169.254.170.2 --dport 80 -j DNAT --to-destination 127.0.0.1:51679
 iptables -t nat -A OUTPUT -d 169.254.170.2 -p tcp -m tcp --dport 80 -j REDIRECT --to-ports 51679
 
+echo '==============================================================================='
+echo '======================== Analyzer Scratch Volume =============================='
+echo '==============================================================================='
+
+# Format and mount the first unused disk, the gp3 scratch volume or
+# the NVMe instance store, for analyzer image unpacking. Instance
+# types without an instance store keep scratch on the root volume.
+if [ "${ScratchVolumeType}" = "instance-store" ]; then
+  SCRATCH_DEVICE=$(ls /dev/disk/by-id/nvme-Amazon_EC2_NVMe_Instance_Storage_* 2>/dev/null | head -n 1)
+else
+  SCRATCH_DEVICE=$(lsblk -dpno NAME | while read -r DISK; do [ -z "$(lsblk -no MOUNTPOINT $DISK | tr -d '[:space:]')" ] && echo $DISK; done | head -n 1)
+fi
+mkdir -p /var/lib/anchore-scratch
+if [ -n "$SCRATCH_DEVICE" ]; then
+  mkfs -t ext4 -F $SCRATCH_DEVICE
+  mount -o noatime $SCRATCH_DEVICE /var/lib/anchore-scratch
+  echo "UUID=$(blkid -s UUID -o value $SCRATCH_DEVICE) /var/lib/anchore-scratch ext4 defaults,noatime,nofail 0 2" >> /etc/fstab
+else
+  echo 'No scratch disk found, using the root volume'
+fi
+chmod 1777 /var/lib/anchore-scratch
+
 echo '==============================================================================='
 echo '======================== Start ECS Agent ======================================'
 echo '==============================================================================='
@@ -99,9 +121,109 @@ MLA = 'MemoryLowAlarm'
 TASK_ROLE = 'TaskRole'
 MHA = 'MemoryHighAlarm'
 ENG_LOG = 'EngineLogGroup'
-DB_LOG = 'DatabaseLogGroup'
 SERVICE_ROLE = 'ServiceRole'
 
+# ECS split engine services CFN Resources Logical IDs
+ANALYZER_SCALABLE_TARGET = 'AnalyzerScalableTarget'
+SD_NAMESPACE = 'ServiceDiscoveryNamespace'
+PGBOUNCER_TASK = 'PgBouncerTask'
+PGBOUNCER_SERVICE = 'PgBouncerService'
+PGBOUNCER_DISCOVERY = 'PgBouncerDiscoveryService'
+USE_PGBOUNCER = 'UsePgBouncer'
+PGBOUNCER_PORT = 6432
+ANALYZER_SCALING_POLICY = 'AnalyzerQueueDepthScalingPolicy'
+
+# EC2 ECS capacity provider CFN Resources Logical IDs
+CAPACITY_PROVIDER = 'CapacityProvider'
+CAPACITY_PROVIDER_ASSOC = 'ClusterCapacityProviderAssociation'
+MANAGED_SCALING = 'UseManagedScaling'
+STEP_SCALING = 'UseStepScaling'
+
+# Analyzer queue depth metric published from simplequeue
+QUEUE_METRIC_NAMESPACE = 'Anchore'
+QUEUE_METRIC_NAME = 'AnalyzerQueueDepth'
+ANALYZER_QUEUE = 'images_to_analyze'
+QUEUE_METRIC_PERIOD = 30
+
+# Catalog archive stored in S3 with compression instead of the database
+ARCHIVE_CONFIG = {
+    'services': {
+        'catalog': {
+            'archive': {
+                'compression': {
+                    'enabled': True,
+                    'min_size_kbytes': 100
+                },
+                'storage_driver': {
+                    'name': 's3',
+                    'config': {
+                        'bucket': '${ANCHORE_ARCHIVE_BUCKET}',
+                        'region': '${AWS_DEFAULT_REGION}',
+                        'iamauto': True,
+                        'create_bucket': False
+                    }
+                }
+            }
+        }
+    }
+}
+
+# Anchore Engine services that can run as separate ECS services
+# with their listening port and default task sizing
+# and per process database connection pool
+ENGINE_SERVICES = {
+    'apiext': {
+        'Port': 8228, 'Cpu': 256, 'Memory': 1024, 'DesiredCount': 1,
+        'DbPoolSize': 10, 'DbPoolMaxOverflow': 20
+    },
+    'catalog': {
+        'Port': 8082, 'Cpu': 256, 'Memory': 1024, 'DesiredCount': 1,
+        'DbPoolSize': 15, 'DbPoolMaxOverflow': 30,
+        'Config': ARCHIVE_CONFIG
+    },
+    'simplequeue': {
+        'Port': 8083, 'Cpu': 128, 'Memory': 512, 'DesiredCount': 1,
+        'DbPoolSize': 5, 'DbPoolMaxOverflow': 10
+    },
+    'analyzer': {
+        'Port': 8084, 'Cpu': 1024, 'Memory': 4096, 'DesiredCount': 2, 'MaxThreads': 4,
+        'DbPoolSize': 5, 'DbPoolMaxOverflow': 5
+    },
+    'policy_engine': {
+        'Port': 8087, 'Cpu': 256, 'Memory': 1536, 'DesiredCount': 1,
+        'DbPoolSize': 10, 'DbPoolMaxOverflow': 20
+    },
+}
+
+# RDS CFN Resources Logical IDs
+DB_INSTANCE = 'AnchoreDatabase'
+DB_REPLICA = 'AnchoreDatabaseReplica'
+DB_SUBNET_GROUP = 'DatabaseSubnetGroup'
+DB_SG = 'DatabaseSecurityGroup'
+DB_PARAMS = 'DatabaseParameterGroup'
+MAX_READ_REPLICAS = 2
+
+# Analyzer scratch volume
+SCRATCH_VOLUME = 'analysis_scratch'
+SCRATCH_DEVICE = '/dev/xvdb'
+SCRATCH_HOST_PATH = '/var/lib/anchore-scratch'
+SCRATCH_CONTAINER_PATH = '/analysis_scratch'
+EBS_SCRATCH = 'UseEbsScratch'
+
+# S3 archive CFN Resources Logical IDs
+ARCHIVE_BUCKET = 'ArchiveBucket'
+
+# ECR push scan queue CFN Resources Logical IDs
+PUSH_RULE = 'ImagePushRule'
+SCAN_QUEUE = 'ScanQueue'
+SCAN_DLQ = 'ScanDeadLetterQueue'
+SCAN_QUEUE_POLICY = 'ScanQueuePolicy'
+SCANNER_ROLE = 'ScannerRole'
+SCANNER_FUNCTION = 'ScannerFunction'
+SCANNER_EVENT_SOURCE = 'ScannerEventSourceMapping'
+HAS_SCANNER = 'HasScannerFunction'
+SCANNER_HANDLER = 'tasks.scan_queue.handler'
+
 # ROUTE53 CFN Resources Logical Ids
 RECORDSET = 'AnchoreEngineRecordSet'
 # OUTPUTS
@@ -115,3 +237,15 @@ ECS_TEMPLATE = 'anchore_ecs.yml'
 ECR_TEMPLATE = 'anchore_ecr.yml'
 EC2_INST_TEMPLATE = 'anchore_ec2_cluster.yml'
 RECORDSET_TEMPLATE = 'anchore_recordset.yml'
+ECS_SERVICES_TEMPLATE = 'anchore_ecs_services.yml'
+RDS_TEMPLATE = 'anchore_rds.yml'
+ARCHIVE_TEMPLATE = 'anchore_archive.yml'
+SCAN_EVENTS_TEMPLATE = 'anchore_scan_events.yml'
+
+# Anchore Engine configuration
+ENGINE_CONFIG = 'anchore/anchore-engine/config/config.yaml'
+ENGINE_SERVICES_CONFIG_DIR = 'anchore/anchore-engine/config/services'
+CONTAINER_SERVICES_CONFIG_DIR = '/config/services'
+
+# Deployed stack fingerprints
+STACK_STATE_FILE = '.anchore_stacks.json'
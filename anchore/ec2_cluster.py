@@ -4,9 +4,16 @@ Create cloudformation template for Anchore Engine EC2 Autoscaling Cluster
 from troposphere import (
     Sub, Ref, GetAtt, Parameter,
     Output, Export, Template,
-    ImportValue, Base64
+    ImportValue, Base64, Equals, Not, If
+)
+from troposphere.ecs import (
+    Cluster,
+    CapacityProvider,
+    AutoScalingGroupProvider,
+    ManagedScaling,
+    ClusterCapacityProviderAssociations,
+    CapacityProviderStrategy,
 )
-from troposphere.ecs import Cluster
 from troposphere.ec2 import (
     SecurityGroup,
     EBSBlockDevice,
@@ -94,6 +101,79 @@ class EC2ClusterTemplate():
                 Type="String",
             )
         )
+        self.cfn_template.add_parameter(
+            Parameter(
+                "ManagedScaling",
+                Type="String",
+                Default="false",
+                AllowedValues=["true", "false"],
+                Description="Scale the cluster from ECS task demand through a capacity provider",
+            )
+        )
+        self.cfn_template.add_parameter(
+            Parameter(
+                "ScratchVolumeType",
+                Type="String",
+                Default="gp3",
+                AllowedValues=["gp3", "instance-store"],
+                Description="Analyzer scratch space on a gp3 volume or the instance NVMe store",
+            )
+        )
+        self.cfn_template.add_parameter(
+            Parameter(
+                "ScratchVolumeSize",
+                Type="Number",
+                Default="200",
+                Description="Size in GiB of the gp3 scratch volume",
+            )
+        )
+        self.cfn_template.add_parameter(
+            Parameter(
+                "ScratchVolumeIops",
+                Type="Number",
+                Default="3000",
+                MinValue="3000",
+                MaxValue="16000",
+            )
+        )
+        self.cfn_template.add_parameter(
+            Parameter(
+                "ScratchVolumeThroughput",
+                Type="Number",
+                Default="250",
+                MinValue="125",
+                MaxValue="1000",
+                Description="Throughput in MiB/s of the gp3 scratch volume",
+            )
+        )
+        self.cfn_template.add_parameter(
+            Parameter(
+                "CapacityTargetPercent",
+                Type="Number",
+                Default="100",
+                MinValue="1",
+                MaxValue="100",
+            )
+        )
+        return self.cfn_template
+
+    def add_conditions(self):
+        '''
+        Add conditions selecting between capacity provider managed
+        scaling and the reservation alarm step scaling
+        '''
+        self.cfn_template.add_condition(
+            constants.MANAGED_SCALING,
+            Equals(Ref('ManagedScaling'), 'true')
+        )
+        self.cfn_template.add_condition(
+            constants.STEP_SCALING,
+            Not(Equals(Ref('ManagedScaling'), 'true'))
+        )
+        self.cfn_template.add_condition(
+            constants.EBS_SCRATCH,
+            Equals(Ref('ScratchVolumeType'), 'gp3')
+        )
         return self.cfn_template
 
     def add_outputs(self):
@@ -231,6 +311,10 @@ class EC2ClusterTemplate():
     def add_launch_config(self):
         '''
         Add autoscaling launch configurastion
+
+        Instances get a gp3 scratch volume unless ScratchVolumeType
+        selects the NVMe instance store. The user data mounts either
+        one on the host for the analyzer tasks.
         '''
         self.cfn_template.add_resource(
             LaunchConfiguration(
@@ -244,6 +328,20 @@ class EC2ClusterTemplate():
                             VolumeSize=int('100'),
                             VolumeType='gp2'
                         )
+                    ),
+                    If(
+                        constants.EBS_SCRATCH,
+                        BlockDeviceMapping(
+                            DeviceName=constants.SCRATCH_DEVICE,
+                            Ebs=EBSBlockDevice(
+                                DeleteOnTermination=True,
+                                VolumeSize=Ref('ScratchVolumeSize'),
+                                VolumeType='gp3',
+                                Iops=Ref('ScratchVolumeIops'),
+                                Throughput=Ref('ScratchVolumeThroughput')
+                            )
+                        ),
+                        Ref('AWS::NoValue')
                     )
                 ],
                 IamInstanceProfile=Ref(constants.INST_PROFILE),
@@ -260,6 +358,52 @@ class EC2ClusterTemplate():
         )
         return self.cfn_template
 
+    def add_capacity_provider(self):
+        '''
+        Add a capacity provider with managed scaling on the instance
+        AutoScalingGroup and make it the cluster default strategy
+        '''
+        self.cfn_template.add_resource(
+            CapacityProvider(
+                title=constants.CAPACITY_PROVIDER,
+                Condition=constants.MANAGED_SCALING,
+                AutoScalingGroupProvider=AutoScalingGroupProvider(
+                    AutoScalingGroupArn=Ref(constants.INST_ASG),
+                    ManagedScaling=ManagedScaling(
+                        Status='ENABLED',
+                        TargetCapacity=Ref('CapacityTargetPercent'),
+                        MinimumScalingStepSize=int('1'),
+                        MaximumScalingStepSize=int('2')
+                    ),
+                    ManagedTerminationProtection='DISABLED'
+                )
+            )
+        )
+        self.cfn_template.add_resource(
+            ClusterCapacityProviderAssociations(
+                title=constants.CAPACITY_PROVIDER_ASSOC,
+                Condition=constants.MANAGED_SCALING,
+                Cluster=Ref(constants.CLUSTER),
+                CapacityProviders=[Ref(constants.CAPACITY_PROVIDER)],
+                DefaultCapacityProviderStrategy=[
+                    CapacityProviderStrategy(
+                        CapacityProvider=Ref(constants.CAPACITY_PROVIDER),
+                        Weight=int('1')
+                    )
+                ]
+            )
+        )
+        self.cfn_template.add_output(
+            Output(
+                constants.CAPACITY_PROVIDER,
+                Condition=constants.MANAGED_SCALING,
+                Description="ECS cluster capacity provider",
+                Export=Export(Sub('${Environment}-CAPACITY-PROVIDER')),
+                Value=Ref(constants.CAPACITY_PROVIDER),
+            )
+        )
+        return self.cfn_template
+
     def add_scaling_policy(self, title, cd_number, adjustment):
         '''
         Add autoscaling policy
@@ -267,6 +411,7 @@ class EC2ClusterTemplate():
         self.cfn_template.add_resource(
             ScalingPolicy(
                 title=title,
+                Condition=constants.STEP_SCALING,
                 AdjustmentType='ChangeInCapacity',
                 AutoScalingGroupName=Ref(constants.INST_ASG),
                 Cooldown=cd_number,
@@ -292,6 +437,7 @@ class EC2ClusterTemplate():
         self.cfn_template.add_resource(
             Alarm(
                 title=title,
+                Condition=constants.STEP_SCALING,
                 ActionsEnabled=True,
                 AlarmActions=[Ref(scale_policy)],
                 AlarmDescription=alarm_desc,
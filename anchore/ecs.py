@@ -4,17 +4,30 @@ Create cloudformation template for Anchore Engine ECS
 from troposphere import (
     Sub, Ref, GetAtt,
     Output, Export, Template, Parameter,
-    ImportValue, Join
+    ImportValue, Join, If, Equals
 )
 from troposphere.ecs import (
     Service, LoadBalancer,
     TaskDefinition, PlacementStrategy,
     ContainerDefinition, Environment,
-    PortMapping, Volume, LogConfiguration,
-    MountPoint, DeploymentConfiguration
+    PortMapping, LogConfiguration,
+    DeploymentConfiguration, Volume,
+    Host, MountPoint,
+    NetworkConfiguration, AwsvpcConfiguration,
+    ServiceRegistry, CapacityProviderStrategyItem
 )
 from troposphere.iam import Role, Policy
 from troposphere.logs import LogGroup
+from troposphere.applicationautoscaling import (
+    ScalableTarget, ScalingPolicy,
+    TargetTrackingScalingPolicyConfiguration,
+    CustomizedMetricSpecification, MetricDimension
+)
+from troposphere.servicediscovery import (
+    PrivateDnsNamespace, DnsConfig, DnsRecord,
+    HealthCheckCustomConfig
+)
+from troposphere.servicediscovery import Service as DiscoveryService
 from awacs.sts import AssumeRole
 from awacs.aws import (
     Allow, Statement, Action,
@@ -22,6 +35,112 @@ from awacs.aws import (
 )
 import anchore.constants as constants
 
+def service_title(service):
+    '''
+    Logical ID prefix for an engine service, e.g. policy_engine -> PolicyEngine
+    '''
+    return ''.join(part.capitalize() for part in service.split('_'))
+
+def container_metadata(*keys):
+    '''
+    Shell command printing a value of the ECS container metadata file,
+    e.g. container_metadata('PortMappings', 0, 'HostPort')
+    '''
+    path = ''.join(f'[{key!r}]' for key in keys)
+    return (
+        'python3 -c "import json, os; '
+        f"print(json.load(open(os.environ['ECS_CONTAINER_METADATA_FILE'])){path})\""
+    )
+
+def awsvpc_configuration():
+    '''
+    Run tasks in the private subnets with the application security group
+    '''
+    return NetworkConfiguration(
+        AwsvpcConfiguration=AwsvpcConfiguration(
+            Subnets=[
+                ImportValue(Sub('${Environment}-PRIVATE-SUBNET-1')),
+                ImportValue(Sub('${Environment}-PRIVATE-SUBNET-2')),
+            ],
+            SecurityGroups=[
+                ImportValue(Sub('${Environment}-AppSecurityGroup'))
+            ]
+        )
+    )
+
+def database_environment(pooled=False):
+    '''
+    Point the engine at the database exported by the RDS stack
+
+    Args:
+        pooled: connect through PgBouncer when the UsePgBouncer condition holds
+    '''
+    host = ImportValue(Sub('${Environment}-DB-HOST'))
+    port = ImportValue(Sub('${Environment}-DB-PORT'))
+    if pooled:
+        host = If(constants.USE_PGBOUNCER, Sub('pgbouncer.${Environment}.anchore.internal'), host)
+        port = If(constants.USE_PGBOUNCER, str(constants.PGBOUNCER_PORT), port)
+    return [
+        Environment(
+            Name='ANCHORE_DB_HOST',
+            Value=host
+        ),
+        Environment(
+            Name='ANCHORE_DB_PORT',
+            Value=port
+        ),
+        Environment(
+            Name='ANCHORE_DB_NAME',
+            Value=ImportValue(Sub('${Environment}-DB-NAME'))
+        ),
+        Environment(
+            Name='ANCHORE_DB_USER',
+            Value=ImportValue(Sub('${Environment}-DB-USER'))
+        ),
+        Environment(
+            Name='ANCHORE_DB_PASSWORD',
+            Value=Ref('AnchoreDBPassword')
+        ),
+    ]
+
+def archive_environment():
+    '''
+    Name the S3 archive bucket the catalog config refers to
+    '''
+    return [
+        Environment(
+            Name='ANCHORE_ARCHIVE_BUCKET',
+            Value=ImportValue(Sub('${Environment}-ARCHIVE-BUCKET'))
+        )
+    ]
+
+def analyzer_threads_environment(service):
+    '''
+    Set the analyzer max_threads from the service MaxThreads parameter
+    '''
+    return Environment(
+        Name='ANCHORE_MAX_THREADS',
+        Value=Ref(f'{service_title(service)}MaxThreads')
+    )
+
+def scratch_volume():
+    '''
+    Host directory the cluster instances mount their scratch disk on
+    '''
+    return Volume(
+        Name=constants.SCRATCH_VOLUME,
+        Host=Host(SourcePath=constants.SCRATCH_HOST_PATH)
+    )
+
+def scratch_mount_point():
+    '''
+    Mount the scratch disk as the analyzer tmp_dir
+    '''
+    return MountPoint(
+        ContainerPath=constants.SCRATCH_CONTAINER_PATH,
+        SourceVolume=constants.SCRATCH_VOLUME
+    )
+
 class ECSTemplate():
     '''
     Create ECS template
@@ -67,22 +186,53 @@ class ECSTemplate():
         )
         self.cfn_template.add_parameter(
             Parameter(
-                "ArchoreDatabaseImage",
+                "AnchoreDBPassword",
                 Type="String",
+                NoEcho=True,
             )
         )
+        return self.cfn_template
+
+    def add_engine_parameters(self):
+        '''
+        Add sizing parameters for the all-in-one engine container
+        '''
         self.cfn_template.add_parameter(
             Parameter(
-                "PGDATA",
-                Type="String",
+                "EngineCpu",
+                Type="Number",
+                Default="1024",
             )
         )
         self.cfn_template.add_parameter(
             Parameter(
-                "AnchoreDBPassword",
+                "EngineMemory",
+                Type="Number",
+                Default="3072",
+            )
+        )
+        self.cfn_template.add_parameter(
+            Parameter(
+                "AnalyzerMaxThreads",
+                Type="Number",
+                Default="2",
+                Description="Images the analyzer unpacks and analyzes at once",
+            )
+        )
+        self.cfn_template.add_parameter(
+            Parameter(
+                "ManagedScaling",
                 Type="String",
+                Default="false",
+                AllowedValues=["true", "false"],
+                Description="Place the engine through the cluster capacity provider, "
+                            "must match the EC2 cluster stack",
             )
         )
+        self.cfn_template.add_condition(
+            constants.MANAGED_SCALING,
+            Equals(Ref('ManagedScaling'), 'true')
+        )
         return self.cfn_template
 
     def add_outputs(self):
@@ -110,11 +260,25 @@ class ECSTemplate():
     def add_ecs_service(self):
         '''
         Add ECS service
+
+        With managed scaling the service is placed through the cluster
+        capacity provider, so its tasks drive the cluster size.
+        Otherwise it uses the EC2 launch type.
         '''
         self.cfn_template.add_resource(Service(
             title=constants.SERVICE,
             Cluster=ImportValue(Sub('${Environment}-CLUSTER')),
-            LaunchType='EC2',
+            LaunchType=If(constants.MANAGED_SCALING, Ref('AWS::NoValue'), 'EC2'),
+            CapacityProviderStrategy=If(
+                constants.MANAGED_SCALING,
+                [
+                    CapacityProviderStrategyItem(
+                        CapacityProvider=ImportValue(Sub('${Environment}-CAPACITY-PROVIDER')),
+                        Weight=int('1')
+                    )
+                ],
+                Ref('AWS::NoValue')
+            ),
             DesiredCount=int('1'),
             TaskDefinition=Ref(constants.TASK),
             Role=Ref(constants.SERVICE_ROLE),
@@ -150,18 +314,14 @@ class ECSTemplate():
         '''
         self.cfn_template.add_resource(TaskDefinition(
             title=constants.TASK,
-            Volumes=[
-                Volume(
-                    Name='anchore_db_vol'
-                )
-            ],
             TaskRoleArn=GetAtt(constants.TASK_ROLE, 'Arn'),
+            Volumes=[scratch_volume()],
             ContainerDefinitions=[
                 ContainerDefinition(
                     Name='anchore-engine',
                     Hostname='anchore-engine',
-                    Cpu=int('512'),
-                    MemoryReservation=int('1536'),
+                    Cpu=Ref('EngineCpu'),
+                    MemoryReservation=Ref('EngineMemory'),
                     Essential=bool('true'),
                     Image=ImportValue(
                         Sub('${Environment}-${AnchoreEngineImage}')
@@ -189,13 +349,10 @@ class ECSTemplate():
                             Value='anchore-engine'
                         ),
                         Environment(
-                            Name='ANCHORE_DB_HOST',
-                            Value='anchore-db'
-                        ),
-                        Environment(
-                            Name='ANCHORE_DB_PASSWORD',
-                            Value=Ref('AnchoreDBPassword')
+                            Name='ANCHORE_MAX_THREADS',
+                            Value=Ref('AnalyzerMaxThreads')
                         ),
+                    ] + database_environment() + archive_environment() + [
                         Environment(
                             Name='AWS_DEFAULT_REGION',
                             Value=Ref('AWS::Region')
@@ -216,58 +373,7 @@ class ECSTemplate():
                             ])
                         }
                     ),
-                    Links=['anchore-db']
-                ),
-                ContainerDefinition(
-                    Name='anchore-db',
-                    Hostname='anchore-db',
-                    Cpu=int('512'),
-                    MemoryReservation=int('1536'),
-                    Essential=bool('true'),
-                    Image=Ref('ArchoreDatabaseImage'),
-                    PortMappings=[
-                        PortMapping(
-                            ContainerPort=int('5432'),
-                            HostPort=int('5432'),
-                            Protocol='tcp',
-                        )
-                    ],
-                    DockerSecurityOptions=['apparmor:docker-default'],
-                    MountPoints=[
-                        MountPoint(
-                            ContainerPath=Ref('PGDATA'),
-                            SourceVolume='anchore_db_vol'
-                        )
-                    ],
-                    Environment=[
-                        Environment(
-                            Name='POSTGRES_PASSWORD',
-                            Value=Ref('AnchoreDBPassword')
-                        ),
-                        Environment(
-                            Name='PGDATA',
-                            Value=Ref('PGDATA')
-                        ),
-                        Environment(
-                            Name='AWS_DEFAULT_REGION',
-                            Value=Ref('AWS::Region')
-                        ),
-                        Environment(
-                            Name='region',
-                            Value=Ref('AWS::Region')
-                        ),
-                    ],
-                    LogConfiguration=LogConfiguration(
-                        LogDriver='awslogs',
-                        Options={
-                            "awslogs-group": Ref('DatabaseLogGroup'),
-                            "awslogs-region": Ref('AWS::Region'),
-                            "awslogs-stream-prefix": Join('', [
-                                'anchore-db',
-                                'logs'
-                            ])
-                        }
-                    )
+                    MountPoints=[scratch_mount_point()]
                 )
             ]
         ))
@@ -342,10 +448,42 @@ class ECSTemplate():
         ))
         return self.cfn_template
 
-    def add_ecs_task_role(self):
+    def add_ecs_task_role(self, archive=False):
         '''
         Add ECS Task Role to template
+
+        Args:
+            archive: allow the tasks to use the S3 archive bucket
         '''
+        policies = []
+        if archive:
+            bucket_arn = ImportValue(Sub('${Environment}-ARCHIVE-BUCKET-ARN'))
+            policies.append(
+                Policy(
+                    PolicyName='AnchoreArchiveBucket',
+                    PolicyDocument=PolicyDocument(
+                        Statement=[
+                            Statement(
+                                Effect=Allow,
+                                Action=[
+                                    Action('s3', 'ListBucket'),
+                                    Action('s3', 'GetBucketLocation')
+                                ],
+                                Resource=[bucket_arn]
+                            ),
+                            Statement(
+                                Effect=Allow,
+                                Action=[
+                                    Action('s3', 'GetObject'),
+                                    Action('s3', 'PutObject'),
+                                    Action('s3', 'DeleteObject')
+                                ],
+                                Resource=[Join('', [bucket_arn, '/*'])]
+                            )
+                        ]
+                    )
+                )
+            )
         self.cfn_template.add_resource(Role(
             title=constants.TASK_ROLE,
             AssumeRolePolicyDocument=PolicyDocument(
@@ -367,7 +505,8 @@ class ECSTemplate():
                                 Action=[
                                     Action('s3', 'GetObject'),
                                     Action('kms', 'Encrypt'),
-                                    Action('kms', 'Decrypt')
+                                    Action('kms', 'Decrypt'),
+                                    Action('cloudwatch', 'PutMetricData')
                                 ],
                                 Resource=['*']
                             )
@@ -396,7 +535,7 @@ class ECSTemplate():
                         ]
                     )
                 )
-            ]
+            ] + policies
         ))
         return self.cfn_template
 
@@ -413,15 +552,477 @@ class ECSTemplate():
         )
         return self.cfn_template
 
-    def add_database_log_group(self):
+    def add_engine_service_parameters(self, service, sizing):
         '''
-        Add Anchore Database log group to template
+        Add CPU, memory, desired count and, for the analyzer, thread
+        count parameters for an engine service
+
+        Args:
+            service: engine service name, e.g. analyzer
+            sizing: default sizing from constants.ENGINE_SERVICES
         '''
-        self.cfn_template.add_resource(
-            LogGroup(
-                title=constants.DB_LOG,
-                LogGroupName='demo-anchore-database',
-                RetentionInDays=int('7')
+        title = service_title(service)
+        keys = ['Cpu', 'Memory', 'DesiredCount']
+        if 'MaxThreads' in sizing:
+            keys.append('MaxThreads')
+        for key in keys:
+            self.cfn_template.add_parameter(
+                Parameter(
+                    f'{title}{key}',
+                    Type='Number',
+                    Default=str(sizing[key]),
+                    Description=f'{key} of the anchore-engine {service} service',
+                )
+            )
+        return self.cfn_template
+
+    def add_engine_services_parameters(self):
+        '''
+        Add parameters shared by the split engine services
+        '''
+        self.cfn_template.add_parameter(
+            Parameter(
+                "AnchoreAdminPassword",
+                Type="String",
+                NoEcho=True,
+                Default="foobar",
+            )
+        )
+        self.cfn_template.add_parameter(
+            Parameter(
+                "MetricsPublisherImage",
+                Type="String",
+                Default="amazon/aws-cli:latest",
+                Description="Image with the AWS CLI and curl publishing the analyzer queue depth",
+            )
+        )
+        self.cfn_template.add_parameter(
+            Parameter(
+                "AnalyzerMinCount",
+                Type="Number",
+                Default="1",
+            )
+        )
+        self.cfn_template.add_parameter(
+            Parameter(
+                "AnalyzerMaxCount",
+                Type="Number",
+                Default="10",
+            )
+        )
+        self.cfn_template.add_parameter(
+            Parameter(
+                "AnalyzerTargetQueueDepth",
+                Type="Number",
+                Default="5",
+                Description="Analyzer queue depth the analyzer service is scaled to hold",
+            )
+        )
+        return self.cfn_template
+
+    def queue_metrics_container(self, port):
+        '''
+        Sidecar publishing the analyzer queue depth from simplequeue to CloudWatch
+
+        Args:
+            port: port simplequeue listens on in the same task
+        Returns:
+            The container definition
+        '''
+        script = (
+            'while true; do '
+            'QLEN=$(curl -sf -u admin:$ANCHORE_ADMIN_PASSWORD '
+            f'http://anchore-simplequeue:{port}/v1/queues/{constants.ANALYZER_QUEUE}/qlen) && '
+            'aws cloudwatch put-metric-data '
+            f'--namespace {constants.QUEUE_METRIC_NAMESPACE} '
+            f'--metric-name {constants.QUEUE_METRIC_NAME} '
+            '--dimensions Environment=$ENVIRONMENT --value $QLEN; '
+            f'sleep {constants.QUEUE_METRIC_PERIOD}; '
+            'done'
+        )
+        return ContainerDefinition(
+            Name='queue-metrics',
+            Cpu=int('32'),
+            MemoryReservation=int('64'),
+            Essential=False,
+            Image=Ref('MetricsPublisherImage'),
+            Links=['anchore-simplequeue'],
+            EntryPoint=['/bin/sh', '-c'],
+            Command=[script],
+            Environment=[
+                Environment(
+                    Name='ENVIRONMENT',
+                    Value=Ref('Environment')
+                ),
+                Environment(
+                    Name='ANCHORE_ADMIN_PASSWORD',
+                    Value=Ref('AnchoreAdminPassword')
+                ),
+                Environment(
+                    Name='AWS_DEFAULT_REGION',
+                    Value=Ref('AWS::Region')
+                ),
+            ],
+            LogConfiguration=LogConfiguration(
+                LogDriver='awslogs',
+                Options={
+                    "awslogs-group": Ref('EngineLogGroup'),
+                    "awslogs-region": Ref('AWS::Region'),
+                    "awslogs-stream-prefix": 'queue-metrics'
+                }
+            )
+        )
+
+    def add_analyzer_autoscaling(self):
+        '''
+        Add target tracking on the analyzer queue depth to the analyzer service
+        '''
+        self.cfn_template.add_resource(ScalableTarget(
+            title=constants.ANALYZER_SCALABLE_TARGET,
+            MinCapacity=Ref('AnalyzerMinCount'),
+            MaxCapacity=Ref('AnalyzerMaxCount'),
+            ResourceId=Join('/', [
+                'service',
+                ImportValue(Sub('${Environment}-CLUSTER')),
+                GetAtt('AnalyzerService', 'Name')
+            ]),
+            RoleARN=Sub(
+                'arn:aws:iam::${AWS::AccountId}:role/aws-service-role/'
+                'ecs.application-autoscaling.amazonaws.com/'
+                'AWSServiceRoleForApplicationAutoScaling_ECSService'
+            ),
+            ScalableDimension='ecs:service:DesiredCount',
+            ServiceNamespace='ecs'
+        ))
+        self.cfn_template.add_resource(ScalingPolicy(
+            title=constants.ANALYZER_SCALING_POLICY,
+            PolicyName=Sub('${Environment}-analyzer-queue-depth'),
+            PolicyType='TargetTrackingScaling',
+            ScalingTargetId=Ref(constants.ANALYZER_SCALABLE_TARGET),
+            TargetTrackingScalingPolicyConfiguration=TargetTrackingScalingPolicyConfiguration(
+                TargetValue=Ref('AnalyzerTargetQueueDepth'),
+                ScaleOutCooldown=int('60'),
+                ScaleInCooldown=int('300'),
+                CustomizedMetricSpecification=CustomizedMetricSpecification(
+                    MetricName=constants.QUEUE_METRIC_NAME,
+                    Namespace=constants.QUEUE_METRIC_NAMESPACE,
+                    Statistic='Average',
+                    Dimensions=[
+                        MetricDimension(
+                            Name='Environment',
+                            Value=Ref('Environment')
+                        )
+                    ]
+                )
+            )
+        ))
+        return self.cfn_template
+
+    def add_pgbouncer_parameters(self):
+        '''
+        Add parameters and condition for the optional PgBouncer tier
+        '''
+        self.cfn_template.add_parameter(
+            Parameter(
+                "PgBouncer",
+                Type="String",
+                Default="false",
+                AllowedValues=["true", "false"],
+                Description="Connect the engine services to the database through PgBouncer",
+            )
+        )
+        self.cfn_template.add_parameter(
+            Parameter(
+                "PgBouncerImage",
+                Type="String",
+                Default="edoburu/pgbouncer:latest",
+            )
+        )
+        self.cfn_template.add_parameter(
+            Parameter(
+                "PgBouncerPoolSize",
+                Type="Number",
+                Default="40",
+                Description="Server connections per PgBouncer task",
+            )
+        )
+        self.cfn_template.add_parameter(
+            Parameter(
+                "PgBouncerMaxClientConn",
+                Type="Number",
+                Default="2000",
+                Description="Engine connections accepted per PgBouncer task",
+            )
+        )
+        self.cfn_template.add_parameter(
+            Parameter(
+                "PgBouncerDesiredCount",
+                Type="Number",
+                Default="2",
+            )
+        )
+        self.cfn_template.add_condition(
+            constants.USE_PGBOUNCER,
+            Equals(Ref('PgBouncer'), 'true')
+        )
+        return self.cfn_template
+
+    def add_pgbouncer_service(self):
+        '''
+        Add PgBouncer in transaction pooling mode as its own ECS service
+
+        Tasks register in a private DNS namespace as
+        pgbouncer.<Environment>.anchore.internal, which is exported.
+        The database sees at most PgBouncerPoolSize connections per
+        task however many engine tasks are running. DNS A records need
+        awsvpc networking, and each task takes one of the instance's
+        network interfaces, so tasks are replaced one at a time.
+        '''
+        self.cfn_template.add_resource(PrivateDnsNamespace(
+            title=constants.SD_NAMESPACE,
+            Condition=constants.USE_PGBOUNCER,
+            Name=Sub('${Environment}.anchore.internal'),
+            Vpc=ImportValue(Sub('${Environment}-VPCID'))
+        ))
+        self.cfn_template.add_resource(DiscoveryService(
+            title=constants.PGBOUNCER_DISCOVERY,
+            Condition=constants.USE_PGBOUNCER,
+            Name='pgbouncer',
+            NamespaceId=Ref(constants.SD_NAMESPACE),
+            DnsConfig=DnsConfig(
+                DnsRecords=[DnsRecord(Type='A', TTL='10')],
+                RoutingPolicy='MULTIVALUE'
+            ),
+            HealthCheckCustomConfig=HealthCheckCustomConfig(FailureThreshold=1)
+        ))
+        self.cfn_template.add_resource(TaskDefinition(
+            title=constants.PGBOUNCER_TASK,
+            Condition=constants.USE_PGBOUNCER,
+            NetworkMode='awsvpc',
+            ContainerDefinitions=[
+                ContainerDefinition(
+                    Name='pgbouncer',
+                    Cpu=int('256'),
+                    MemoryReservation=int('256'),
+                    Essential=bool('true'),
+                    Image=Ref('PgBouncerImage'),
+                    PortMappings=[
+                        PortMapping(
+                            ContainerPort=int(constants.PGBOUNCER_PORT),
+                            Protocol='tcp',
+                        )
+                    ],
+                    DockerSecurityOptions=['apparmor:docker-default'],
+                    Environment=[
+                        Environment(
+                            Name='DB_HOST',
+                            Value=ImportValue(Sub('${Environment}-DB-HOST'))
+                        ),
+                        Environment(
+                            Name='DB_PORT',
+                            Value=ImportValue(Sub('${Environment}-DB-PORT'))
+                        ),
+                        Environment(
+                            Name='DB_USER',
+                            Value=ImportValue(Sub('${Environment}-DB-USER'))
+                        ),
+                        Environment(
+                            Name='DB_PASSWORD',
+                            Value=Ref('AnchoreDBPassword')
+                        ),
+                        Environment(
+                            Name='LISTEN_PORT',
+                            Value=str(constants.PGBOUNCER_PORT)
+                        ),
+                        Environment(
+                            Name='AUTH_TYPE',
+                            Value='md5'
+                        ),
+                        Environment(
+                            Name='POOL_MODE',
+                            Value='transaction'
+                        ),
+                        # pg8000 names its prepared statements, PgBouncer
+                        # tracks them across server connections
+                        Environment(
+                            Name='MAX_PREPARED_STATEMENTS',
+                            Value='200'
+                        ),
+                        Environment(
+                            Name='DEFAULT_POOL_SIZE',
+                            Value=Ref('PgBouncerPoolSize')
+                        ),
+                        Environment(
+                            Name='MAX_CLIENT_CONN',
+                            Value=Ref('PgBouncerMaxClientConn')
+                        ),
+                    ],
+                    LogConfiguration=LogConfiguration(
+                        LogDriver='awslogs',
+                        Options={
+                            "awslogs-group": Ref('EngineLogGroup'),
+                            "awslogs-region": Ref('AWS::Region'),
+                            "awslogs-stream-prefix": 'pgbouncer'
+                        }
+                    )
+                )
+            ]
+        ))
+        self.cfn_template.add_resource(Service(
+            title=constants.PGBOUNCER_SERVICE,
+            Condition=constants.USE_PGBOUNCER,
+            Cluster=ImportValue(Sub('${Environment}-CLUSTER')),
+            DesiredCount=Ref('PgBouncerDesiredCount'),
+            TaskDefinition=Ref(constants.PGBOUNCER_TASK),
+            NetworkConfiguration=awsvpc_configuration(),
+            ServiceRegistries=[
+                ServiceRegistry(RegistryArn=GetAtt(constants.PGBOUNCER_DISCOVERY, 'Arn'))
+            ],
+            DeploymentConfiguration=DeploymentConfiguration(
+                MaximumPercent=int('100'),
+                MinimumHealthyPercent=int('50')
+            ),
+            PlacementStrategies=[
+                PlacementStrategy(
+                    Type='spread',
+                    Field='attribute:ecs.availability-zone'
+                )
+            ]
+        ))
+        self.cfn_template.add_output(
+            Output(
+                'PgBouncerEndpoint',
+                Condition=constants.USE_PGBOUNCER,
+                Description='PgBouncer endpoint in front of the anchore database',
+                Export=Export(Sub('${Environment}-PGBOUNCER-ENDPOINT')),
+                Value=Sub(
+                    'pgbouncer.${Environment}.anchore.internal:' + str(constants.PGBOUNCER_PORT)
+                ),
+            )
+        )
+        return self.cfn_template
+
+    def add_engine_service(self, service, port, sidecars=None, pooled=False, environment=None,
+                           scratch=False): # pylint: disable=too-many-arguments
+        '''
+        Add task definition and ECS service running a single engine service
+
+        Tasks use bridge networking with a dynamic host port, so they
+        need no network interface of their own. Every task registers
+        its host's IP and host port as the service endpoint, so
+        services with a desired count above one can scale out. Only
+        apiext is attached to the load balancer. Services use the
+        cluster's default capacity provider strategy when it has one.
+
+        Args:
+            service: engine service name, e.g. analyzer
+            port: port the engine service listens on
+            sidecars: extra container definitions to run in the task
+            pooled: connect through PgBouncer when it is enabled
+            environment: extra environment variables for the engine container
+            scratch: mount the host scratch disk as the analysis tmp_dir
+        '''
+        title = service_title(service)
+        config_dir = f'{constants.CONTAINER_SERVICES_CONFIG_DIR}/{service}'
+        self.cfn_template.add_resource(TaskDefinition(
+            title=f'{title}Task',
+            NetworkMode='bridge',
+            TaskRoleArn=GetAtt(constants.TASK_ROLE, 'Arn'),
+            Volumes=[scratch_volume()] if scratch else [],
+            ContainerDefinitions=[
+                ContainerDefinition(
+                    Name=f'anchore-{service}',
+                    Cpu=Ref(f'{title}Cpu'),
+                    MemoryReservation=Ref(f'{title}Memory'),
+                    Essential=bool('true'),
+                    Image=ImportValue(
+                        Sub('${Environment}-${AnchoreEngineImage}')
+                    ),
+                    Command=[
+                        '/bin/sh', '-c',
+                        'until grep -q READY "$ECS_CONTAINER_METADATA_FILE"; do sleep 1; done; '
+                        f'ANCHORE_HOST_ID={service}-$(hostname) '
+                        'ANCHORE_ENDPOINT_HOSTNAME='
+                        '$(' + container_metadata('HostPrivateIPv4Address') + ') '
+                        'ANCHORE_EXTERNAL_PORT='
+                        '$(' + container_metadata('PortMappings', 0, 'HostPort') + ') '
+                        f'exec anchore-manager --configdir {config_dir} service start {service}'
+                    ],
+                    PortMappings=[
+                        PortMapping(
+                            ContainerPort=int(port),
+                            HostPort=int('0'),
+                            Protocol='tcp',
+                        )
+                    ],
+                    DockerSecurityOptions=['apparmor:docker-default'],
+                    Environment=database_environment(pooled) + [
+                        Environment(
+                            Name='ANCHORE_ADMIN_PASSWORD',
+                            Value=Ref('AnchoreAdminPassword')
+                        ),
+                        Environment(
+                            Name='AWS_DEFAULT_REGION',
+                            Value=Ref('AWS::Region')
+                        ),
+                        Environment(
+                            Name='region',
+                            Value=Ref('AWS::Region')
+                        ),
+                    ] + (environment or []),
+                    LogConfiguration=LogConfiguration(
+                        LogDriver='awslogs',
+                        Options={
+                            "awslogs-group": Ref('EngineLogGroup'),
+                            "awslogs-region": Ref('AWS::Region'),
+                            "awslogs-stream-prefix": f'anchore-{service}'
+                        }
+                    ),
+                    MountPoints=[scratch_mount_point()] if scratch else []
+                )
+            ] + (sidecars or [])
+        ))
+
+        load_balancers = []
+        if service == 'apiext':
+            load_balancers.append(
+                LoadBalancer(
+                    ContainerName=f'anchore-{service}',
+                    ContainerPort=int(port),
+                    TargetGroupArn=ImportValue(
+                        Sub('${Environment}-TARGETGROUP-ARN')
+                    )
+                )
+            )
+        self.cfn_template.add_resource(Service(
+            title=f'{title}Service',
+            Cluster=ImportValue(Sub('${Environment}-CLUSTER')),
+            DesiredCount=Ref(f'{title}DesiredCount'),
+            TaskDefinition=Ref(f'{title}Task'),
+            DeploymentConfiguration=DeploymentConfiguration(
+                MaximumPercent=int('200'),
+                MinimumHealthyPercent=int('100')
+            ),
+            LoadBalancers=load_balancers,
+            PlacementStrategies=[
+                PlacementStrategy(
+                    Type='spread',
+                    Field='attribute:ecs.availability-zone'
+                ),
+                PlacementStrategy(
+                    Type='spread',
+                    Field='instanceId'
+                )
+            ]
+        ))
+        self.cfn_template.add_output(
+            Output(
+                f'{title}Service',
+                Description=f'ECS Service running anchore-engine {service}',
+                Export=Export(
+                    Sub('${Environment}-' + service.upper().replace('_', '-') + '-SERVICE')
+                ),
+                Value=GetAtt(f'{title}Service', 'Name'),
             )
         )
         return self.cfn_template
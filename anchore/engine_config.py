@@ -0,0 +1,100 @@
+'''
+Generate per-service Anchore Engine configuration overlays
+'''
+import os
+import copy
+import yaml
+import anchore.constants as constants
+
+def load_engine_config(config_file=constants.ENGINE_CONFIG):
+    '''
+    Read the base Anchore Engine config.yaml
+
+    Environment variable references such as ${ANCHORE_DB_HOST} are
+    kept as plain strings, the engine substitutes them at start up.
+    '''
+    with open(config_file, 'r') as config:
+        return yaml.safe_load(config)
+
+def merge_config(base, overrides):
+    '''
+    Deep merge configuration overrides into a copy of base
+
+    Args:
+        base: configuration dictionary
+        overrides: nested dictionary of values to replace
+    Returns:
+        The merged configuration
+    '''
+    merged = copy.deepcopy(base)
+    for key, value in overrides.items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = merge_config(merged[key], value)
+        else:
+            merged[key] = copy.deepcopy(value)
+    return merged
+
+def service_overrides(sizing):
+    '''
+    Configuration overrides for an engine service from its sizing
+
+    Args:
+        sizing: entry of constants.ENGINE_SERVICES, its DbPoolSize and
+            DbPoolMaxOverflow set the per process connection pool and
+            its optional Config holds any other overrides
+    Returns:
+        Nested dictionary of configuration overrides
+    '''
+    overrides = {}
+    if 'DbPoolSize' in sizing:
+        overrides = {
+            'credentials': {
+                'database': {
+                    'db_pool_size': sizing['DbPoolSize'],
+                    'db_pool_max_overflow': sizing['DbPoolMaxOverflow'],
+                }
+            }
+        }
+    return merge_config(overrides, sizing.get('Config', {}))
+
+def service_config(base, service, overrides=None):
+    '''
+    Build the configuration for a container running a single engine service
+
+    Args:
+        base: base configuration dictionary
+        service: engine service to enable, every other service is disabled
+        overrides: optional nested dictionary of extra values for this service
+    Returns:
+        The service configuration
+    '''
+    enabled = {
+        name: {'enabled': name == service}
+        for name in base['services']
+    }
+    return merge_config(base, merge_config({'services': enabled}, overrides or {}))
+
+def write_service_configs(services, config_file=constants.ENGINE_CONFIG,
+                          output_dir=constants.ENGINE_SERVICES_CONFIG_DIR):
+    '''
+    Write <output_dir>/<service>/config.yaml for every engine service
+
+    Args:
+        services: dictionary of service name to configuration overrides
+        config_file: base config.yaml
+        output_dir: directory copied into the engine image
+    Returns:
+        List of written configuration files
+    '''
+    base = load_engine_config(config_file)
+    files = []
+    for service, overrides in services.items():
+        service_dir = os.path.join(output_dir, service)
+        os.makedirs(service_dir, exist_ok=True)
+        filename = os.path.join(service_dir, 'config.yaml')
+        with open(filename, 'w') as config:
+            config.write(f'# Generated from {config_file} for the {service} service\n')
+            yaml.safe_dump(service_config(base, service, overrides), config,
+                           default_flow_style=False, sort_keys=False)
+        files.append(filename)
+    return files
@@ -0,0 +1,67 @@
+'''
+Stamp out per-environment variants of a rendered cloudformation template
+'''
+import os
+import copy
+import json
+import cfn_flip
+
+def variant_filename(filename, environment):
+    '''
+    Name of the template file for one environment
+
+    Args:
+        filename: base template file, e.g. anchore_vpc.yml
+        environment: environment name, e.g. DEMO
+    Returns:
+        The variant file name, e.g. anchore_vpc_demo.yml
+    '''
+    base, extension = os.path.splitext(filename)
+    return f'{base}_{environment.lower()}{extension}'
+
+def template_variant(template, parameters):
+    '''
+    Copy a rendered template with environment values as parameter defaults
+
+    Only the Parameters section is copied, every other section
+    is shared with the base template.
+
+    Args:
+        template: template dictionary from Template.to_dict()
+        parameters: parameter key-values for the environment
+    Returns:
+        The template dictionary for the environment
+    Raises:
+        Exception: If a value is given for a parameter the template does not declare
+    '''
+    unknown = set(parameters) - set(template.get('Parameters', {}))
+    if unknown:
+        raise Exception(f'Template does not declare parameters: {sorted(unknown)}')
+
+    variant = dict(template)
+    variant['Parameters'] = copy.deepcopy(template['Parameters'])
+    for key, value in parameters.items():
+        variant['Parameters'][key]['Default'] = value
+    return variant
+
+def write_variants(template, filename, environments):
+    '''
+    Write one template file per environment
+
+    Args:
+        template: template dictionary from Template.to_dict()
+        filename: base template file name
+        environments: dictionary of environment name to parameter key-values
+    Returns:
+        List of written file names
+    '''
+    files = []
+    for environment, parameters in environments.items():
+        parameters = dict(parameters)
+        parameters.setdefault('Environment', environment)
+        variant = template_variant(template, parameters)
+        variant_file = variant_filename(filename, environment)
+        with open(variant_file, 'w') as yaml_file:
+            yaml_file.write(cfn_flip.to_yaml(json.dumps(variant, sort_keys=True)))
+        files.append(variant_file)
+    return files
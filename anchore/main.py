@@ -4,15 +4,53 @@ Anchore-Engine
 This create cloudformation templates to deploy Anchore Engine
 '''
 import os
+from concurrent.futures import ProcessPoolExecutor
 from anchore.vpc import VPCTemplate
 from anchore.alb import ALBTemplate
 from anchore.ecs import ECSTemplate
 from anchore.ecr import ECRTemplate
 from anchore.ec2_cluster import EC2ClusterTemplate
+from anchore.rds import RDSTemplate
+from anchore.archive import ArchiveTemplate
+from anchore.scan_events import ScanEventsTemplate
+from anchore.ecs import archive_environment, analyzer_threads_environment
+from anchore.render_cache import RenderCache, builder_key
+from anchore.environments import write_variants
+from anchore.engine_config import write_service_configs, service_overrides
 import anchore.constants as constants
 from tasks.deploy_stacks import deploy_stack
 from tasks.keypair import create_keypair
 
+# Template builder method to the module it is built from, its output file
+# and the AnchoreEngine attribute holding the built template
+TEMPLATE_BUILDERS = {
+    'create_vpc_template': ('anchore.vpc', constants.VPC_TEMPLATE, 'vpc_template'),
+    'create_alb_template': ('anchore.alb', constants.ALB_TEMPLATE, 'alb_template'),
+    'create_ecs_template': ('anchore.ecs', constants.ECS_TEMPLATE, 'ecs_template'),
+    'create_ecr_template': ('anchore.ecr', constants.ECR_TEMPLATE, 'ecr_template'),
+    'create_ec2_cluster_template': (
+        'anchore.ec2_cluster', constants.EC2_INST_TEMPLATE, 'ec2_template'
+    ),
+    'create_rds_template': ('anchore.rds', constants.RDS_TEMPLATE, 'rds_template'),
+    'create_archive_template': ('anchore.archive', constants.ARCHIVE_TEMPLATE, 'archive_template'),
+    'create_scan_events_template': (
+        'anchore.scan_events', constants.SCAN_EVENTS_TEMPLATE, 'scan_events_template'
+    ),
+    'create_ecs_services_template': (
+        'anchore.ecs', constants.ECS_SERVICES_TEMPLATE, 'ecs_services_template'
+    ),
+}
+
+def render_template(builder):
+    '''
+    Render a single template in a fresh AnchoreEngine
+
+    Runs in a worker process, so every template gets its own
+    troposphere objects.
+    '''
+    getattr(AnchoreEngine(), builder)()
+    return builder
+
 #pylint: disable=too-many-instance-attributes
 class AnchoreEngine():
     '''
@@ -24,8 +62,12 @@ class AnchoreEngine():
         self.vpc_template = VPCTemplate()
         self.alb_template = ALBTemplate()
         self.ecs_template = ECSTemplate()
+        self.ecs_services_template = ECSTemplate()
         self.ecr_template = ECRTemplate()
         self.ec2_template = EC2ClusterTemplate()
+        self.rds_template = RDSTemplate()
+        self.archive_template = ArchiveTemplate()
+        self.scan_events_template = ScanEventsTemplate()
 
     def write_file(self, filename, template):
         '''
@@ -40,6 +82,7 @@ class AnchoreEngine():
         '''
 
         # Create Anchore Engine VPC template
+        self.vpc_template = VPCTemplate()
         self.vpc_template.add_descriptions("Launch a simple VPC")
         self.vpc_template.add_version(self.version)
         self.vpc_template.add_parameters()
@@ -73,6 +116,7 @@ class AnchoreEngine():
         '''
 
         # Create Anchore Engine ALB template
+        self.alb_template = ALBTemplate()
         self.alb_template.add_descriptions("Archore-Engine Container Scanning System Load Balancer")
         self.alb_template.add_version(self.version)
         self.alb_template.add_parameters()
@@ -92,6 +136,7 @@ class AnchoreEngine():
         '''
 
         # Create Anchore Engine ECR template
+        self.ecr_template = ECRTemplate()
         self.ecr_template.add_descriptions("Demo Anchore-Engine ECR Repository")
         self.ecr_template.add_version(self.version)
         self.ecr_template.add_parameters()
@@ -109,15 +154,18 @@ class AnchoreEngine():
         '''
 
         # Create Anchore Engine EC2 template
+        self.ec2_template = EC2ClusterTemplate()
         self.ec2_template.add_descriptions("Demo Anchore-Engine EC2 Instance")
         self.ec2_template.add_version(self.version)
         self.ec2_template.add_parameters()
+        self.ec2_template.add_conditions()
         self.ec2_template.add_ecs_cluster()
         self.ec2_template.add_instance_role()
         self.ec2_template.add_ssh_security()
         self.ec2_template.add_instance_profile()
         self.ec2_template.add_auto_scaling_group()
         self.ec2_template.add_launch_config()
+        self.ec2_template.add_capacity_provider()
         self.ec2_template.add_scaling_policy(
             constants.SDP,
             '300',
@@ -174,27 +222,187 @@ class AnchoreEngine():
         self.write_file(constants.EC2_INST_TEMPLATE, ec2_template_file)
         return True
 
+    def create_rds_template(self):
+        '''
+        RDS Template creation entrypoint
+        '''
+
+        # Create Anchore Engine RDS template
+        self.rds_template = RDSTemplate()
+        self.rds_template.add_descriptions("Demo Anchore-Engine Postgres Database")
+        self.rds_template.add_version(self.version)
+        self.rds_template.add_parameters()
+        self.rds_template.add_conditions()
+        self.rds_template.add_db_subnet_group()
+        self.rds_template.add_db_security_group()
+        self.rds_template.add_db_parameter_group()
+        self.rds_template.add_db_instance()
+        self.rds_template.add_read_replicas()
+        rds_template_file = self.rds_template.add_outputs()
+
+        # write template file to directory
+        self.write_file(constants.RDS_TEMPLATE, rds_template_file)
+        return True
+
+    def create_archive_template(self):
+        '''
+        S3 archive bucket Template creation entrypoint
+        '''
+
+        # Create Anchore Engine archive bucket template
+        self.archive_template = ArchiveTemplate()
+        self.archive_template.add_descriptions("Demo Anchore-Engine Catalog Archive")
+        self.archive_template.add_version(self.version)
+        self.archive_template.add_parameters()
+        self.archive_template.add_archive_bucket()
+        archive_template_file = self.archive_template.add_outputs()
+
+        # write template file to directory
+        self.write_file(constants.ARCHIVE_TEMPLATE, archive_template_file)
+        return True
+
+    def create_scan_events_template(self):
+        '''
+        ECR push scan queue Template creation entrypoint
+        '''
+
+        # Create Anchore Engine push scanning template
+        self.scan_events_template = ScanEventsTemplate()
+        self.scan_events_template.add_descriptions("Demo Anchore-Engine ECR Push Scanning")
+        self.scan_events_template.add_version(self.version)
+        self.scan_events_template.add_parameters()
+        self.scan_events_template.add_conditions()
+        self.scan_events_template.add_scan_queue()
+        self.scan_events_template.add_push_rule()
+        self.scan_events_template.add_scanner_function()
+        scan_events_template_file = self.scan_events_template.add_outputs()
+
+        # write template file to directory
+        self.write_file(constants.SCAN_EVENTS_TEMPLATE, scan_events_template_file)
+        return True
+
     def create_ecs_template(self):
         '''
         ECS Template creation entrypoint
         '''
 
         # Create Anchore Engine ECS template
+        self.ecs_template = ECSTemplate()
         self.ecs_template.add_descriptions("Demo Anchore-Engine Cluster")
         self.ecs_template.add_version(self.version)
         self.ecs_template.add_parameters()
+        self.ecs_template.add_engine_parameters()
         self.ecs_template.add_ecs_service()
         self.ecs_template.add_ecs_task()
         self.ecs_template.add_ecs_service_role()
-        self.ecs_template.add_ecs_task_role()
+        self.ecs_template.add_ecs_task_role(archive=True)
         self.ecs_template.add_engine_log_group()
-        self.ecs_template.add_database_log_group()
         ecs_template_file = self.ecs_template.add_outputs()
 
         # write template file to directory
         self.write_file(constants.ECS_TEMPLATE, ecs_template_file)
         return True
 
+    def create_ecs_services_template(self, services=None):
+        '''
+        ECS Template creation entrypoint for running every engine
+        service as its own independently scalable ECS service
+        '''
+        services = services or constants.ENGINE_SERVICES
+
+        # Create Anchore Engine split services ECS template
+        self.ecs_services_template = ECSTemplate()
+        self.ecs_services_template.add_descriptions("Demo Anchore-Engine Services")
+        self.ecs_services_template.add_version(self.version)
+        self.ecs_services_template.add_parameters()
+        self.ecs_services_template.add_engine_services_parameters()
+        self.ecs_services_template.add_pgbouncer_parameters()
+        for service, sizing in services.items():
+            self.ecs_services_template.add_engine_service_parameters(service, sizing)
+        for service, sizing in services.items():
+            sidecars = []
+            if service == 'simplequeue':
+                sidecars.append(self.ecs_services_template.queue_metrics_container(sizing['Port']))
+            environment = archive_environment() if service == 'catalog' else []
+            if 'MaxThreads' in sizing:
+                environment.append(analyzer_threads_environment(service))
+            self.ecs_services_template.add_engine_service(
+                service, sizing['Port'], sidecars, pooled=True,
+                environment=environment, scratch=service == 'analyzer'
+            )
+        if 'analyzer' in services:
+            self.ecs_services_template.add_analyzer_autoscaling()
+        self.ecs_services_template.add_pgbouncer_service()
+        self.ecs_services_template.add_ecs_task_role(archive=True)
+        ecs_services_template_file = self.ecs_services_template.add_engine_log_group()
+
+        # write template file to directory
+        self.write_file(constants.ECS_SERVICES_TEMPLATE, ecs_services_template_file)
+        return True
+
+    def create_engine_service_configs(self, services=None):
+        '''
+        Write the per-service engine config.yaml overlays
+        '''
+        services = services or constants.ENGINE_SERVICES
+        return write_service_configs({
+            service: service_overrides(sizing)
+            for service, sizing in services.items()
+        })
+
+    def create_templates(self, builders, max_workers=None, cache=None):
+        '''
+        Render templates concurrently in a process pool
+
+        Templates whose builder module, constants and main module are
+        unchanged since they were last rendered are restored from the
+        render cache, and files already up to date are not rewritten.
+
+        Args:
+            builders: template builder method names, e.g. create_vpc_template
+            max_workers: maximum number of worker processes
+            cache: RenderCache to use, defaults to .template_cache
+        Returns:
+            List of builders that had to be rendered
+        '''
+        cache = cache or RenderCache()
+        keys = {}
+        pending = []
+        for builder in builders:
+            module, filename, _ = TEMPLATE_BUILDERS[builder]
+            keys[builder] = builder_key(builder, [module, 'anchore.constants', 'anchore.main'])
+            if cache.restore(keys[builder], filename):
+                print(f'Template {filename} is up to date')
+            else:
+                pending.append(builder)
+
+        if pending:
+            with ProcessPoolExecutor(max_workers=max_workers) as executor:
+                for builder in executor.map(render_template, pending):
+                    filename = TEMPLATE_BUILDERS[builder][1]
+                    cache.store(keys[builder], filename)
+                    print(f'Template {filename} rendered')
+        return pending
+
+    def create_environment_templates(self, builder, environments):
+        '''
+        Build a template once and write a variant for every environment
+
+        The resource graph is built and validated a single time. Each
+        environment only gets its parameter defaults (CIDRs, instance
+        types, cluster sizes, ...) substituted into a copy.
+
+        Args:
+            builder: template builder method name, e.g. create_vpc_template
+            environments: dictionary of environment name to parameter key-values
+        Returns:
+            List of written template file names
+        '''
+        _, filename, attribute = TEMPLATE_BUILDERS[builder]
+        getattr(self, builder)()
+        template = getattr(self, attribute).cfn_template.to_dict()
+        return write_variants(template, filename, environments)
+
     def deploy_keypair(self, keyname):
         '''
         Create EC2 key pair
@@ -205,8 +413,8 @@ class AnchoreEngine():
 
     def deploy_all(self, configs):
         '''
-        Deploy cloudformation stack
+        Deploy cloudformation stack, skipping stacks that are unchanged
         '''
-        res = deploy_stack(configs)
+        res = deploy_stack(configs, state_file=constants.STACK_STATE_FILE)
         return res
         
\ No newline at end of file
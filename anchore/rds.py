@@ -0,0 +1,294 @@
+'''
+Create cloudformation template for Anchore Engine RDS Postgres database
+'''
+from troposphere import (
+    Sub, Ref, GetAtt, Join, Parameter,
+    Output, Export, Template,
+    ImportValue, Equals, Or
+)
+from troposphere.rds import (
+    DBInstance,
+    DBSubnetGroup,
+    DBParameterGroup,
+)
+from troposphere.ec2 import (
+    SecurityGroup,
+    SecurityGroupRule
+)
+import anchore.constants as constants
+
+# Postgres settings applied on top of the RDS defaults. Memory based
+# values are RDS formulas resolved against the instance class:
+# shared_buffers is a quarter and effective_cache_size three quarters
+# of the instance memory, both in 8 KiB pages.
+DB_PARAMETERS = {
+    'shared_buffers': '{DBInstanceClassMemory/32768}',
+    'effective_cache_size': '{DBInstanceClassMemory/10923}',
+    'work_mem': '16384',
+    'maintenance_work_mem': '262144',
+    'random_page_cost': '1.1',
+    'checkpoint_completion_target': '0.9',
+    'log_min_duration_statement': '1000',
+    # pg8000 shipped with anchore-engine only supports md5 authentication
+    'password_encryption': 'md5',
+}
+
+def replica_condition(number):
+    '''
+    Name of the condition creating the given read replica
+    '''
+    return f'HasReadReplica{number}'
+
+class RDSTemplate():
+    '''
+    Create RDS Postgres template shared by all Anchore Engine tasks
+    '''
+    def __init__(self):
+        self.cfn_template = Template()
+
+    def add_descriptions(self, descriptions):
+        '''
+        Add descriptions to template
+        '''
+        self.cfn_template.set_description(descriptions)
+        return self.cfn_template
+
+    def add_version(self, version):
+        '''
+        Add a version of the template file to template
+        '''
+        self.cfn_template.set_version(version)
+        return self.cfn_template
+
+    def add_parameters(self):
+        '''
+        Add parameters to generated template
+        '''
+        self.cfn_template.add_parameter(
+            Parameter(
+                "Environment",
+                Type="String",
+            )
+        )
+        self.cfn_template.add_parameter(
+            Parameter(
+                "DBInstanceClass",
+                Type="String",
+                Default="db.m5.large",
+            )
+        )
+        self.cfn_template.add_parameter(
+            Parameter(
+                "DBEngineVersion",
+                Type="String",
+                Default="13",
+                Description="Postgres major version, also selects the parameter group family",
+            )
+        )
+        self.cfn_template.add_parameter(
+            Parameter(
+                "DBAllocatedStorage",
+                Type="Number",
+                Default="100",
+                MinValue="20",
+            )
+        )
+        self.cfn_template.add_parameter(
+            Parameter(
+                "DBMaxConnections",
+                Type="Number",
+                Default="500",
+            )
+        )
+        self.cfn_template.add_parameter(
+            Parameter(
+                "DBMultiAZ",
+                Type="String",
+                Default="true",
+                AllowedValues=["true", "false"],
+            )
+        )
+        self.cfn_template.add_parameter(
+            Parameter(
+                "DBName",
+                Type="String",
+                Default="anchore",
+            )
+        )
+        self.cfn_template.add_parameter(
+            Parameter(
+                "DBUsername",
+                Type="String",
+                Default="anchore",
+            )
+        )
+        self.cfn_template.add_parameter(
+            Parameter(
+                "AnchoreDBPassword",
+                Type="String",
+                NoEcho=True,
+            )
+        )
+        self.cfn_template.add_parameter(
+            Parameter(
+                "ReadReplicaCount",
+                Type="Number",
+                Default="0",
+                AllowedValues=[str(count) for count in range(constants.MAX_READ_REPLICAS + 1)],
+            )
+        )
+        return self.cfn_template
+
+    def add_conditions(self):
+        '''
+        Add one condition per possible read replica
+        '''
+        for number in range(1, constants.MAX_READ_REPLICAS + 1):
+            counts = [
+                Equals(Ref('ReadReplicaCount'), str(count))
+                for count in range(number, constants.MAX_READ_REPLICAS + 1)
+            ]
+            self.cfn_template.add_condition(
+                replica_condition(number),
+                counts[0] if len(counts) == 1 else Or(*counts)
+            )
+        return self.cfn_template
+
+    def add_outputs(self):
+        '''
+        Add outputs to generated template
+        '''
+        self.cfn_template.add_output(
+            Output(
+                "DatabaseHost",
+                Description="Anchore database endpoint address",
+                Export=Export(Sub('${Environment}-DB-HOST')),
+                Value=GetAtt(constants.DB_INSTANCE, 'Endpoint.Address'),
+            )
+        )
+        self.cfn_template.add_output(
+            Output(
+                "DatabasePort",
+                Description="Anchore database endpoint port",
+                Export=Export(Sub('${Environment}-DB-PORT')),
+                Value=GetAtt(constants.DB_INSTANCE, 'Endpoint.Port'),
+            )
+        )
+        self.cfn_template.add_output(
+            Output(
+                "DatabaseName",
+                Description="Anchore database name",
+                Export=Export(Sub('${Environment}-DB-NAME')),
+                Value=Ref('DBName'),
+            )
+        )
+        self.cfn_template.add_output(
+            Output(
+                "DatabaseUser",
+                Description="Anchore database user",
+                Export=Export(Sub('${Environment}-DB-USER')),
+                Value=Ref('DBUsername'),
+            )
+        )
+        return self.cfn_template
+
+    def add_db_subnet_group(self):
+        '''
+        Add subnet group placing the database in the private subnets
+        '''
+        self.cfn_template.add_resource(DBSubnetGroup(
+            title=constants.DB_SUBNET_GROUP,
+            DBSubnetGroupDescription='Anchore database private subnets',
+            SubnetIds=[
+                ImportValue(Sub('${Environment}-PRIVATE-SUBNET-1')),
+                ImportValue(Sub('${Environment}-PRIVATE-SUBNET-2')),
+            ]
+        ))
+        return self.cfn_template
+
+    def add_db_security_group(self):
+        '''
+        Add security group allowing postgres from the application servers
+        '''
+        self.cfn_template.add_resource(SecurityGroup(
+            title=constants.DB_SG,
+            GroupDescription='Allow postgres connections from application servers',
+            SecurityGroupIngress=[
+                SecurityGroupRule(
+                    IpProtocol='tcp',
+                    FromPort=int('5432'),
+                    ToPort=int('5432'),
+                    SourceSecurityGroupId=ImportValue(Sub('${Environment}-AppSecurityGroup'))
+                )
+            ],
+            VpcId=ImportValue(Sub('${Environment}-VPCID'))
+        ))
+        return self.cfn_template
+
+    def add_db_parameter_group(self):
+        '''
+        Add parameter group tuned for the anchore engine workload
+        '''
+        parameters = dict(DB_PARAMETERS)
+        parameters['max_connections'] = Ref('DBMaxConnections')
+        self.cfn_template.add_resource(DBParameterGroup(
+            title=constants.DB_PARAMS,
+            Description='Anchore database parameters',
+            Family=Join('', ['postgres', Ref('DBEngineVersion')]),
+            Parameters=parameters
+        ))
+        return self.cfn_template
+
+    def add_db_instance(self):
+        '''
+        Add the primary Postgres instance
+        '''
+        self.cfn_template.add_resource(DBInstance(
+            title=constants.DB_INSTANCE,
+            DeletionPolicy='Snapshot',
+            Engine='postgres',
+            EngineVersion=Ref('DBEngineVersion'),
+            DBInstanceClass=Ref('DBInstanceClass'),
+            AllocatedStorage=Ref('DBAllocatedStorage'),
+            StorageType='gp2',
+            StorageEncrypted=True,
+            MultiAZ=Ref('DBMultiAZ'),
+            DBName=Ref('DBName'),
+            MasterUsername=Ref('DBUsername'),
+            MasterUserPassword=Ref('AnchoreDBPassword'),
+            DBParameterGroupName=Ref(constants.DB_PARAMS),
+            DBSubnetGroupName=Ref(constants.DB_SUBNET_GROUP),
+            VPCSecurityGroups=[Ref(constants.DB_SG)],
+            PubliclyAccessible=False,
+            BackupRetentionPeriod=int('7'),
+            EnablePerformanceInsights=True
+        ))
+        return self.cfn_template
+
+    def add_read_replicas(self):
+        '''
+        Add the optional read replicas and export their endpoints
+        '''
+        for number in range(1, constants.MAX_READ_REPLICAS + 1):
+            title = f'{constants.DB_REPLICA}{number}'
+            self.cfn_template.add_resource(DBInstance(
+                title=title,
+                Condition=replica_condition(number),
+                SourceDBInstanceIdentifier=Ref(constants.DB_INSTANCE),
+                Engine='postgres',
+                DBInstanceClass=Ref('DBInstanceClass'),
+                DBParameterGroupName=Ref(constants.DB_PARAMS),
+                VPCSecurityGroups=[Ref(constants.DB_SG)],
+                PubliclyAccessible=False,
+                EnablePerformanceInsights=True
+            ))
+            self.cfn_template.add_output(
+                Output(
+                    f'DatabaseReadHost{number}',
+                    Condition=replica_condition(number),
+                    Description=f'Anchore database read replica {number} endpoint address',
+                    Export=Export(Sub('${Environment}-DB-READ-HOST-' + str(number))),
+                    Value=GetAtt(title, 'Endpoint.Address'),
+                )
+            )
+        return self.cfn_template
@@ -0,0 +1,80 @@
+'''
+Content-addressed cache of rendered cloudformation templates
+'''
+import os
+import hashlib
+import importlib.util
+import troposphere
+
+CACHE_DIR = '.template_cache'
+
+def builder_key(builder, modules):
+    '''
+    Hash everything a template builder depends on
+
+    Args:
+        builder: name of the AnchoreEngine template builder method
+        modules: dotted module names whose source the template is built from
+    Returns:
+        Hex digest identifying the rendered template
+    '''
+    digest = hashlib.sha256(builder.encode('utf-8'))
+    digest.update(troposphere.__version__.encode('utf-8'))
+    for module in modules:
+        with open(importlib.util.find_spec(module).origin, 'rb') as source:
+            digest.update(source.read())
+    return digest.hexdigest()
+
+class RenderCache():
+    '''
+    Store rendered templates by builder key and restore them
+    without rewriting files that are already up to date
+    '''
+    def __init__(self, cache_dir=CACHE_DIR):
+        self.cache_dir = cache_dir
+
+    def path(self, key):
+        '''
+        Location of a cached template
+        '''
+        return os.path.join(self.cache_dir, f'{key}.yml')
+
+    def restore(self, key, filename):
+        '''
+        Restore a cached template to filename
+
+        The file is only written when its content differs from the cache.
+
+        Args:
+            key: builder key from builder_key
+            filename: template file to restore
+        Returns:
+            True on a cache hit, otherwise False
+        '''
+        if not os.path.exists(self.path(key)):
+            return False
+        with open(self.path(key), 'rb') as cached:
+            content = cached.read()
+        if os.path.exists(filename):
+            with open(filename, 'rb') as current:
+                if current.read() == content:
+                    return True
+        with open(filename, 'wb') as template:
+            template.write(content)
+        return True
+
+    def store(self, key, filename):
+        '''
+        Add a rendered template to the cache
+
+        Args:
+            key: builder key from builder_key
+            filename: rendered template file
+        '''
+        os.makedirs(self.cache_dir, exist_ok=True)
+        with open(filename, 'rb') as template:
+            content = template.read()
+        temp_file = f'{self.path(key)}.tmp'
+        with open(temp_file, 'wb') as cached:
+            cached.write(content)
+        os.replace(temp_file, self.path(key))
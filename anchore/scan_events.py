@@ -0,0 +1,295 @@
+'''
+Create cloudformation template routing ECR image pushes
+through EventBridge and SQS to the Anchore Engine scanner
+'''
+from troposphere import (
+    Sub, Ref, GetAtt, Parameter,
+    Output, Export, Template,
+    ImportValue, Equals, Not
+)
+from troposphere.events import Rule, Target
+from troposphere.sqs import Queue, QueuePolicy, RedrivePolicy
+from troposphere.awslambda import (
+    Function, Code, Environment,
+    EventSourceMapping, VPCConfig
+)
+from troposphere.iam import Role, Policy
+from awacs.sts import AssumeRole
+from awacs.aws import (
+    Allow, Statement, Action,
+    PolicyDocument, Principal,
+    Condition, ArnEquals
+)
+import anchore.constants as constants
+
+# Successful pushes as emitted by ECR for every PutImage
+PUSH_EVENT_PATTERN = {
+    'source': ['aws.ecr'],
+    'detail-type': ['ECR Image Action'],
+    'detail': {
+        'action-type': ['PUSH'],
+        'result': ['SUCCESS']
+    }
+}
+
+class ScanEventsTemplate():
+    '''
+    Create ECR push scan queue template
+    '''
+    def __init__(self):
+        self.cfn_template = Template()
+
+    def add_descriptions(self, descriptions):
+        '''
+        Add descriptions to template
+        '''
+        self.cfn_template.set_description(descriptions)
+        return self.cfn_template
+
+    def add_version(self, version):
+        '''
+        Add a version of the template file to template
+        '''
+        self.cfn_template.set_version(version)
+        return self.cfn_template
+
+    def add_parameters(self):
+        '''
+        Add parameters to generated template
+        '''
+        self.cfn_template.add_parameter(
+            Parameter(
+                "Environment",
+                Type="String",
+            )
+        )
+        self.cfn_template.add_parameter(
+            Parameter(
+                "AnchoreAdminPasswordParameter",
+                Type="String",
+                Default="/anchore/admin-password",
+                AllowedPattern="^/[a-zA-Z0-9_.\\-/]+$",
+                Description="SSM SecureString parameter holding the engine admin password",
+            )
+        )
+        self.cfn_template.add_parameter(
+            Parameter(
+                "ScanBatchSize",
+                Type="Number",
+                Default="10",
+                MinValue="1",
+                # SQS event sources reject more than 10 without a batching window
+                MaxValue="10",
+                Description="Maximum number of pushed images submitted to the engine at once",
+            )
+        )
+        self.cfn_template.add_parameter(
+            Parameter(
+                "ScanBatchWindow",
+                Type="Number",
+                Default="5",
+                MinValue="0",
+                MaxValue="300",
+                Description="Seconds to gather pushed images into one batch",
+            )
+        )
+        self.cfn_template.add_parameter(
+            Parameter(
+                "ScannerCodeBucket",
+                Type="String",
+                Default="",
+                Description=(
+                    "Bucket holding the scanner lambda package, empty to run a worker instead"
+                ),
+            )
+        )
+        self.cfn_template.add_parameter(
+            Parameter(
+                "ScannerCodeKey",
+                Type="String",
+                Default="scanner.zip",
+            )
+        )
+        return self.cfn_template
+
+    def add_conditions(self):
+        '''
+        Only create the lambda consumer when its package is provided
+        '''
+        self.cfn_template.add_condition(
+            constants.HAS_SCANNER,
+            Not(Equals(Ref('ScannerCodeBucket'), ''))
+        )
+        return self.cfn_template
+
+    def add_outputs(self):
+        '''
+        Add outputs to generated template
+        '''
+        self.cfn_template.add_output(
+            Output(
+                "ScanQueueUrl",
+                Description="Queue of pushed ECR images waiting to be scanned",
+                Export=Export(Sub('${Environment}-SCAN-QUEUE-URL')),
+                Value=Ref(constants.SCAN_QUEUE),
+            )
+        )
+        self.cfn_template.add_output(
+            Output(
+                "ScanQueueArn",
+                Description="Scan queue ARN",
+                Export=Export(Sub('${Environment}-SCAN-QUEUE-ARN')),
+                Value=GetAtt(constants.SCAN_QUEUE, 'Arn'),
+            )
+        )
+        return self.cfn_template
+
+    def add_scan_queue(self):
+        '''
+        Add the scan queue and the dead letter queue receiving images
+        that repeatedly failed to be submitted
+        '''
+        self.cfn_template.add_resource(Queue(
+            title=constants.SCAN_DLQ,
+            MessageRetentionPeriod=int('1209600')
+        ))
+        self.cfn_template.add_resource(Queue(
+            title=constants.SCAN_QUEUE,
+            ReceiveMessageWaitTimeSeconds=int('20'),
+            VisibilityTimeout=int('120'),
+            RedrivePolicy=RedrivePolicy(
+                deadLetterTargetArn=GetAtt(constants.SCAN_DLQ, 'Arn'),
+                maxReceiveCount=int('5')
+            )
+        ))
+        return self.cfn_template
+
+    def add_push_rule(self):
+        '''
+        Add EventBridge rule sending ECR push events to the scan queue
+        '''
+        self.cfn_template.add_resource(Rule(
+            title=constants.PUSH_RULE,
+            Description='Queue every image pushed to ECR for scanning',
+            EventPattern=PUSH_EVENT_PATTERN,
+            State='ENABLED',
+            Targets=[
+                Target(
+                    Id='ScanQueue',
+                    Arn=GetAtt(constants.SCAN_QUEUE, 'Arn')
+                )
+            ]
+        ))
+        self.cfn_template.add_resource(QueuePolicy(
+            title=constants.SCAN_QUEUE_POLICY,
+            Queues=[Ref(constants.SCAN_QUEUE)],
+            PolicyDocument=PolicyDocument(
+                Statement=[
+                    Statement(
+                        Effect=Allow,
+                        Action=[Action('sqs', 'SendMessage')],
+                        Principal=Principal('Service', ['events.amazonaws.com']),
+                        Resource=[GetAtt(constants.SCAN_QUEUE, 'Arn')],
+                        Condition=Condition(
+                            ArnEquals('aws:SourceArn', GetAtt(constants.PUSH_RULE, 'Arn'))
+                        )
+                    )
+                ]
+            )
+        ))
+        return self.cfn_template
+
+    def add_scanner_function(self):
+        '''
+        Add the lambda consumer submitting queued images to the engine
+
+        SQS delivers up to ScanBatchSize messages gathered over
+        ScanBatchWindow seconds per invocation. Messages the engine
+        rejected are reported back as batch item failures so only
+        they are retried. The function runs in the private subnets
+        with the app security group, which the internal load balancer
+        accepts, and reads the admin password from SSM at runtime.
+        '''
+        self.cfn_template.add_resource(Role(
+            title=constants.SCANNER_ROLE,
+            Condition=constants.HAS_SCANNER,
+            AssumeRolePolicyDocument=PolicyDocument(
+                Statement=[
+                    Statement(
+                        Effect=Allow,
+                        Action=[AssumeRole],
+                        Principal=Principal('Service', ['lambda.amazonaws.com'])
+                    )
+                ]
+            ),
+            ManagedPolicyArns=[
+                'arn:aws:iam::aws:policy/service-role/AWSLambdaBasicExecutionRole',
+                'arn:aws:iam::aws:policy/service-role/AWSLambdaVPCAccessExecutionRole'
+            ],
+            Policies=[
+                Policy(
+                    PolicyName='ScanQueueConsumer',
+                    PolicyDocument=PolicyDocument(
+                        Statement=[
+                            Statement(
+                                Effect=Allow,
+                                Action=[
+                                    Action('sqs', 'ReceiveMessage'),
+                                    Action('sqs', 'DeleteMessage'),
+                                    Action('sqs', 'GetQueueAttributes')
+                                ],
+                                Resource=[GetAtt(constants.SCAN_QUEUE, 'Arn')]
+                            ),
+                            Statement(
+                                Effect=Allow,
+                                Action=[Action('ssm', 'GetParameter')],
+                                Resource=[Sub(
+                                    'arn:${AWS::Partition}:ssm:${AWS::Region}:${AWS::AccountId}'
+                                    ':parameter${AnchoreAdminPasswordParameter}'
+                                )]
+                            )
+                        ]
+                    )
+                )
+            ]
+        ))
+        self.cfn_template.add_resource(Function(
+            title=constants.SCANNER_FUNCTION,
+            Condition=constants.HAS_SCANNER,
+            Handler=constants.SCANNER_HANDLER,
+            Runtime='python3.9',
+            Timeout=int('60'),
+            MemorySize=int('256'),
+            Role=GetAtt(constants.SCANNER_ROLE, 'Arn'),
+            Code=Code(
+                S3Bucket=Ref('ScannerCodeBucket'),
+                S3Key=Ref('ScannerCodeKey')
+            ),
+            VpcConfig=VPCConfig(
+                SecurityGroupIds=[ImportValue(Sub('${Environment}-AppSecurityGroup'))],
+                SubnetIds=[
+                    ImportValue(Sub('${Environment}-PRIVATE-SUBNET-1')),
+                    ImportValue(Sub('${Environment}-PRIVATE-SUBNET-2')),
+                ]
+            ),
+            Environment=Environment(
+                Variables={
+                    'ANCHORE_CLI_URL': Sub(
+                        'http://${DNS}:8228/v1',
+                        DNS=ImportValue(Sub('${Environment}-DNS-NAME'))
+                    ),
+                    'ANCHORE_CLI_USER': 'admin',
+                    'ANCHORE_CLI_PASS_PARAMETER': Ref('AnchoreAdminPasswordParameter')
+                }
+            )
+        ))
+        self.cfn_template.add_resource(EventSourceMapping(
+            title=constants.SCANNER_EVENT_SOURCE,
+            Condition=constants.HAS_SCANNER,
+            EventSourceArn=GetAtt(constants.SCAN_QUEUE, 'Arn'),
+            FunctionName=Ref(constants.SCANNER_FUNCTION),
+            BatchSize=Ref('ScanBatchSize'),
+            MaximumBatchingWindowInSeconds=Ref('ScanBatchWindow'),
+            FunctionResponseTypes=['ReportBatchItemFailures']
+        ))
+        return self.cfn_template
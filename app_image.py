@@ -3,6 +3,7 @@ Create ECR cloudformation template and
 Launches ECR stack
 '''
 from anchore.main import AnchoreEngine
+from tasks import metrics
 
 ECR_CONFIGS = 'configs/ecr_configs.yml'
 
@@ -12,7 +13,9 @@ def main():
     '''
     anchore_engine = AnchoreEngine()
     anchore_engine.create_ecr_template()
+    anchore_engine.create_engine_service_configs()
     anchore_engine.deploy_all(ECR_CONFIGS)
+    metrics.dump()
     return anchore_engine
 
 if __name__ == '__main__':
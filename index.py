@@ -3,6 +3,7 @@ Create Anchore-Engine cloudformation templates
 and Launches all stacks for Anchore-Engine
 '''
 from anchore.main import AnchoreEngine
+from tasks import metrics
 
 CONFIGS = 'configs/configs.yml'
 
@@ -11,11 +12,17 @@ def main():
     Anchore-Engine stacks creation entrypoint
     '''
     anchore_engine = AnchoreEngine()
-    anchore_engine.create_vpc_template()
-    anchore_engine.create_alb_template()
-    anchore_engine.create_ecs_template()
-    anchore_engine.create_ec2_cluster_template()
+    anchore_engine.create_templates([
+        'create_vpc_template',
+        'create_alb_template',
+        'create_rds_template',
+        'create_archive_template',
+        'create_ecs_template',
+        'create_ec2_cluster_template',
+        'create_scan_events_template'
+    ])
     anchore_engine.deploy_all(CONFIGS)
+    metrics.dump()
     return anchore_engine
 
 if __name__ == '__main__':
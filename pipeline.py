@@ -2,6 +2,7 @@
 Launches AWS CodePipeline stack
 '''
 from anchore.main import AnchoreEngine
+from tasks import metrics
 
 PIPELINE_CONFIGS = 'examples/aws-codepipeline/pipeline_configs.yml'
 
@@ -11,6 +12,7 @@ def main():
     '''
     anchore_engine = AnchoreEngine()
     anchore_engine.deploy_all(PIPELINE_CONFIGS)
+    metrics.dump()
     return anchore_engine
 
 if __name__ == '__main__':
@@ -0,0 +1,220 @@
+'''
+Shared pool of boto3 clients
+
+All AWS clients of the project are created here. Every request
+attempt first takes a token from a process-wide bucket per (account,
+region, service). Clients retry in botocore adaptive mode, except
+for BACKOFF_SERVICES, whose calls go through call_with_backoff and
+are retried only there. Concurrent deployments against one account
+therefore slow down instead of failing.
+'''
+import os
+import time
+import random
+import threading
+import boto3
+import botocore
+from botocore.config import Config
+import tasks.metrics as metrics
+
+RETRY_MODE = 'adaptive'
+MAX_ATTEMPTS = 10
+# services only called through call_with_backoff, botocore makes a
+# single attempt so the two retry layers do not multiply
+BACKOFF_SERVICES = ['cloudformation']
+
+# sustained requests per second per account, region and service
+DEFAULT_RATE = 10
+SERVICE_RATES = {
+    'cloudformation': 5,
+    'ec2': 20,
+    'ecr': 20,
+    's3': 100,
+    'sqs': 100
+}
+BURST_SECONDS = 1
+
+BACKOFF_BASE = 0.5
+BACKOFF_CAP = 20
+BACKOFF_ATTEMPTS = 6
+
+THROTTLING_ERROR_CODES = metrics.THROTTLING_ERROR_CODES
+TRANSIENT_STATUS_CODES = [500, 502, 503, 504]
+
+CLIENTS = {}
+LIMITERS = {}
+ACCOUNTS = {}
+CLIENTS_LOCK = threading.Lock()
+LIMITERS_LOCK = threading.Lock()
+ACCOUNTS_LOCK = threading.Lock()
+
+class TokenBucket():
+    '''
+    Client-side rate limiter shared by every thread of the process
+
+    Tokens are reserved ahead, so concurrent callers queue up in
+    order. A caller that has to wait sleeps until its token is due
+    plus a random share of one token interval, so that waiting
+    threads do not all wake up at once.
+    '''
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = capacity or max(1.0, self.rate * BURST_SECONDS)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        '''
+        Take one token, sleeping until it is available
+
+        Returns:
+            Seconds waited
+        '''
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+        if wait:
+            wait += random.uniform(0, 1 / self.rate) # nosec
+            time.sleep(wait)
+        return wait
+
+def service_rate(service):
+    '''
+    Requests per second allowed for a service, ANCHORE_AWS_RATE overrides all services
+    '''
+    return float(os.environ.get('ANCHORE_AWS_RATE') or SERVICE_RATES.get(service, DEFAULT_RATE))
+
+def get_limiter(account, region, service):
+    '''
+    Get the process-wide token bucket of an (account, region, service)
+    '''
+    key = (account, region, service)
+    with LIMITERS_LOCK:
+        if key not in LIMITERS:
+            LIMITERS[key] = TokenBucket(service_rate(service))
+        return LIMITERS[key]
+
+def caller_account(session, region):
+    '''
+    Account of a session's credentials, looked up once per access key through STS
+    '''
+    credentials = session.get_credentials()
+    access_key = credentials.access_key if credentials else None
+    with ACCOUNTS_LOCK:
+        if access_key not in ACCOUNTS:
+            sts = session.client('sts', region_name=region)
+            ACCOUNTS[access_key] = sts.get_caller_identity()['Account']
+        return ACCOUNTS[access_key]
+
+def create_client(service, region, account_id=None):
+    '''
+    Create an instrumented, rate limited boto3 client
+
+    Args:
+        service: AWS service name, e.g. cloudformation
+        region: target aws region
+        account_id: account the client talks to, when known. Otherwise
+            it is looked up through STS before the first request
+    Returns:
+        The low-level boto3 client
+    '''
+    session = boto3.session.Session()
+    attempts = 1 if service in BACKOFF_SERVICES else MAX_ATTEMPTS
+    client = session.client(
+        service,
+        region_name=region,
+        config=Config(retries={'mode': RETRY_MODE, 'total_max_attempts': attempts})
+    )
+    limiter = None
+
+    def limit(**_):
+        nonlocal limiter
+        if limiter is None:
+            account = account_id or caller_account(session, region)
+            limiter = get_limiter(str(account), region, service)
+        limiter.acquire()
+
+    client.meta.events.register('before-send', limit)
+    return metrics.instrument(client)
+
+def get_client(service, region, account_id=None):
+    '''
+    Get the shared boto3 client for a service in a region
+
+    Clients are created once per (account, region, service) and
+    reused by every stack and thread. boto3 clients are thread-safe
+    but creating them is not, so creation is serialized. Every client
+    is instrumented for API call accounting.
+
+    Args:
+        service: AWS service name, e.g. cloudformation
+        region: target aws region
+        account_id: optional account the client talks to
+    Returns:
+        The low-level boto3 client
+    '''
+    key = (account_id, region, service)
+    with CLIENTS_LOCK:
+        if key not in CLIENTS:
+            CLIENTS[key] = create_client(service, region, account_id)
+        return CLIENTS[key]
+
+def clear_clients():
+    '''
+    Drop all cached clients and rate limiters, e.g. after credentials change
+    '''
+    with CLIENTS_LOCK:
+        CLIENTS.clear()
+    with LIMITERS_LOCK:
+        LIMITERS.clear()
+    with ACCOUNTS_LOCK:
+        ACCOUNTS.clear()
+
+def is_throttling(exc):
+    '''
+    Check whether a botocore error is a throttling error
+    '''
+    return isinstance(exc, botocore.exceptions.ClientError) \
+        and exc.response.get('Error', {}).get('Code') in THROTTLING_ERROR_CODES
+
+def is_transient(exc):
+    '''
+    Check whether an error is worth retrying: throttling, a server
+    error or a failed connection
+    '''
+    if isinstance(exc, (botocore.exceptions.ConnectionError, botocore.exceptions.HTTPClientError)):
+        return True
+    if not isinstance(exc, botocore.exceptions.ClientError):
+        return False
+    status = exc.response.get('ResponseMetadata', {}).get('HTTPStatusCode')
+    return is_throttling(exc) or status in TRANSIENT_STATUS_CODES
+
+def call_with_backoff(function, *args, **kwargs):
+    '''
+    Call an AWS API, retrying transient errors with jittered backoff
+
+    Clients of BACKOFF_SERVICES make a single attempt per call, so
+    this is their only retry layer. Before each new attempt it sleeps
+    a random time up to an exponentially growing cap.
+
+    Args:
+        function: bound client method, e.g. cfn.describe_stacks
+        args, kwargs: arguments of the call
+    Returns:
+        The response of the call
+    Raises:
+        botocore.exceptions.ClientError: Any error that is not transient,
+        or a transient error after BACKOFF_ATTEMPTS attempts
+    '''
+    for attempt in range(BACKOFF_ATTEMPTS):
+        try:
+            return function(*args, **kwargs)
+        except (botocore.exceptions.ClientError, botocore.exceptions.BotoCoreError) as exc:
+            if not is_transient(exc) or attempt == BACKOFF_ATTEMPTS - 1:
+                raise
+            time.sleep(random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))) # nosec
+    return None
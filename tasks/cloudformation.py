@@ -1,9 +1,39 @@
 '''
 Deploys AWS Cloudformation Stacks
 '''
+import os
+import json
+import time
+import random
+import hashlib
+import threading
 import yaml
-import boto3
 import botocore
+import tasks.clients as clients
+
+WAITER_MIN_DELAY = 2
+WAITER_MAX_DELAY = 30
+WAITER_BACKOFF = 1.5
+WAITER_TIMEOUT = 3600
+
+UNCHANGED_STACK_STATUSES = ['CREATE_COMPLETE', 'UPDATE_COMPLETE']
+NO_CHANGES_REASONS = [
+    "The submitted information didn't contain changes.",
+    'No updates are to be performed.'
+]
+
+STACK_RESOURCE_TYPE = 'AWS::CloudFormation::Stack'
+FAILED_STACK_STATUSES = [
+    'CREATE_FAILED',
+    'ROLLBACK_IN_PROGRESS',
+    'ROLLBACK_COMPLETE',
+    'ROLLBACK_FAILED',
+    'DELETE_FAILED',
+    'UPDATE_FAILED',
+    'UPDATE_ROLLBACK_IN_PROGRESS',
+    'UPDATE_ROLLBACK_COMPLETE',
+    'UPDATE_ROLLBACK_FAILED'
+]
 
 # pylint: disable=no-member
 def load_yaml_file(yaml_file):
@@ -21,7 +51,7 @@ def load_yaml_file(yaml_file):
     try:
         # Get the configuration parameters
         file = open(yaml_file).read()
-        config = list(yaml.load_all(file))[0]
+        config = list(yaml.safe_load_all(file))[0]
 
     except Exception as exc:
         # We're expecting the user parameters to be encoded as YAML
@@ -56,7 +86,7 @@ def regional_client(config):
     Read input configuration file that contains
     stack creation arguments and parameters
     and read Region parameter to define regional
-    client to create stack
+    client to create stack. Clients are shared per region.
 
     Args:
       config: loaded yaml file to be read
@@ -69,18 +99,188 @@ def regional_client(config):
     try:
         # get the loaded yaml file and extract "Region" parameter to define cloudformation client
         region = config['region']
-        cfn = boto3.client('cloudformation', region_name=region)
+        cfn = clients.get_client('cloudformation', region)
         return cfn
     except botocore.exceptions.ClientError as exc:
         return exc
 
+def jittered(delay):
+    '''
+    Randomize a polling delay between half and all of it, so that
+    concurrent waiters do not poll the API in lockstep
+    '''
+    return random.uniform(delay / 2, delay) # nosec
+
+def template_fingerprint(template, parameters):
+    '''
+    Hash a rendered template body together with its stack parameters
+
+    Args:
+        template: The template body
+        parameters: List of Parameters from build_stack_parameters
+    Returns:
+        Hex digest identifying this exact stack input
+    '''
+    digest = hashlib.sha256(template.encode('utf-8'))
+    digest.update(json.dumps(parameters, sort_keys=True, default=str).encode('utf-8'))
+    return digest.hexdigest()
+
+class FingerprintStore():
+    '''
+    Local state file recording the fingerprint last deployed to each stack
+
+    The fingerprints are kept out of stack tags because stack tags
+    propagate to every taggable resource and would turn each
+    template change into an update of all resources.
+    '''
+    def __init__(self, state_file):
+        self.state_file = state_file
+        self.lock = threading.Lock()
+        self.fingerprints = {}
+        if os.path.exists(state_file):
+            with open(state_file, 'r') as state:
+                self.fingerprints = json.load(state)
+
+    def get(self, region, stack):
+        '''
+        Get the recorded fingerprint of a stack, or None
+        '''
+        with self.lock:
+            return self.fingerprints.get(region, {}).get(stack)
+
+    def set(self, region, stack, fingerprint):
+        '''
+        Record the fingerprint deployed to a stack and save the state file
+        '''
+        with self.lock:
+            self.fingerprints.setdefault(region, {})[stack] = fingerprint
+            temp_file = f'{self.state_file}.tmp'
+            with open(temp_file, 'w') as state:
+                json.dump(self.fingerprints, state, indent=2, sort_keys=True)
+            os.replace(temp_file, self.state_file)
+
+class StackEventWaiter():
+    '''
+    Wait for a stack operation by tailing its stack events
+
+    New events are read incrementally using the last seen event
+    id as a cursor, polling backs off while the stack is quiet,
+    and the wait fails as soon as any resource reports *_FAILED.
+    '''
+    def __init__(self, cfn, min_delay=None, max_delay=None, timeout=None):
+        self.cfn = cfn
+        self.min_delay = min_delay or WAITER_MIN_DELAY
+        self.max_delay = max_delay or WAITER_MAX_DELAY
+        self.timeout = timeout or WAITER_TIMEOUT
+
+    def latest_event_id(self, stack):
+        '''
+        Get the id of the most recent event of a stack
+
+        Args:
+            stack: The name or id of the stack
+        Returns:
+            The event id to use as a cursor, or None if there are no events
+        '''
+        response = clients.call_with_backoff(self.cfn.describe_stack_events, StackName=stack)
+        events = response['StackEvents']
+        return events[0]['EventId'] if events else None
+
+    def new_events(self, stack, cursor):
+        '''
+        Page through stack events newer than the cursor
+
+        Args:
+            stack: The name or id of the stack
+            cursor: Id of the last event already seen, or None
+        Returns:
+            List of new events, oldest first
+        '''
+        events = []
+        kwargs = {'StackName': stack}
+        while True:
+            response = clients.call_with_backoff(self.cfn.describe_stack_events, **kwargs)
+            for event in response['StackEvents']:
+                if event['EventId'] == cursor:
+                    return list(reversed(events))
+                events.append(event)
+            if 'NextToken' not in response:
+                return list(reversed(events))
+            kwargs['NextToken'] = response['NextToken']
+
+    def stream(self, stack, stack_name, cursor=None):
+        '''
+        Yield stack events as they happen
+
+        Args:
+            stack: The name or id of the stack to follow
+            stack_name: The name of the stack, used to find stack-level events
+            cursor: Id of the last event already seen, or None
+        Yields:
+            Stack events, oldest first
+        Raises:
+            Exception: If the stack does not settle before the timeout
+        '''
+        delay = self.min_delay
+        deadline = time.monotonic() + self.timeout
+        while time.monotonic() < deadline:
+            try:
+                events = self.new_events(stack, cursor)
+            except botocore.exceptions.ClientError as exc:
+                if not clients.is_throttling(exc):
+                    raise
+                print(f'{stack_name}: polling throttled, backing off')
+                events = []
+            for event in events:
+                cursor = event['EventId']
+                yield event
+            delay = self.min_delay if events else min(delay * WAITER_BACKOFF, self.max_delay)
+            time.sleep(jittered(delay))
+        raise Exception(f'Timed out waiting for CloudFormation stack "{stack_name}"')
+
+    def wait(self, stack, stack_name, success_status, cursor=None):
+        '''
+        Wait for a stack to reach the expected status
+
+        Args:
+            stack: The name or id of the stack to follow
+            stack_name: The name of the stack
+            success_status: Stack status that ends the wait, e.g. CREATE_COMPLETE
+            cursor: Id of the last event before the operation started
+        Returns:
+            The final stack-level event
+        Raises:
+            Exception: On the first failed resource or stack event
+        '''
+        for event in self.stream(stack, stack_name, cursor):
+            status = event['ResourceStatus']
+            reason = event.get('ResourceStatusReason', '')
+            print(f'{stack_name}: {event["LogicalResourceId"]} '
+                  f'({event["ResourceType"]}) {status} {reason}'.rstrip())
+
+            is_stack_event = (
+                event['ResourceType'] == STACK_RESOURCE_TYPE
+                and event['LogicalResourceId'] == stack_name
+            )
+            if is_stack_event and status == success_status:
+                return event
+            if status.endswith('_FAILED') or (is_stack_event and status in FAILED_STACK_STATUSES):
+                raise Exception(
+                    f'CloudFormation stack "{stack_name}" failed: '
+                    f'{event["LogicalResourceId"]} {status} {reason}'.rstrip()
+                )
+        return None
+
 # pylint: disable=no-else-return
 class DeploymentManager():
     '''
     Manage AWS resource deployment
     '''
-    def __init__(self, config):
+    def __init__(self, config, fingerprints=None):
+        self.region = config['region']
         self.cfn = regional_client(config)
+        self.waiter = StackEventWaiter(self.cfn, **config.get('waiter', {}))
+        self.fingerprints = fingerprints
 
     def stack_exists(self, stack):
         '''
@@ -97,7 +297,7 @@ class DeploymentManager():
             the stack doesn't exist.
         '''
         try:
-            self.cfn.describe_stacks(StackName=stack)
+            clients.call_with_backoff(self.cfn.describe_stacks, StackName=stack)
             return True
         except botocore.exceptions.ClientError as exc:
             if "does not exist" in exc.response['Error']['Message']:
@@ -118,7 +318,7 @@ class DeploymentManager():
         Raises:
              Exception: Any exception thrown by .describe_stacks()
         '''
-        stack_description = self.cfn.describe_stacks(StackName=stack)
+        stack_description = clients.call_with_backoff(self.cfn.describe_stacks, StackName=stack)
         return stack_description['Stacks'][0]['StackStatus']
 
     def create_stack(self, stack, template, parameters):
@@ -132,14 +332,14 @@ class DeploymentManager():
         Throws:
             Exception: Any exception thrown by .create_stack()
         '''
-        self.cfn.create_stack(
+        response = clients.call_with_backoff(
+            self.cfn.create_stack,
             StackName=stack,
             TemplateBody=template,
             Parameters=parameters,
             Capabilities=['CAPABILITY_IAM', 'CAPABILITY_NAMED_IAM']
         )
-        waiter = self.cfn.get_waiter('stack_create_complete')
-        waiter.wait(StackName=stack)
+        self.waiter.wait(response['StackId'], stack, 'CREATE_COMPLETE')
 
     def update_stack(self, stack, template, parameters):
         '''
@@ -157,14 +357,15 @@ class DeploymentManager():
             Exception: Any exception besides "No updates are to be performed."
         '''
         try:
-            self.cfn.update_stack(
+            cursor = self.waiter.latest_event_id(stack)
+            clients.call_with_backoff(
+                self.cfn.update_stack,
                 StackName=stack,
                 TemplateBody=template,
                 Parameters=parameters,
                 Capabilities=['CAPABILITY_IAM', 'CAPABILITY_NAMED_IAM']
             )
-            waiter = self.cfn.get_waiter('stack_update_complete')
-            waiter.wait(StackName=stack)
+            self.waiter.wait(stack, stack, 'UPDATE_COMPLETE', cursor)
             return True
 
         except botocore.exceptions.ClientError as exc:
@@ -173,6 +374,105 @@ class DeploymentManager():
             else:
                 raise Exception('Error updating CloudFormation stack "{0}"'.format(stack), exc)
 
+    def create_change_set(self, stack, template, parameters, change_set):
+        '''
+        Create a change set for an existing stack and wait until it is ready
+
+        Args:
+            stack: The stack to update
+            template: The template to apply
+            parameters: List of Parameters for the template
+            change_set: The name of the change set
+
+        Returns:
+            The list of changes, or None if the template and parameters
+            would not change the stack.
+
+        Raises:
+            Exception: If the change set could not be created
+        '''
+        clients.call_with_backoff(
+            self.cfn.create_change_set,
+            StackName=stack,
+            ChangeSetName=change_set,
+            ChangeSetType='UPDATE',
+            TemplateBody=template,
+            Parameters=parameters,
+            Capabilities=['CAPABILITY_IAM', 'CAPABILITY_NAMED_IAM']
+        )
+        delay = self.waiter.min_delay
+        deadline = time.monotonic() + self.waiter.timeout
+        while time.monotonic() < deadline:
+            description = clients.call_with_backoff(
+                self.cfn.describe_change_set, StackName=stack, ChangeSetName=change_set
+            )
+            if description['Status'] == 'CREATE_COMPLETE':
+                return self.list_changes(stack, change_set, description)
+            if description['Status'] == 'FAILED':
+                clients.call_with_backoff(
+                    self.cfn.delete_change_set, StackName=stack, ChangeSetName=change_set
+                )
+                if description.get('StatusReason') in NO_CHANGES_REASONS:
+                    return None
+                raise Exception(
+                    f'Error creating change set for CloudFormation stack "{stack}"',
+                    description.get('StatusReason')
+                )
+            time.sleep(jittered(delay))
+            delay = min(delay * WAITER_BACKOFF, self.waiter.max_delay)
+        raise Exception(f'Timed out creating change set for CloudFormation stack "{stack}"')
+
+    def list_changes(self, stack, change_set, description):
+        '''
+        Page through the changes of a change set
+
+        Args:
+            stack: The stack of the change set
+            change_set: The name of the change set
+            description: The first describe_change_set page
+        Returns:
+            List of all changes
+        '''
+        changes = list(description['Changes'])
+        while 'NextToken' in description:
+            description = clients.call_with_backoff(
+                self.cfn.describe_change_set,
+                StackName=stack,
+                ChangeSetName=change_set,
+                NextToken=description['NextToken']
+            )
+            changes.extend(description['Changes'])
+        return changes
+
+    def update_stack_with_change_set(self, stack, template, parameters, change_set):
+        '''
+        Update a stack through a change set, printing the changes first
+
+        Args:
+            stack: The stack to update
+            template: The template to apply
+            parameters: List of Parameters for the template
+            change_set: The name of the change set
+
+        Returns:
+            True if the change set was executed, false if there were no changes
+        '''
+        changes = self.create_change_set(stack, template, parameters, change_set)
+        if changes is None:
+            return False
+
+        for change in changes:
+            resource = change['ResourceChange']
+            print(f'{stack}: {resource["Action"]} {resource["LogicalResourceId"]} '
+                  f'({resource["ResourceType"]}) replacement={resource.get("Replacement", "N/A")}')
+
+        cursor = self.waiter.latest_event_id(stack)
+        clients.call_with_backoff(
+            self.cfn.execute_change_set, StackName=stack, ChangeSetName=change_set
+        )
+        self.waiter.wait(stack, stack, 'UPDATE_COMPLETE', cursor)
+        return True
+
     def delete_stack(self, stack):
         '''
         Delete existing stack based on stackname and status
@@ -182,17 +482,27 @@ class DeploymentManager():
 
         Args:
          stack_name: The name of the stack to delete
+
+        Returns:
+            True if the stack was deleted, false if it did not exist
         '''
         try:
-            self.cfn.delete_stack(StackName=stack)
+            # Follow events by stack id, the name no longer resolves once deleted
+            stack_id = clients.call_with_backoff(
+                self.cfn.describe_stacks, StackName=stack
+            )['Stacks'][0]['StackId']
+            cursor = self.waiter.latest_event_id(stack_id)
+            clients.call_with_backoff(self.cfn.delete_stack, StackName=stack)
             print('Deleting stack:- ' + stack)
-            waiter = self.cfn.get_waiter('stack_delete_complete')
-            waiter.wait(StackName=stack)
+            self.waiter.wait(stack_id, stack, 'DELETE_COMPLETE', cursor)
             return True
 
         except botocore.exceptions.ClientError as exc:
             if exc.response['Error']['Message'] == 'No stacks deletion performed.':
                 return False
+            elif 'does not exist' in exc.response['Error']['Message']:
+                print('Stack does not exist:- ' + stack)
+                return False
             else:
                 raise Exception('Error deleting CloudFormation stack "{0}"'.format(stack), exc)
 
@@ -202,12 +512,23 @@ class DeploymentManager():
 
         If the stack exists then update, otherwise create.
 
+        When a FingerprintStore is given, stacks whose template and
+        parameters match the recorded fingerprint are skipped and
+        changed stacks are updated through a change set.
+
         Args:
             stack_name: The name of stack to create or update
             template: The template to create or update the stack with
+        Raises:
+            Exception: If the stack exists in a status that cannot be updated
         '''
+        fingerprint = template_fingerprint(template, parameters)
         if self.stack_exists(stack):
             status = self.get_stack_status(stack)
+            if self.fingerprints is not None and status in UNCHANGED_STACK_STATUSES \
+                    and self.fingerprints.get(self.region, stack) == fingerprint:
+                print('Stack template and parameters unchanged, skipping update')
+                return
             if status not in [
                     'CREATE_COMPLETE',
                     'ROLLBACK_COMPLETE',
@@ -216,9 +537,15 @@ class DeploymentManager():
                 ]:
                 # If the CloudFormation stack is not in a state where
                 # it can be updated again then fail the job right away.
-                print('Stack cannot be updated when status is: ' + status)
-                return
-            resource_updates = self.update_stack(stack, template, parameters)
+                raise Exception(f'Stack "{stack}" cannot be updated when status is: {status}')
+            if self.fingerprints is not None:
+                resource_updates = self.update_stack_with_change_set(
+                    stack, template, parameters, f'{stack}-{fingerprint[:12]}-{int(time.time())}'
+                )
+            else:
+                resource_updates = self.update_stack(stack, template, parameters)
+            if self.fingerprints is not None:
+                self.fingerprints.set(self.region, stack, fingerprint)
             if resource_updates:
                 # If there were updates then continue and succeed with progress of the update.
                 print('Stack updated')
@@ -228,5 +555,7 @@ class DeploymentManager():
         else:
             # If the stack doesn't already exist then create it instead of updating it.
             self.create_stack(stack, template, parameters)
+            if self.fingerprints is not None:
+                self.fingerprints.set(self.region, stack, fingerprint)
             # Continue the job so the pipeline will wait for the CloudFormation stack to be created.
             print('Stack creation started....')
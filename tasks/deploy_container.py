@@ -1,56 +1,143 @@
 '''
 Manage AWS ECR Resources and Stacks
 '''
+import os
+import time
 import traceback
+from concurrent.futures import ThreadPoolExecutor
 from tasks.cloudformation import load_yaml_file
-import ecr_deployer as ecr
+import tasks.clients as clients
+import tasks.ecr_deployer as ecr
 
 print('Loading function ....')
 
-def main(configs):
+MAX_WORKERS = 4
+
+def read_image_configs(setup_data):
     '''
-    Deploy AWS ECR resources
+    Flatten the image entries of the ECR deployment configuration
+
+    An entry either describes one image itself (remote_image, tag,
+    dockerfile_path, dockerfile) or lists several under images,
+    sharing the entry's region and account_id.
+
+    Args:
+        setup_data: parsed ECR configuration file
+    Returns:
+        List of image configurations, each with its region and account_id
     '''
-    setup_data = load_yaml_file(configs)
+    images = []
+    for single_setup_data in setup_data:
+        entries = single_setup_data.get('images', [single_setup_data])
+        for image in entries:
+            if 'remote_image' not in image:
+                continue
+            image = dict(image)
+            image.setdefault('region', single_setup_data['region'])
+            image.setdefault('account_id', single_setup_data.get('account_id'))
+            images.append(image)
+    return images
 
-    try:
-        for single_setup_data in setup_data:
+def registry_key(image):
+    '''
+    Registry an image is pushed to
+    '''
+    account_id = image['account_id'] or clients.get_client(
+        'sts', image['region']
+    ).get_caller_identity()['Account']
+    return (str(account_id), image['region'])
 
-        # declare variables
-            ecr_image = single_setup_data['remote_image']
-            tag = single_setup_data['tag']
+def deploy_image(deployer, auth_config, image):
+    '''
+    Build one image and push or retag it
 
-        # Extract region to deploy container
-            container_region = single_setup_data['region']
-            print(f'Region to deploy container images = {container_region}')
+    Unless cache_tag is null, the image built last time is pulled
+    from its cache_tag (buildcache by default) and used as a cache
+    source next to any cache_from images, and the new image is
+    pushed to that tag for the next build.
 
-        # Extract registry account to deploy container images
-            account_id = single_setup_data['account_id']
-            print(f'Registry account to deploy container images = {account_id}')
+    Args:
+        deployer: ECRDeployer of the image registry
+        auth_config: registry credentials shared by all pushes
+        image: image configuration
+    Returns:
+        PushProgress of the finished push
+    '''
+    cache_from = list(image.get('cache_from', []))
+    cache_tag = image.get('cache_tag', ecr.BUILD_CACHE_TAG)
+    if cache_tag and deployer.pull_image(image['remote_image'], cache_tag, auth_config):
+        cache_from.append(f'{deployer.remote_repository(image["remote_image"])}:{cache_tag}')
 
-        # Get ECR authentication token for logins
-            login = ecr.ECRDeployer(single_setup_data)
+    print(f'Building {image["remote_image"]}:{image["tag"]}')
+    local_image = deployer.build_image(
+        image['dockerfile_path'],
+        f'{image["remote_image"]}:{image["tag"]}',
+        image['dockerfile'],
+        cache_from
+    )
+    progress = deployer.publish_image(local_image, image['remote_image'], image['tag'], auth_config)
+    if cache_tag:
+        deployer.publish_image(local_image, image['remote_image'], cache_tag, auth_config)
+    return progress
 
-        # Login to ECR
-            print('Logging in to Amazon ECR...')
-            auth_conf = login.ecr_login()
+def deploy_images(images, max_workers=MAX_WORKERS, deployer_factory=ecr.ECRDeployer):
+    '''
+    Build and push images concurrently
 
-        # Build image
-            local_image = login.build_image(
-                single_setup_data['dockerfile_path'],
-                tag,
-                single_setup_data['dockerfile']
-            )
+    Every registry gets one ECRDeployer and one ECR login shared by
+    all of its images, then up to max_workers images are built and
+    pushed at once.
 
-        # Tag image
-            tag_response = login.tag_image(local_image, ecr_image, tag)
-            print(tag_response)
+    Returns:
+        Dictionary of image to PushProgress, or to the raised exception
+    '''
+    deployers = {}
+    auth_configs = {}
+    for image in images:
+        key = registry_key(image)
+        image['account_id'] = key[0]
+        if key not in deployers:
+            print(f'Logging in to Amazon ECR {key[0]} in {key[1]}...')
+            deployers[key] = deployer_factory({'account_id': key[0], 'region': key[1]})
+            auth_configs[key] = deployers[key].ecr_login()
+
+    def deploy(image):
+        key = (image['account_id'], image['region'])
+        try:
+            return deploy_image(deployers[key], auth_configs[key], image)
+        except Exception as exc: # pylint: disable=broad-except
+            print(f'Deploying {image["remote_image"]}:{image["tag"]} failed. {exc}')
+            return exc
+
+    start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(images)))) as executor:
+        results = dict(zip(
+            [f'{image["remote_image"]}:{image["tag"]}' for image in images],
+            executor.map(deploy, images)
+        ))
+    elapsed = time.monotonic() - start
+
+    pushed = [result for result in results.values() if isinstance(result, ecr.PushProgress)]
+    total = sum(result.bytes_pushed for result in pushed)
+    print(f'Pushed {len(pushed)} of {len(images)} images, {total} bytes in {elapsed:.1f}s'
+          f' ({total / max(elapsed, 0.001) / 1048576:.1f} MiB/s)')
+    return results
+
+def main(configs, max_workers=None):
+    '''
+    Deploy AWS ECR resources
 
-        # Push image
-            push_response = login.push_image(ecr_image, tag, auth_conf)
-            print(push_response)
+    The number of concurrent builds defaults to ECR_MAX_WORKERS or MAX_WORKERS.
+    '''
+    setup_data = load_yaml_file(configs)
+    max_workers = max_workers or int(os.environ.get('ECR_MAX_WORKERS', MAX_WORKERS))
 
-        print('Container Images Deployment Successful!!!')
+    try:
+        results = deploy_images(read_image_configs(setup_data), max_workers)
+        if all(isinstance(result, ecr.PushProgress) for result in results.values()):
+            print('Container Images Deployment Successful!!!')
+        else:
+            print('Container Images Deployment Failed!!!')
 
     except Exception as exc: # pylint: disable=broad-except
         print(f'Function failed due to exception. {exc}')
@@ -2,47 +2,171 @@
 Deploys cloudformation stacks
 '''
 import traceback
+from concurrent.futures import ThreadPoolExecutor
 import tasks.cloudformation as cfn
+import tasks.stack_graph as graph
+import tasks.stack_outputs as outputs
 
 print('Loading function ....')
 
-def deploy_stack(configs):
+def read_stack_config(single_setup_data):
+    '''
+    Read a single stack configuration and its template body
+
+    Args:
+        single_setup_data: one entry of the deployment configuration file
+    Returns:
+        Dictionary describing the stack to deploy
+    '''
+    # Extract region and environemnt to deploy stack
+    environment = single_setup_data['parameters']['Environment']
+
+    # Extract resource name and region and create a stack name
+    resource_name = single_setup_data['resource_name']
+
+    # Extract the template file to create stack
+    with open(single_setup_data['template_file'], 'r') as template:
+        template_body = template.read()
+
+    return {
+        'stack_name': environment+'-'+resource_name,
+        'environment': environment,
+        'region': single_setup_data['region'],
+        'template_file': single_setup_data['template_file'],
+        'template_body': template_body,
+        'parameters': single_setup_data['parameters'],
+        'setup_data': single_setup_data
+    }
+
+def deploy_single_stack(stack, fingerprints=None):
+    '''
+    Create or update one stack and wait for it to complete
+
+    ${Stack.Output} references in its parameters are resolved from
+    the shared output registry first, and the cached outputs of the
+    region are invalidated once the stack is deployed.
+
+    Args:
+        stack: stack description returned by read_stack_config
+        fingerprints: optional FingerprintStore to skip unchanged stacks
+    '''
+    print(f'Environment to deploy resource = {stack["environment"]}')
+    print('Stack name for deployed resource = ' + stack['stack_name'])
+    print(f'Template file used to deploy resource = {stack["template_file"]}')
+
+    # Extract the input parameters to create or update stack
+    parameters = outputs.REGISTRY.resolve_parameters(stack['parameters'], stack['region'])
+    parameter_values = cfn.build_stack_parameters(parameters)
+    print(f'Parameter key-value for resource stack = {parameter_values}')
+
+    # Deploy Stack
+    print('provisioning resources.......')
+    stacks = cfn.DeploymentManager(stack['setup_data'], fingerprints)
+    try:
+        stacks.create_or_update_stack(stack['stack_name'], stack['template_body'], parameter_values)
+    finally:
+        outputs.REGISTRY.invalidate(stack['region'])
+    print(f'Stack {stack["stack_name"]} Deployment Complete!!!')
+
+def group_by_region(stacks):
+    '''
+    Group stack descriptions by their target region
+
+    The same stack name may be deployed to several regions,
+    so stacks are only unique within a region.
+
+    Args:
+        stacks: list of stack descriptions
+    Returns:
+        Dictionary of region to a dictionary of stack name to stack description
+    '''
+    regions = {}
+    for stack in stacks:
+        regions.setdefault(stack['region'], {})[stack['stack_name']] = stack
+    return regions
+
+def add_reference_dependencies(dependencies, stacks):
+    '''
+    Make stacks depend on the stacks their ${Stack.Output} parameters reference
+
+    Args:
+        dependencies: dependency graph from build_dependency_graph, updated in place
+        stacks: dictionary of stack name to stack description
+    Returns:
+        The updated dependency graph
+    '''
+    for stack_name, stack in stacks.items():
+        for reference in outputs.stack_references(stack['parameters']):
+            for name in (reference, f'{stack["environment"]}-{reference}'):
+                if name in stacks and name != stack_name:
+                    dependencies[stack_name].add(name)
+    return dependencies
+
+def deploy_region(region, stacks, max_workers, fingerprints=None):
+    '''
+    Deploy the stacks of one region in dependency order
+
+    Args:
+        region: target aws region
+        stacks: dictionary of stack name to stack description
+        max_workers: maximum number of stacks deployed at once in the region
+        fingerprints: optional FingerprintStore to skip unchanged stacks
+    Returns:
+        Dictionary of stack name to deployment result
+    '''
+    print(f'Region to deploy resource = {region}')
+    dependencies = add_reference_dependencies(graph.build_dependency_graph(stacks), stacks)
+    for stack_name, depends_on in dependencies.items():
+        print(f'Stack {stack_name} depends on {sorted(depends_on)}')
+
+    return graph.run_graph(
+        dependencies,
+        lambda stack_name: deploy_single_stack(stacks[stack_name], fingerprints),
+        max_workers
+    )
+
+def deploy_stack(configs, max_workers=graph.MAX_WORKERS, state_file=None):
     '''
     Get deployment configurations and deploy stacks
+
+    Config entries are grouped by region and all regions are
+    deployed concurrently. Within a region, stacks are ordered by
+    the exports they import from each other and every stack whose
+    dependencies are deployed is launched, up to max_workers at a time.
+
+    When a state_file is given, stacks whose template and parameters
+    are unchanged since the last deployment are skipped and changed
+    stacks are updated through change sets.
     '''
     setup_data = cfn.load_yaml_file(configs)
     print('Listing configuration to setup Stacks in specified regions.......')
 
     try:
-        for single_setup_data in setup_data:
-
-        # Extract region and environemnt to deploy stack
-            stack_region = single_setup_data['region']
-            environment = single_setup_data['parameters']['Environment']
-            print(f'Region to deploy resource = {stack_region}')
-            print(f'Environment to deploy resource = {environment}')
-
-        # Extract resource name and region and create a stack name
-            resource_name = single_setup_data['resource_name']
-            stack_name = environment+'-'+resource_name
-            print('Stack name for deployed resource = ' + stack_name)
-
-        # Extract the template file to create stack
-            template_file = single_setup_data['template_file']
-            with open(template_file, 'r') as template:
-                template_body = template.read()
-            print(f'Template file used to deploy resource = {template_file}')
-
-        # Extract the input parameters to create or update stack
-            parameter_values = cfn.build_stack_parameters(single_setup_data['parameters'])
-            print(f'Parameter key-value for resource stack = {parameter_values}')
-
-        # Deploy Stack
-            print('provisioning resources.......')
-            stacks = cfn.DeploymentManager(single_setup_data)
-            stacks.create_or_update_stack(stack_name, template_body, parameter_values)
-            print('Stack Deployment Complete!!!')
+        fingerprints = cfn.FingerprintStore(state_file) if state_file else None
+        regions = group_by_region(
+            [read_stack_config(single_setup_data) for single_setup_data in setup_data]
+        )
+        with ThreadPoolExecutor(max_workers=len(regions) or 1) as executor:
+            futures = {
+                region: executor.submit(
+                    deploy_region, region, region_stacks, max_workers, fingerprints
+                )
+                for region, region_stacks in regions.items()
+            }
+            results = {region: future.result() for region, future in futures.items()}
 
+        for region, region_results in results.items():
+            for stack_name, result in region_results.items():
+                print(f'Stack {stack_name} in {region} = {result}')
+
+        if all(
+                result == graph.SUCCEEDED
+                for region_results in results.values()
+                for result in region_results.values()
+            ):
+            print('Stack Deployment Complete!!!')
+        else:
+            print('Stack Deployment Failed!!!')
 
     except Exception as error: # pylint: disable=broad-except
 
@@ -1,10 +1,76 @@
 '''
 Manage ECR deployment and Resources
 '''
+import time
+import json
 import base64
-import boto3
 import docker
 import botocore
+import tasks.clients as clients
+
+# batch_get_image accepts at most 100 image ids per call
+IMAGE_BATCH_SIZE = 100
+
+# Tag in each repository holding the layer cache of its last build
+BUILD_CACHE_TAG = 'buildcache'
+
+# batch_check_layer_availability accepts at most 100 layer digests per call
+LAYER_BATCH_SIZE = 100
+
+class PushProgress():
+    '''
+    Per-layer progress of a docker push read from its output stream
+    '''
+    def __init__(self, image):
+        self.image = image
+        self.layers = {}
+        self.existing = set()
+        self.digest = None
+        self.retagged = False
+        self.started = time.monotonic()
+        self.seconds = 0.0
+
+    @property
+    def bytes_pushed(self):
+        '''
+        Bytes uploaded for layers that were not already in the registry
+        '''
+        return sum(self.layers.values())
+
+    def update(self, chunk):
+        '''
+        Record one decoded line of the push output
+
+        Raises:
+            docker.errors.APIError: If the registry rejected the push
+        '''
+        if 'error' in chunk:
+            raise docker.errors.APIError(f'Push of {self.image} failed. {chunk["error"]}')
+        layer = chunk.get('id')
+        status = chunk.get('status', '')
+        if status == 'Pushing' and layer:
+            current = chunk.get('progressDetail', {}).get('current')
+            if current:
+                self.layers[layer] = max(self.layers.get(layer, 0), current)
+        elif status == 'Pushed' and layer:
+            print(f'{self.image} layer {layer} pushed, {self.layers.get(layer, 0)} bytes')
+        elif status == 'Layer already exists' and layer:
+            self.existing.add(layer)
+        if 'aux' in chunk and 'Digest' in chunk['aux']:
+            self.digest = chunk['aux']['Digest']
+
+    def finish(self):
+        '''
+        Stop the clock once the push stream is exhausted
+        '''
+        self.seconds = time.monotonic() - self.started
+        if self.retagged:
+            print(f'{self.image} already in the registry as {self.digest}, retagged only')
+            return self
+        print(f'{self.image} pushed as {self.digest}, {len(self.layers)} layers uploaded,'
+              f' {len(self.existing)} already present, {self.bytes_pushed} bytes'
+              f' in {self.seconds:.1f}s')
+        return self
 
 class ECRDeployer():
     '''
@@ -13,8 +79,43 @@ class ECRDeployer():
     def __init__(self, config):
         self.region = config['region']
         self.account_id = config['account_id']
-        self.ecr = boto3.client('ecr', region_name=self.region)
-        self.docker_api = docker.APIClient(base_url='unix://var/run/docker.sock')
+        self.ecr = clients.get_client('ecr', self.region, self.account_id)
+        self._docker_api = None
+
+    @property
+    def docker_api(self):
+        '''
+        Docker API client, connected on first use so registry
+        lookups work on hosts without a docker daemon
+        '''
+        if self._docker_api is None:
+            self._docker_api = docker.APIClient(base_url='unix://var/run/docker.sock')
+        return self._docker_api
+
+    def image_digests(self, repository, tags):
+        '''
+        Resolve image tags in a repository to their manifest digests
+
+        Args:
+            repository: ECR repository name
+            tags: image tags to resolve
+        Returns:
+            Dictionary of tag to digest, tags that do not exist are left out
+        '''
+        digests = {}
+        tags = list(tags)
+        for start in range(0, len(tags), IMAGE_BATCH_SIZE):
+            response = self.ecr.batch_get_image(
+                registryId=self.account_id,
+                repositoryName=repository,
+                imageIds=[{'imageTag': tag} for tag in tags[start:start + IMAGE_BATCH_SIZE]]
+            )
+            for image in response['images']:
+                digests[image['imageId']['imageTag']] = image['imageId']['imageDigest']
+            for failure in response['failures']:
+                print(f'Could not resolve {repository}:{failure["imageId"].get("imageTag")}'
+                      f' = {failure["failureCode"]}')
+        return digests
 
     def get_ecr_creds(self):
         '''
@@ -64,26 +165,72 @@ class ECRDeployer():
         auth_config_payload = {'username': username, 'password': password}
         return auth_config_payload
 
-    def build_image(self, dockerfile_path, tag, dockerfile):
+    def remote_repository(self, ecr_image):
+        '''
+        Full name of a repository in this registry
+        '''
+        return f'{self.account_id}.dkr.ecr.{self.region}.amazonaws.com/{ecr_image}'
+
+    def pull_image(self, ecr_image, tag, auth_config):
+        '''
+        Pull an image from a repository, e.g. the build cache of the
+        previous build
+
+        Returns:
+            True if the image was pulled, False if it is not available
+        '''
+        try:
+            for chunk in self.docker_api.pull(
+                    self.remote_repository(ecr_image),
+                    tag=tag,
+                    stream=True,
+                    auth_config=auth_config,
+                    decode=True):
+                if 'error' in chunk:
+                    print(f'Could not pull {ecr_image}:{tag}. {chunk["error"]}')
+                    return False
+            return True
+        except docker.errors.APIError as error:
+            print(f'Could not pull {ecr_image}:{tag}. {error}')
+            return False
+
+    def build_image(self, dockerfile_path, tag, dockerfile, cache_from=None):
         '''
         Build an image using a Dockerfile
 
+        The build output is consumed until the build finishes, so
+        the image exists when this returns. With cache_from, layers
+        of the given images, which must have been pulled, are reused.
+
         Args:
             dockerfile_path (str) – Path to the directory containing the Dockerfile
             tag (str) – A tag to add to the final image
             dockerfile (str) – path within the build context to the Dockerfile
+            cache_from (list) – images to use as cache sources
 
         Returns:
-            Image object for the image that was built
+            ID of the image that was built
 
         Raises:
+            docker.errors.BuildError - if the build fails
             docker.error.APIerror - if the server returns an error
         '''
-        local_image = self.docker_api.build(
-            path=dockerfile_path,
-            tag=tag,
-            dockerfile=dockerfile
-        )
+        build_log = []
+        local_image = tag
+        options = {}
+        if cache_from:
+            options['cache_from'] = cache_from
+        for chunk in self.docker_api.build(
+                path=dockerfile_path,
+                tag=tag,
+                dockerfile=dockerfile,
+                decode=True,
+                **options):
+            build_log.append(chunk)
+            if 'error' in chunk:
+                raise docker.errors.BuildError(chunk['error'], build_log)
+            if 'aux' in chunk and 'ID' in chunk['aux']:
+                local_image = chunk['aux']['ID']
         return local_image
 
     def tag_image(self, local_image, ecr_image, tag):
@@ -102,38 +249,152 @@ class ECRDeployer():
         Raises:
             docker.error.APIerror - if the server returns an error
         '''
-        remote_repository = f'{self.account_id}.dkr.ecr.{self.region}.amazonaws.com/{ecr_image}'
+        remote_repository = self.remote_repository(ecr_image)
         self.docker_api.tag(local_image, remote_repository, tag, force=True)
         return remote_repository
 
     def push_image(self, ecr_image, tag, auth_config):
         '''
-        Push an image into a repository
+        Push an image into a repository and wait for the push to finish
 
         Args:
-            account_id: AWS account ID
-            local_image: Name of built image to be pushed to repository
             ecr_image: AWS ECR remote repository name
             tag: Tag for image to be pushed
+            auth_config: registry credentials returned by ecr_login
 
         Returns:
-            True if successful
+            PushProgress of the finished push
 
         Raises:
-            docker.error.APIerror - if the server returns an error
+            docker.errors.APIError - if the server or the registry returns an error
         '''
-        try:
-
-            tagged_image = f'{self.account_id}.dkr.ecr.{self.region}.amazonaws.com/{ecr_image}'
-            print(tagged_image)
-            status = self.docker_api.push(
+        tagged_image = self.remote_repository(ecr_image)
+        print(f'Pushing {tagged_image}:{tag}')
+        progress = PushProgress(f'{tagged_image}:{tag}')
+        for chunk in self.docker_api.push(
                 tagged_image,
                 tag=tag,
                 stream=True,
                 auth_config=auth_config,
-                decode=True
+                decode=True):
+            progress.update(chunk)
+        return progress.finish()
+
+    def pushed_digests(self, local_image):
+        '''
+        Manifest digests a local image was pushed to or pulled from
+        in this registry
+
+        Returns:
+            List of (repository, digest)
+        '''
+        registry = self.remote_repository('')
+        digests = []
+        for repo_digest in self.docker_api.inspect_image(local_image).get('RepoDigests') or []:
+            name, _, digest = repo_digest.partition('@')
+            if name.startswith(registry) and digest:
+                digests.append((name[len(registry):], digest))
+        return digests
+
+    def get_manifest(self, ecr_image, digest):
+        '''
+        Fetch the manifest of an image, which also tells whether it exists
+
+        Returns:
+            Tuple of the manifest and its media type, or None if the
+            image or the repository does not exist
+        '''
+        try:
+            images = self.ecr.batch_get_image(
+                registryId=self.account_id,
+                repositoryName=ecr_image,
+                imageIds=[{'imageDigest': digest}]
+            )['images']
+        except botocore.exceptions.ClientError as error:
+            if error.response['Error']['Code'] == 'RepositoryNotFoundException':
+                return None
+            raise
+        if not images:
+            return None
+        return images[0]['imageManifest'], images[0].get('imageManifestMediaType')
+
+    def missing_layers(self, ecr_image, layer_digests):
+        '''
+        Find the layers a repository does not hold yet
+
+        Args:
+            ecr_image: AWS ECR remote repository name
+            layer_digests: blob digests of the image layers and config
+        Returns:
+            List of layer digests that would have to be uploaded
+        '''
+        missing = []
+        for start in range(0, len(layer_digests), LAYER_BATCH_SIZE):
+            response = self.ecr.batch_check_layer_availability(
+                registryId=self.account_id,
+                repositoryName=ecr_image,
+                layerDigests=layer_digests[start:start + LAYER_BATCH_SIZE]
             )
-            return status
-        except Exception as error: # pylint: disable=broad-except
-            return error
-    
\ No newline at end of file
+            missing.extend(
+                layer['layerDigest'] for layer in response['layers']
+                if layer['layerAvailability'] != 'AVAILABLE'
+            )
+            missing.extend(failure['layerDigest'] for failure in response['failures'])
+        return missing
+
+    def put_manifest(self, ecr_image, tag, manifest, media_type=None):
+        '''
+        Tag an existing manifest without uploading anything
+        '''
+        options = {'imageManifestMediaType': media_type} if media_type else {}
+        try:
+            self.ecr.put_image(
+                registryId=self.account_id,
+                repositoryName=ecr_image,
+                imageManifest=manifest,
+                imageTag=tag,
+                **options
+            )
+        except botocore.exceptions.ClientError as error:
+            # the tag already points at this manifest
+            if error.response['Error']['Code'] != 'ImageAlreadyExistsException':
+                raise
+
+    def publish_image(self, local_image, ecr_image, tag, auth_config):
+        '''
+        Make a built image available as ecr_image:tag, uploading as
+        little as possible
+
+        If the image manifest is already in the repository, it is only
+        retagged. If it was pushed to another repository of the registry
+        and every layer is already in this one, the manifest is copied.
+        Otherwise the image is pushed, and docker uploads only the layers
+        the registry does not have.
+
+        Returns:
+            PushProgress of the retag or push
+        '''
+        for repository, digest in self.pushed_digests(local_image):
+            found = self.get_manifest(repository, digest)
+            if found is None:
+                continue
+            manifest, media_type = found
+            if repository != ecr_image:
+                document = json.loads(manifest)
+                if 'layers' not in document:
+                    continue
+                layers = [document['config']['digest']] + [
+                    layer['digest'] for layer in document['layers']
+                ]
+                missing = self.missing_layers(ecr_image, layers)
+                if missing:
+                    print(f'{ecr_image} is missing {len(missing)} of {len(layers)} layers')
+                    continue
+            self.put_manifest(ecr_image, tag, manifest, media_type)
+            progress = PushProgress(f'{self.remote_repository(ecr_image)}:{tag}')
+            progress.digest = digest
+            progress.retagged = True
+            return progress.finish()
+
+        self.tag_image(local_image, ecr_image, tag)
+        return self.push_image(ecr_image, tag, auth_config)
@@ -1,7 +1,7 @@
 '''
 Manage EC2 key-pair deployment and Resources
 '''
-import boto3
+import tasks.clients as clients
 
 def create_keypair(region, keyname):
     '''
@@ -16,7 +16,7 @@ def create_keypair(region, keyname):
         Any exceptions raised
 
     '''
-    ec2 = boto3.client('ec2', region_name=region)
+    ec2 = clients.get_client('ec2', region)
     res = ec2.create_key_pair(KeyName=keyname)
     return res['KeyMaterial']
 
@@ -33,6 +33,6 @@ def delete_keypair(region, keyname):
         Any exceptions raised
 
     '''
-    ec2 = boto3.client('ec2', region_name=region)
+    ec2 = clients.get_client('ec2', region)
     ec2.delete_key_pair(KeyName=keyname)
     return True
@@ -0,0 +1,256 @@
+'''
+Account for the AWS API calls made by the project
+
+Every boto3 client created by the project is instrumented with
+botocore event hooks. Calls, retries, throttled attempts, errors
+and a latency histogram are recorded per service, region and
+operation, and dumped as a text table at the end of a run and,
+optionally, as CloudWatch embedded metric format (EMF) records.
+'''
+import os
+import sys
+import json
+import time
+import threading
+from collections import deque
+
+# latency histogram bucket upper bounds, in milliseconds
+LATENCY_BUCKETS = [10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000]
+# EMF accepts at most 100 values per metric
+LATENCY_SAMPLES = 100
+
+EMF_NAMESPACE = 'AnchoreEngineDeployment'
+EMF_DIMENSIONS = [['Service', 'Operation'], ['Service', 'Region', 'Operation']]
+
+THROTTLING_ERROR_CODES = [
+    'Throttling',
+    'ThrottlingException',
+    'ThrottledException',
+    'RequestThrottledException',
+    'TooManyRequestsException',
+    'ProvisionedThroughputExceededException',
+    'TransactionInProgressException',
+    'RequestLimitExceeded',
+    'BandwidthLimitExceeded',
+    'LimitExceededException',
+    'RequestThrottled',
+    'SlowDown',
+    'EC2ThrottledException'
+]
+
+class OperationStats():
+    '''
+    Counters and latency histogram of one operation
+    '''
+    def __init__(self):
+        self.calls = 0
+        self.retries = 0
+        self.throttles = 0
+        self.errors = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+        self.histogram = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.samples = deque(maxlen=LATENCY_SAMPLES)
+
+    def add_latency(self, milliseconds):
+        '''
+        Record the latency of one call, retries included
+        '''
+        self.latency_total += milliseconds
+        self.latency_max = max(self.latency_max, milliseconds)
+        self.samples.append(round(milliseconds, 3))
+        for index, bound in enumerate(LATENCY_BUCKETS):
+            if milliseconds <= bound:
+                self.histogram[index] += 1
+                return
+        self.histogram[-1] += 1
+
+    def percentile(self, fraction):
+        '''
+        Approximate a latency percentile by its histogram bucket bound
+
+        Returns:
+            The upper bound in milliseconds, or the maximum for the last bucket
+        '''
+        wanted = fraction * sum(self.histogram)
+        seen = 0
+        for index, count in enumerate(self.histogram):
+            seen += count
+            if count and seen >= wanted:
+                return LATENCY_BUCKETS[index] if index < len(LATENCY_BUCKETS) else self.latency_max
+        return 0
+
+class CallMetrics():
+    '''
+    Process-wide registry of per-operation AWS call statistics
+    '''
+    def __init__(self):
+        self.operations = {}
+        self.lock = threading.Lock()
+
+    def stats(self, service, region, operation):
+        '''
+        Get the statistics of an operation, creating them on first use
+        '''
+        key = (service, region, operation)
+        if key not in self.operations:
+            self.operations[key] = OperationStats()
+        return self.operations[key]
+
+    def instrument(self, client):
+        '''
+        Register the accounting hooks on a boto3 client
+
+        before-call starts the clock of an operation, needs-retry
+        sees every attempt and after-call, or after-call-error for
+        connection failures, records the finished call.
+
+        Args:
+            client: boto3 client
+        Returns:
+            The same client
+        '''
+        service = client.meta.service_model.service_name
+        region = client.meta.region_name
+
+        def before_call(model, context, **_):
+            context['metrics_operation'] = model.name
+            context['metrics_started'] = time.monotonic()
+
+        def needs_retry(response, request_dict, **_):
+            if response is None:
+                return
+            code = response[1].get('Error', {}).get('Code')
+            if code in THROTTLING_ERROR_CODES:
+                context = request_dict.get('context', {})
+                with self.lock:
+                    self.stats(service, region, context.get('metrics_operation')).throttles += 1
+
+        def finish(context, parsed=None):
+            if 'metrics_started' not in context:
+                return
+            milliseconds = (time.monotonic() - context.pop('metrics_started')) * 1000
+            metadata = (parsed or {}).get('ResponseMetadata', {})
+            with self.lock:
+                stats = self.stats(service, region, context['metrics_operation'])
+                stats.calls += 1
+                stats.retries += metadata.get('RetryAttempts', 0)
+                if parsed is None or 'Error' in parsed:
+                    stats.errors += 1
+                stats.add_latency(milliseconds)
+
+        def after_call(parsed, context, **_):
+            finish(context, parsed)
+
+        def after_call_error(context, **_):
+            finish(context)
+
+        events = client.meta.events
+        events.register_first('before-call', before_call)
+        events.register_first('needs-retry', needs_retry)
+        events.register_first('after-call', after_call)
+        events.register_first('after-call-error', after_call_error)
+        return client
+
+    def reset(self):
+        '''
+        Forget all recorded calls
+        '''
+        with self.lock:
+            self.operations.clear()
+
+    def summary_lines(self):
+        '''
+        Format the recorded calls as a table, busiest operations first
+        '''
+        with self.lock:
+            operations = sorted(self.operations.items(), key=lambda item: -item[1].calls)
+        totals = [sum(getattr(stats, name) for _, stats in operations)
+                  for name in ('calls', 'retries', 'throttles', 'errors')]
+        lines = [f'AWS API calls: {totals[0]} calls, {totals[1]} retries,'
+                 f' {totals[2]} throttled, {totals[3]} errors']
+        if not operations:
+            return lines
+        lines.append(f'  {"service":<16} {"region":<14} {"operation":<34} {"calls":>6}'
+                     f' {"retries":>7} {"throttled":>9} {"errors":>6}'
+                     f' {"avg ms":>8} {"p50 ms":>8} {"p99 ms":>8} {"max ms":>8}')
+        for (service, region, operation), stats in operations:
+            average = stats.latency_total / stats.calls if stats.calls else 0
+            lines.append(
+                f'  {service:<16} {str(region):<14} {str(operation):<34} {stats.calls:>6}'
+                f' {stats.retries:>7} {stats.throttles:>9} {stats.errors:>6}'
+                f' {average:>8.1f} {stats.percentile(0.5):>8.0f} {stats.percentile(0.99):>8.0f}'
+                f' {stats.latency_max:>8.1f}'
+            )
+        return lines
+
+    def emf_records(self, namespace=EMF_NAMESPACE):
+        '''
+        Convert the recorded calls into CloudWatch EMF records
+
+        Returns:
+            One EMF dictionary per service, region and operation
+        '''
+        timestamp = int(time.time() * 1000)
+        records = []
+        with self.lock:
+            for (service, region, operation), stats in sorted(self.operations.items(), key=str):
+                records.append({
+                    '_aws': {
+                        'Timestamp': timestamp,
+                        'CloudWatchMetrics': [{
+                            'Namespace': namespace,
+                            'Dimensions': EMF_DIMENSIONS,
+                            'Metrics': [
+                                {'Name': 'Calls', 'Unit': 'Count'},
+                                {'Name': 'Retries', 'Unit': 'Count'},
+                                {'Name': 'Throttles', 'Unit': 'Count'},
+                                {'Name': 'Errors', 'Unit': 'Count'},
+                                {'Name': 'Latency', 'Unit': 'Milliseconds'}
+                            ]
+                        }]
+                    },
+                    'Service': service,
+                    'Region': region,
+                    'Operation': operation,
+                    'Calls': stats.calls,
+                    'Retries': stats.retries,
+                    'Throttles': stats.throttles,
+                    'Errors': stats.errors,
+                    'Latency': list(stats.samples)
+                })
+        return records
+
+    def dump(self, emf=None):
+        '''
+        Print the call table and optionally write EMF records
+
+        Args:
+            emf: "-" to print EMF records to stdout, a file path to
+                append them to, defaults to ANCHORE_METRICS_EMF
+        '''
+        print('\n'.join(self.summary_lines()))
+        emf = os.environ.get('ANCHORE_METRICS_EMF') if emf is None else emf
+        if not emf:
+            return
+        lines = ''.join(json.dumps(record) + '\n' for record in self.emf_records())
+        if emf == '-':
+            sys.stdout.write(lines)
+        else:
+            with open(emf, 'a') as emf_file:
+                emf_file.write(lines)
+            print(f'EMF metrics written to {emf}')
+
+METRICS = CallMetrics()
+
+def instrument(client):
+    '''
+    Instrument a boto3 client with the process-wide call accounting
+    '''
+    return METRICS.instrument(client)
+
+def dump(emf=None):
+    '''
+    Dump the process-wide call accounting
+    '''
+    METRICS.dump(emf)
@@ -0,0 +1,142 @@
+'''
+Cache of image scan results keyed by image digest and policy
+bundle version, stored in a local directory or an S3 bucket
+'''
+import os
+import re
+import json
+import time
+import hashlib
+import threading
+import botocore
+import tasks.clients as clients
+
+CACHE_TTL = 86400
+
+ECR_IMAGE = re.compile(
+    r'^(?P<account_id>\d{12})\.dkr\.ecr\.(?P<region>[a-z0-9-]+)\.amazonaws\.com/'
+    r'(?P<repository>[^:@]+):(?P<tag>[^:@]+)$'
+)
+
+def cache_key(digest, policy_version):
+    '''
+    Name of the cache entry for an image digest and policy bundle version
+    '''
+    policy = hashlib.sha256(str(policy_version).encode()).hexdigest()[:16]
+    return f'{digest.replace(":", "-")}/{policy}.json'
+
+class ScanCache():
+    '''
+    Store scan results under <location>/<digest>/<policy>.json
+
+    Args:
+        location: local directory, or s3://bucket/prefix for an S3 backed cache
+        region: region of the S3 bucket
+        ttl: seconds a cached result stays fresh, vulnerability feeds
+            change even when the image does not
+    '''
+    def __init__(self, location, region=None, ttl=CACHE_TTL):
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.bucket = None
+        self.prefix = location
+        if location.startswith('s3://'):
+            self.bucket, _, self.prefix = location[len('s3://'):].partition('/')
+            self.s3 = clients.get_client('s3', region or os.environ.get('AWS_DEFAULT_REGION'))
+
+    def read(self, key):
+        '''
+        Read a raw cache entry, None when it does not exist
+        '''
+        if self.bucket:
+            try:
+                response = self.s3.get_object(
+                    Bucket=self.bucket, Key=f'{self.prefix}/{key}'.lstrip('/')
+                )
+                return json.loads(response['Body'].read())
+            except botocore.exceptions.ClientError as error:
+                if error.response['Error']['Code'] in ('NoSuchKey', '404'):
+                    return None
+                raise
+        try:
+            with open(os.path.join(self.prefix, key), 'r') as entry:
+                return json.load(entry)
+        except FileNotFoundError:
+            return None
+
+    def write(self, key, entry):
+        '''
+        Write a raw cache entry
+        '''
+        body = json.dumps(entry, sort_keys=True)
+        if self.bucket:
+            self.s3.put_object(
+                Bucket=self.bucket,
+                Key=f'{self.prefix}/{key}'.lstrip('/'),
+                Body=body.encode(),
+                ContentType='application/json'
+            )
+            return
+        path = os.path.join(self.prefix, key)
+        with self.lock:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(f'{path}.tmp', 'w') as tmp_entry:
+                tmp_entry.write(body)
+            os.replace(f'{path}.tmp', path)
+
+    def get(self, digest, policy_version):
+        '''
+        Get a fresh cached scan result
+
+        Returns:
+            The cached result, or None when it is missing or stale
+        '''
+        entry = self.read(cache_key(digest, policy_version))
+        if entry is None or time.time() - entry['scanned_at'] > self.ttl:
+            return None
+        return entry['result']
+
+    def put(self, digest, policy_version, result):
+        '''
+        Cache the scan result of an image
+        '''
+        self.write(cache_key(digest, policy_version), {
+            'digest': digest,
+            'policy_version': policy_version,
+            'scanned_at': time.time(),
+            'result': result
+        })
+
+def resolve_ecr_digests(tags, deployer_factory):
+    '''
+    Resolve ECR image tags to manifest digests without pulling them
+
+    Tags are grouped by registry and repository so each repository
+    costs one batch_get_image call per hundred tags. Images outside
+    ECR are left out.
+
+    Args:
+        tags: image references, e.g. 123456789012.dkr.ecr.us-east-2.amazonaws.com/repo:1.0
+        deployer_factory: callable returning an ECRDeployer for a
+            {'account_id': ..., 'region': ...} config
+    Returns:
+        Dictionary of image reference to digest
+    '''
+    repositories = {}
+    for tag in tags:
+        match = ECR_IMAGE.match(tag)
+        if match:
+            registry = (match.group('account_id'), match.group('region'), match.group('repository'))
+            repositories.setdefault(registry, {})[match.group('tag')] = tag
+
+    digests = {}
+    deployers = {}
+    for (account_id, region, repository), images in repositories.items():
+        if (account_id, region) not in deployers:
+            deployers[(account_id, region)] = deployer_factory(
+                {'account_id': account_id, 'region': region}
+            )
+        resolved = deployers[(account_id, region)].image_digests(repository, images)
+        for image_tag, digest in resolved.items():
+            digests[images[image_tag]] = digest
+    return digests
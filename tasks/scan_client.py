@@ -0,0 +1,325 @@
+'''
+Submit images to Anchore Engine in bulk, wait for their
+analysis concurrently and collect vulnerability and policy results
+'''
+import os
+import sys
+import json
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import tasks.clients as clients
+from tasks.ecr_deployer import ECRDeployer
+from tasks.scan_cache import ScanCache, CACHE_TTL, resolve_ecr_digests
+
+MAX_WORKERS = 16
+REQUEST_TIMEOUT = 30
+POLL_MIN_DELAY = 5
+POLL_MAX_DELAY = 60
+POLL_BACKOFF = 1.5
+ANALYSIS_TIMEOUT = 3600
+
+ANALYZED = 'analyzed'
+ANALYSIS_FAILED = 'analysis_failed'
+TIMED_OUT = 'timed_out'
+ERROR = 'error'
+FINAL_STATUSES = [ANALYZED, ANALYSIS_FAILED]
+
+class EngineClient():
+    '''
+    Minimal Anchore Engine v1 API client sharing one pooled session
+
+    The session keeps up to pool_size connections open to the engine,
+    so concurrent calls from a thread pool of the same size reuse them.
+    Connection errors and 5xx responses are retried with backoff.
+    '''
+    def __init__(self, base_url, username, password, pool_size=MAX_WORKERS,
+                 timeout=REQUEST_TIMEOUT):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.auth = (username, password)
+        retries = Retry(
+            total=5,
+            backoff_factor=0.5,
+            status_forcelist=[502, 503, 504],
+            allowed_methods=None
+        )
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retries)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def request(self, method, path, **kwargs):
+        '''
+        Call the engine API and decode its JSON response
+
+        Raises:
+            requests.HTTPError: If the engine returns an error status
+        '''
+        response = self.session.request(
+            method, f'{self.base_url}{path}', timeout=self.timeout, **kwargs
+        )
+        response.raise_for_status()
+        return response.json()
+
+    def add_image(self, tag, digest=None, created_at=None):
+        '''
+        Submit an image for analysis
+
+        Args:
+            tag: image tag to analyze
+            digest: pin the analysis to this manifest digest, so a tag
+                moved after the push is not analyzed instead
+            created_at: image creation time, required with a digest
+        Returns:
+            The image digest the engine analyzes the tag as
+        '''
+        image = {'tag': tag}
+        if digest:
+            image.update(digest=digest, created_at=created_at)
+        return self.request('POST', '/images', json=image)[0]['imageDigest']
+
+    def get_image(self, digest):
+        '''
+        Get the image record holding the analysis status
+        '''
+        return self.request('GET', f'/images/{digest}')[0]
+
+    def vulnerabilities(self, digest, vuln_type='all'):
+        '''
+        List the vulnerabilities found in an analyzed image
+        '''
+        return self.request('GET', f'/images/{digest}/vuln/{vuln_type}').get('vulnerabilities', [])
+
+    def policy_check(self, digest, tag):
+        '''
+        Evaluate an analyzed image against the active policy bundle
+
+        Returns:
+            The evaluation status, e.g. pass or fail
+        '''
+        evaluations = self.request(
+            'GET', f'/images/{digest}/check', params={'tag': tag, 'history': 'false'}
+        )
+        return evaluations[0][digest][tag][0]['status']
+
+    def policy_bundle_version(self):
+        '''
+        Identify the active policy bundle and its revision
+
+        Returns:
+            policyId and last update time of the active bundle, so
+            editing the bundle invalidates cached policy results
+        '''
+        for bundle in self.request('GET', '/policies', params={'detail': 'false'}):
+            if bundle.get('active'):
+                return f'{bundle["policyId"]}@{bundle.get("last_updated", "")}'
+        return 'none'
+
+def wait_for_analysis(client, digests, executor, timeout=None, min_delay=None, max_delay=None):
+    '''
+    Poll the analysis status of all images until each one is final
+
+    Every round checks all pending images at once on the executor,
+    so the wait lasts as long as the slowest analysis. The delay
+    between rounds grows by POLL_BACKOFF up to max_delay.
+
+    Args:
+        client: EngineClient
+        digests: image digests to wait for
+        executor: thread pool bounding the concurrent status requests
+        timeout: seconds before pending images are reported as timed out
+    Returns:
+        Dictionary of digest to analyzed, analysis_failed, timed_out or error
+    '''
+    timeout = ANALYSIS_TIMEOUT if timeout is None else timeout
+    delay = POLL_MIN_DELAY if min_delay is None else min_delay
+    max_delay = POLL_MAX_DELAY if max_delay is None else max_delay
+    deadline = time.monotonic() + timeout
+    statuses = {}
+    pending = sorted(set(digests))
+
+    def status(digest):
+        try:
+            return client.get_image(digest)['analysis_status']
+        except requests.RequestException as exc:
+            print(f'Status check for {digest} failed. {exc}')
+            return None
+
+    while pending:
+        for digest, analysis_status in zip(pending, executor.map(status, pending)):
+            if analysis_status in FINAL_STATUSES:
+                statuses[digest] = analysis_status
+        pending = [digest for digest in pending if digest not in statuses]
+        print(f'{len(statuses)} images analyzed, {len(pending)} pending')
+        if not pending:
+            break
+        if time.monotonic() + delay > deadline:
+            for digest in pending:
+                statuses[digest] = TIMED_OUT
+            break
+        time.sleep(delay)
+        delay = min(delay * POLL_BACKOFF, max_delay)
+    return statuses
+
+def collect_results(client, tag, digest, status, policy=False):
+    '''
+    Gather the scan result of one image
+
+    Returns:
+        Dictionary with the digest, analysis status, vulnerabilities
+        and, when requested, the policy evaluation status
+    '''
+    result = {'digest': digest, 'status': status}
+    if status != ANALYZED:
+        return result
+    try:
+        result['vulnerabilities'] = client.vulnerabilities(digest)
+        if policy:
+            result['policy'] = client.policy_check(digest, tag)
+    except requests.RequestException as exc:
+        result['status'] = ERROR
+        result['error'] = str(exc)
+    return result
+
+def scan_images(client, tags, policy=False, max_workers=MAX_WORKERS, timeout=None,
+                cache=None, digests=None):
+    '''
+    Submit, wait for and collect the results of many images concurrently
+
+    When a cache is given, images whose digest already has a fresh
+    result for the active policy bundle are answered from the cache
+    and only new or stale images are submitted to the engine.
+    Images with a known digest are submitted pinned to it and cached
+    under it, even when the engine analyzes them as another digest,
+    e.g. the platform manifest of a manifest list.
+
+    Args:
+        client: EngineClient
+        tags: image tags to scan
+        policy: also evaluate every image against the active policy bundle
+        max_workers: maximum number of concurrent engine requests
+        timeout: seconds to wait for the analyses
+        cache: optional ScanCache of previous results
+        digests: dictionary of tag to digest known before submission,
+            e.g. resolved from the registry with resolve_ecr_digests
+    Returns:
+        Dictionary of tag to scan result
+    '''
+    results = {}
+    digests = digests or {}
+    policy_version = client.policy_bundle_version() if cache and policy else 'none'
+    if cache:
+        for tag in tags:
+            cached = cache.get(digests[tag], policy_version) if tag in digests else None
+            if cached:
+                results[tag] = dict(cached, cached=True)
+        print(f'{len(results)} of {len(tags)} images found in the scan cache')
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        def submit(tag):
+            try:
+                if tag in digests:
+                    # the registry lookup has no push time, use the submission time
+                    created_at = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())
+                    return client.add_image(tag, digest=digests[tag], created_at=created_at)
+                return client.add_image(tag)
+            except requests.RequestException as exc:
+                results[tag] = {'status': ERROR, 'error': str(exc)}
+                return None
+
+        pending = [tag for tag in tags if tag not in results]
+        submitted = {
+            tag: digest for tag, digest in zip(pending, executor.map(submit, pending)) if digest
+        }
+        print(f'Submitted {len(submitted)} of {len(tags)} images for analysis')
+
+        statuses = wait_for_analysis(client, submitted.values(), executor, timeout)
+        for tag, result in zip(submitted, executor.map(
+                lambda tag: collect_results(
+                    client, tag, submitted[tag], statuses[submitted[tag]], policy
+                ),
+                submitted)):
+            results[tag] = result
+            if cache and result['status'] == ANALYZED:
+                cache.put(digests.get(tag, result['digest']), policy_version, result)
+    return {tag: results[tag] for tag in tags}
+
+def admin_password():
+    '''
+    Engine password from the SSM SecureString parameter named by
+    ANCHORE_CLI_PASS_PARAMETER, or else from ANCHORE_CLI_PASS
+    '''
+    name = os.environ.get('ANCHORE_CLI_PASS_PARAMETER')
+    if not name:
+        return os.environ.get('ANCHORE_CLI_PASS', 'foobar')
+    ssm = clients.get_client('ssm', os.environ.get('AWS_DEFAULT_REGION'))
+    return ssm.get_parameter(Name=name, WithDecryption=True)['Parameter']['Value']
+
+def client_from_environment():
+    '''
+    EngineClient using the anchore-cli ANCHORE_CLI_URL,
+    ANCHORE_CLI_USER and ANCHORE_CLI_PASS settings
+    '''
+    return EngineClient(
+        os.environ.get('ANCHORE_CLI_URL', 'http://localhost:8228/v1'),
+        os.environ.get('ANCHORE_CLI_USER', 'admin'),
+        admin_password()
+    )
+
+def read_manifest(manifest):
+    '''
+    Read image tags from a release manifest, one per line
+
+    Blank lines and lines starting with # are ignored.
+    '''
+    with open(manifest, 'r') as manifest_file:
+        return [
+            line.strip() for line in manifest_file
+            if line.strip() and not line.strip().startswith('#')
+        ]
+
+def main(manifest):
+    '''
+    Scan every image of a release manifest using the anchore-cli
+    ANCHORE_CLI_URL, ANCHORE_CLI_USER and ANCHORE_CLI_PASS settings
+
+    Setting ANCHORE_SCAN_CACHE to a directory or s3://bucket/prefix
+    skips ECR images scanned within ANCHORE_SCAN_CACHE_TTL seconds.
+    '''
+    client = client_from_environment()
+    try:
+        tags = read_manifest(manifest)
+        cache = None
+        digests = None
+        if os.environ.get('ANCHORE_SCAN_CACHE'):
+            cache = ScanCache(
+                os.environ['ANCHORE_SCAN_CACHE'],
+                ttl=int(os.environ.get('ANCHORE_SCAN_CACHE_TTL', CACHE_TTL))
+            )
+            digests = resolve_ecr_digests(tags, ECRDeployer)
+        results = scan_images(
+            client,
+            tags,
+            policy=os.environ.get('ANCHORE_SCAN_POLICY') == 'true',
+            cache=cache,
+            digests=digests
+        )
+    except Exception as exc: # pylint: disable=broad-except
+        print(f'Function failed due to exception. {exc}')
+        traceback.print_exc()
+        return False
+
+    for tag, result in results.items():
+        print(f'{tag} = {result["status"]}, '
+              f'{len(result.get("vulnerabilities", []))} vulnerabilities'
+              + (f', policy {result["policy"]}' if 'policy' in result else ''))
+    with open('scan_results.json', 'w') as results_file:
+        json.dump(results, results_file, indent=2)
+    return all(result['status'] == ANALYZED for result in results.values())
+
+if __name__ == '__main__':
+    sys.exit(0 if main(sys.argv[1]) else 1)
@@ -0,0 +1,150 @@
+'''
+Consume ECR push events from the scan queue and submit the
+pushed images to Anchore Engine in batches
+
+Runs as the scan queue lambda handler, or as a long polling
+worker process with python -m tasks.scan_queue
+'''
+import os
+import sys
+import json
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+import requests
+import tasks.clients as clients
+from tasks.scan_client import client_from_environment, MAX_WORKERS
+
+# receive_message and delete_message_batch handle at most 10 messages
+RECEIVE_BATCH_SIZE = 10
+RECEIVE_WAIT_TIME = 20
+
+_CLIENT = None
+
+def pushed_image(body):
+    '''
+    Read the pushed image from an ECR Image Action event
+
+    Args:
+        body: EventBridge event delivered as the SQS message body
+    Returns:
+        Dictionary with the image tag, digest and push time, or None
+        when the message is not a tagged image push
+    '''
+    try:
+        event = json.loads(body)
+        detail = event['detail']
+        if not detail.get('image-tag'):
+            return None
+        registry = f'{event["account"]}.dkr.ecr.{event["region"]}.amazonaws.com'
+        return {
+            'tag': f'{registry}/{detail["repository-name"]}:{detail["image-tag"]}',
+            'digest': detail['image-digest'],
+            'created_at': event['time']
+        }
+    except (ValueError, KeyError, TypeError):
+        return None
+
+def submit_messages(client, messages, max_workers=MAX_WORKERS):
+    '''
+    Submit the images of a batch of queue messages concurrently
+
+    Pushes of the same digest, e.g. several tags of one image, are
+    submitted once. Messages that are not image pushes are dropped.
+
+    Args:
+        client: EngineClient
+        messages: list of (message id, message body)
+    Returns:
+        List of message ids whose image could not be submitted
+    '''
+    images = {}
+    message_ids = {}
+    for message_id, body in messages:
+        image = pushed_image(body)
+        if image is None:
+            print(f'Ignoring message {message_id}, not a tagged image push')
+            continue
+        images.setdefault(image['digest'], image)
+        message_ids.setdefault(image['digest'], []).append(message_id)
+
+    def submit(image):
+        try:
+            client.add_image(image['tag'], image['digest'], image['created_at'])
+            return True
+        except requests.RequestException as exc:
+            print(f'Submitting {image["tag"]} failed. {exc}')
+            return False
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(images)))) as executor:
+        submitted = dict(zip(images, executor.map(submit, images.values())))
+    print(f'Submitted {sum(submitted.values())} of {len(images)} pushed images for analysis')
+    return [
+        message_id
+        for digest, succeeded in submitted.items() if not succeeded
+        for message_id in message_ids[digest]
+    ]
+
+def handler(event, context): # pylint: disable=unused-argument
+    '''
+    Lambda entrypoint for the scan queue event source mapping
+
+    Returns:
+        Partial batch response so only failed messages are retried
+    '''
+    global _CLIENT # pylint: disable=global-statement
+    if _CLIENT is None:
+        _CLIENT = client_from_environment()
+    failed = submit_messages(
+        _CLIENT,
+        [(record['messageId'], record['body']) for record in event['Records']]
+    )
+    return {'batchItemFailures': [{'itemIdentifier': message_id} for message_id in failed]}
+
+def poll_queue(sqs, queue_url, client, wait_time=RECEIVE_WAIT_TIME):
+    '''
+    Receive one batch from the scan queue, submit it and delete
+    the messages that were handled
+
+    Returns:
+        Number of messages received
+    '''
+    messages = sqs.receive_message(
+        QueueUrl=queue_url,
+        MaxNumberOfMessages=RECEIVE_BATCH_SIZE,
+        WaitTimeSeconds=wait_time
+    ).get('Messages', [])
+    if not messages:
+        return 0
+    failed = submit_messages(
+        client, [(message['MessageId'], message['Body']) for message in messages]
+    )
+    handled = [message for message in messages if message['MessageId'] not in failed]
+    if handled:
+        sqs.delete_message_batch(
+            QueueUrl=queue_url,
+            Entries=[
+                {'Id': str(index), 'ReceiptHandle': message['ReceiptHandle']}
+                for index, message in enumerate(handled)
+            ]
+        )
+    return len(messages)
+
+def main():
+    '''
+    Worker entrypoint long polling the queue in SCAN_QUEUE_URL
+    '''
+    queue_url = os.environ['SCAN_QUEUE_URL']
+    sqs = clients.get_client('sqs', os.environ.get('AWS_DEFAULT_REGION'))
+    client = client_from_environment()
+    print(f'Waiting for pushed images on {queue_url}')
+    while True:
+        try:
+            poll_queue(sqs, queue_url, client)
+        except KeyboardInterrupt:
+            return True
+        except Exception as exc: # pylint: disable=broad-except
+            print(f'Function failed due to exception. {exc}')
+            traceback.print_exc()
+
+if __name__ == '__main__':
+    sys.exit(0 if main() else 1)
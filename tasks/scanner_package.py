@@ -0,0 +1,89 @@
+'''
+Build the scan queue lambda package and upload it to S3
+
+The package holds the tasks modules and the pure python
+dependencies the lambda runtime lacks. It is uploaded under a key
+derived from its content, so a new package changes ScannerCodeKey
+and CloudFormation updates the function code.
+'''
+import os
+import sys
+import hashlib
+import zipfile
+import tempfile
+import subprocess
+import tasks.clients as clients
+
+PACKAGE_FILE = 'scanner.zip'
+PACKAGE_MODULES = ['tasks']
+# boto3 and botocore are provided by the lambda runtime
+PACKAGE_REQUIREMENTS = ['requests', 'docker']
+# fixed entry timestamps keep the package, and so its key, stable
+ENTRY_DATE = (1980, 1, 1, 0, 0, 0)
+
+def add_tree(package, source, prefix=''):
+    '''
+    Add the files of a directory to a zip file, sorted and without caches
+    '''
+    for root, dirs, files in os.walk(source):
+        dirs[:] = sorted(name for name in dirs if name != '__pycache__')
+        for name in sorted(files):
+            if name.endswith('.pyc'):
+                continue
+            path = os.path.join(root, name)
+            entry = zipfile.ZipInfo(os.path.join(prefix, os.path.relpath(path, source)), ENTRY_DATE)
+            entry.external_attr = 0o644 << 16
+            entry.compress_type = zipfile.ZIP_DEFLATED
+            with open(path, 'rb') as source_file:
+                package.writestr(entry, source_file.read())
+
+def build_package(output=PACKAGE_FILE, requirements=None, modules=None):
+    '''
+    Build the lambda zip package
+
+    Args:
+        output: zip file to write
+        requirements: pip requirements installed into the package
+        modules: project packages copied into the package
+    Returns:
+        Path of the zip file
+    '''
+    requirements = PACKAGE_REQUIREMENTS if requirements is None else requirements
+    with tempfile.TemporaryDirectory() as build_dir:
+        if requirements:
+            subprocess.run(
+                [sys.executable, '-m', 'pip', 'install', '--quiet', '--target', build_dir]
+                + requirements,
+                check=True
+            )
+        with zipfile.ZipFile(output, 'w', zipfile.ZIP_DEFLATED) as package:
+            add_tree(package, build_dir)
+            for module in modules or PACKAGE_MODULES:
+                add_tree(package, module, module)
+    return output
+
+def package_key(package):
+    '''
+    S3 key of a package, e.g. scanner-<sha256 prefix>.zip
+    '''
+    with open(package, 'rb') as package_file:
+        digest = hashlib.sha256(package_file.read()).hexdigest()
+    return f'scanner-{digest[:16]}.zip'
+
+def main(bucket, region=None):
+    '''
+    Build the package and upload it to a bucket
+
+    Returns:
+        The uploaded S3 key, to be set as ScannerCodeKey
+    '''
+    region = region or os.environ.get('AWS_DEFAULT_REGION')
+    package = build_package()
+    key = package_key(package)
+    clients.get_client('s3', region).upload_file(package, bucket, key)
+    print(f'Scanner package uploaded to s3://{bucket}/{key}')
+    print(f'Set ScannerCodeBucket: {bucket} and ScannerCodeKey: {key}')
+    return key
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
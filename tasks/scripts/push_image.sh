@@ -22,9 +22,13 @@ echo ${_ECR_LOGINS} > ecr_logins.out
 echo "login into ecr"
 $(cat ecr_logins.out)
 
-# build image
+# build image reusing the layers of the previous build
 echo Building images....
-docker build -t ${1} -f ${2}/Dockerfile .
+CACHE_IMAGE=${3}.dkr.ecr.${5}.amazonaws.com/${1}:buildcache
+DOCKER_BUILDKIT=1 docker build \
+	--cache-from ${CACHE_IMAGE} \
+	--build-arg BUILDKIT_INLINE_CACHE=1 \
+	-t ${1} -f ${2}/Dockerfile .
 
 # tag image
 echo Tagging built image....
@@ -34,6 +38,11 @@ docker tag ${1} ${3}.dkr.ecr.${5}.amazonaws.com/${1}:${4}
 echo Pushing built image to AWS ECR.....
 docker push ${3}.dkr.ecr.${5}.amazonaws.com/${1}:${4}
 
+# refresh the registry build cache for the next build
+echo Pushing build cache.....
+docker tag ${1} ${CACHE_IMAGE}
+docker push ${CACHE_IMAGE}
+
 echo "removing temp file"
 rm -rf ecr_logins.out
 
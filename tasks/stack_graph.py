@@ -0,0 +1,240 @@
+'''
+Derive deployment order for cloudformation stacks from the
+Export / ImportValue names found in their templates and run
+stack operations concurrently as their dependencies complete
+'''
+import re
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+import yaml
+
+MAX_WORKERS = 4
+
+SUCCEEDED = 'SUCCEEDED'
+FAILED = 'FAILED'
+SKIPPED = 'SKIPPED'
+
+SUB_VARIABLE = re.compile(r'\$\{([^}!]+)\}')
+
+class TemplateLoader(yaml.SafeLoader): # pylint: disable=too-many-ancestors
+    '''
+    YAML loader that understands cloudformation short-form
+    intrinsic functions such as !Sub, !Ref and !ImportValue
+    '''
+
+def construct_intrinsic(loader, tag_suffix, node):
+    '''
+    Convert a short-form intrinsic function into its long-form dictionary
+
+    Args:
+        loader: active yaml loader
+        tag_suffix: intrinsic function name following the "!"
+        node: yaml node holding the function arguments
+    Returns:
+        The long-form representation, e.g. {'Fn::Sub': '...'}
+    '''
+    if isinstance(node, yaml.ScalarNode):
+        value = loader.construct_scalar(node)
+    elif isinstance(node, yaml.SequenceNode):
+        value = loader.construct_sequence(node, deep=True)
+    else:
+        value = loader.construct_mapping(node, deep=True)
+
+    if tag_suffix == 'Ref':
+        return {'Ref': value}
+    if tag_suffix == 'GetAtt' and isinstance(value, str):
+        value = value.split('.', 1)
+    return {f'Fn::{tag_suffix}': value}
+
+TemplateLoader.add_multi_constructor('!', construct_intrinsic)
+
+def load_template(template_body):
+    '''
+    Parse a cloudformation YAML or JSON template body
+
+    Args:
+        template_body: template file contents
+    Returns:
+        The template as a dictionary
+    '''
+    return yaml.load(template_body, Loader=TemplateLoader) # nosec
+
+def resolve_name(value, parameters):
+    '''
+    Resolve an export or import name against stack parameters
+
+    Args:
+        value: plain string or {'Fn::Sub': ...} expression
+        parameters: stack parameter key-values used for substitution
+    Returns:
+        The resolved name, or None if it can not be determined statically
+    '''
+    if isinstance(value, str):
+        return value
+    if isinstance(value, dict) and 'Fn::Sub' in value:
+        expression = value['Fn::Sub']
+        variables = dict(parameters)
+        if isinstance(expression, list):
+            expression, extra = expression
+            for key, extra_value in extra.items():
+                variables[key] = resolve_name(extra_value, parameters)
+        if not isinstance(expression, str):
+            return None
+        return SUB_VARIABLE.sub(
+            lambda match: str(variables.get(match.group(1)) or match.group(0)),
+            expression
+        )
+    return None
+
+def template_exports(template, parameters):
+    '''
+    List the export names produced by a template
+
+    Args:
+        template: parsed template dictionary
+        parameters: stack parameter key-values
+    Returns:
+        Set of resolved export names
+    '''
+    exports = set()
+    for output in (template.get('Outputs') or {}).values():
+        if 'Export' in output:
+            name = resolve_name(output['Export'].get('Name'), parameters)
+            if name:
+                exports.add(name)
+    return exports
+
+def template_imports(template, parameters):
+    '''
+    List the export names imported by a template
+
+    Args:
+        template: parsed template dictionary
+        parameters: stack parameter key-values
+    Returns:
+        Set of resolved import names
+    '''
+    imports = set()
+    nodes = [template.get('Resources') or {}, template.get('Outputs') or {}]
+    while nodes:
+        node = nodes.pop()
+        if isinstance(node, dict):
+            if 'Fn::ImportValue' in node:
+                name = resolve_name(node['Fn::ImportValue'], parameters)
+                if name:
+                    imports.add(name)
+            nodes.extend(node.values())
+        elif isinstance(node, list):
+            nodes.extend(node)
+    return imports
+
+def build_dependency_graph(stacks):
+    '''
+    Build a stack dependency graph from template exports and imports
+
+    Exports are regional, so an import only links two stacks
+    deployed to the same region. Imports that no stack in the
+    set exports are assumed to exist already.
+
+    Args:
+        stacks: dictionary of stack name to a dictionary with
+            "region", "template_body" and "parameters" keys
+    Returns:
+        Dictionary of stack name to the set of stack names it depends on
+    '''
+    exporters = {}
+    imports = {}
+    for name, stack in stacks.items():
+        template = load_template(stack['template_body'])
+        for export in template_exports(template, stack['parameters']):
+            exporters[(stack['region'], export)] = name
+        imports[name] = template_imports(template, stack['parameters'])
+
+    graph = {}
+    for name, stack in stacks.items():
+        graph[name] = {
+            exporters[(stack['region'], export)]
+            for export in imports[name]
+            if (stack['region'], export) in exporters
+            and exporters[(stack['region'], export)] != name
+        }
+    return graph
+
+def reverse_graph(graph):
+    '''
+    Reverse a dependency graph so that dependents run first
+
+    Args:
+        graph: dictionary of node to the set of nodes it depends on
+    Returns:
+        Dictionary of node to the set of nodes that depend on it
+    '''
+    reverse = {name: set() for name in graph}
+    for name, dependencies in graph.items():
+        for dependency in dependencies:
+            reverse.setdefault(dependency, set()).add(name)
+    return reverse
+
+def check_acyclic(graph):
+    '''
+    Make sure the dependency graph can be deployed
+
+    Args:
+        graph: dictionary of node to the set of nodes it depends on
+    Raises:
+        Exception: If the graph contains a dependency cycle
+    '''
+    remaining = {name: set(deps) & set(graph) for name, deps in graph.items()}
+    while remaining:
+        ready = [name for name, deps in remaining.items() if not deps]
+        if not ready:
+            raise Exception(f'Circular stack dependency detected: {sorted(remaining)}')
+        for name in ready:
+            del remaining[name]
+        for deps in remaining.values():
+            deps.difference_update(ready)
+
+def run_graph(graph, action, max_workers=MAX_WORKERS):
+    '''
+    Run an action for every node once all of its dependencies succeeded
+
+    Nodes whose dependencies are ready run concurrently on a thread
+    pool. A node is skipped when any of its dependencies failed or
+    was skipped.
+
+    Args:
+        graph: dictionary of node to the set of nodes it depends on
+        action: callable invoked with the node name
+        max_workers: maximum number of concurrent actions
+    Returns:
+        Dictionary of node to SUCCEEDED, FAILED or SKIPPED
+    Raises:
+        Exception: If the graph contains a dependency cycle
+    '''
+    check_acyclic(graph)
+    pending = {name: set(deps) & set(graph) for name, deps in graph.items()}
+    results = {}
+    running = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while pending or running:
+            for name in list(pending):
+                states = [results.get(dep) for dep in pending[name]]
+                if FAILED in states or SKIPPED in states:
+                    print(f'Skipping {name}, a dependency did not complete')
+                    results[name] = SKIPPED
+                    del pending[name]
+                elif all(state == SUCCEEDED for state in states):
+                    running[executor.submit(action, name)] = name
+                    del pending[name]
+            if not running:
+                continue
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                try:
+                    future.result()
+                    results[name] = SUCCEEDED
+                except Exception as exc: # pylint: disable=broad-except
+                    print(f'{name} failed due to exception. {exc}')
+                    results[name] = FAILED
+    return results
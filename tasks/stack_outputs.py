@@ -0,0 +1,186 @@
+'''
+Resolve stack outputs referenced from deployment configurations
+
+Configuration parameters may reference the output of another stack
+as ${Stack.Output}, e.g. ${ANCHORE-ALB.TARGETGROUP-ARN}. Stack is a
+stack name, with or without the Environment prefix, and Output is
+an export name, with or without the Environment prefix, or an output
+key. All exports of a region are read in one paginated list_exports
+sweep and cached until they expire or a stack of the region is
+deployed.
+'''
+import re
+import time
+import threading
+import botocore
+import tasks.clients as clients
+
+OUTPUTS_TTL = 300
+
+REFERENCE = re.compile(r'\$\{([^}.]+)\.([^}]+)\}')
+
+def stack_name_from_id(stack_id):
+    '''
+    Stack name of a stack arn, e.g. arn:aws:cloudformation:<region>:<account>:stack/<name>/<id>
+    '''
+    return stack_id.split(':stack/', 1)[-1].split('/', 1)[0]
+
+def stack_references(parameters):
+    '''
+    List the stacks referenced by ${Stack.Output} parameter values
+
+    Args:
+        parameters: stack parameter key-values
+    Returns:
+        Set of referenced stack names as written in the configuration
+    '''
+    return {
+        match.group(1)
+        for value in parameters.values() if isinstance(value, str)
+        for match in REFERENCE.finditer(value)
+    }
+
+class OutputRegistry():
+    '''
+    Process-wide cache of the exports and outputs of deployed stacks
+
+    Exports are cached per region, outputs that are not exported
+    per stack, and both expire after ttl seconds.
+    '''
+    def __init__(self, ttl=OUTPUTS_TTL):
+        self.ttl = ttl
+        self.exports = {}
+        self.outputs = {}
+        self.lock = threading.Lock()
+
+    def _fresh(self, entry):
+        return entry is not None and time.monotonic() - entry[0] < self.ttl
+
+    def region_exports(self, region):
+        '''
+        Get every export of a region
+
+        Args:
+            region: aws region
+        Returns:
+            Dictionary of export name to (value, exporting stack name)
+        '''
+        with self.lock:
+            entry = self.exports.get(region)
+            if self._fresh(entry):
+                return entry[1]
+
+            cfn = clients.get_client('cloudformation', region)
+            exports = {}
+            kwargs = {}
+            while True:
+                response = clients.call_with_backoff(cfn.list_exports, **kwargs)
+                for export in response['Exports']:
+                    exports[export['Name']] = (
+                        export['Value'], stack_name_from_id(export['ExportingStackId'])
+                    )
+                if 'NextToken' not in response:
+                    break
+                kwargs['NextToken'] = response['NextToken']
+            self.exports[region] = (time.monotonic(), exports)
+            return exports
+
+    def stack_outputs(self, region, stack_name):
+        '''
+        Get the outputs of one stack
+
+        Returns:
+            Dictionary of output key to value, empty if the stack does not exist
+        '''
+        key = (region, stack_name)
+        with self.lock:
+            entry = self.outputs.get(key)
+            if self._fresh(entry):
+                return entry[1]
+
+        cfn = clients.get_client('cloudformation', region)
+        try:
+            stack = clients.call_with_backoff(
+                cfn.describe_stacks, StackName=stack_name
+            )['Stacks'][0]
+        except botocore.exceptions.ClientError as exc:
+            if 'does not exist' not in exc.response['Error']['Message']:
+                raise
+            stack = {}
+        outputs = {
+            output['OutputKey']: output['OutputValue']
+            for output in stack.get('Outputs', [])
+        }
+        with self.lock:
+            self.outputs[key] = (time.monotonic(), outputs)
+        return outputs
+
+    def invalidate(self, region=None):
+        '''
+        Forget the cached exports and outputs of a region, or of all regions
+        '''
+        with self.lock:
+            for key in [key for key in self.exports if region in (None, key)]:
+                del self.exports[key]
+            for key in [key for key in self.outputs if region in (None, key[0])]:
+                del self.outputs[key]
+
+    def lookup(self, region, stack, output, environment=None):
+        '''
+        Look up the value of a single ${Stack.Output} reference
+
+        Exports are searched first, so references to exported
+        outputs never need a describe_stacks call.
+
+        Args:
+            region: aws region of the referenced stack
+            stack: referenced stack name
+            output: referenced export name or output key
+            environment: Environment prefix tried for stack and export names
+        Returns:
+            The output value
+        Raises:
+            Exception: If the stack has no such output
+        '''
+        stack_names = [stack] + ([f'{environment}-{stack}'] if environment else [])
+        export_names = [output] + ([f'{environment}-{output}'] if environment else [])
+        exports = self.region_exports(region)
+        for name in export_names:
+            if name in exports and exports[name][1] in stack_names:
+                return exports[name][0]
+        # stacks known to export something are the likelier match
+        exporters = {exporter for _, exporter in exports.values()}
+        for stack_name in sorted(stack_names, key=lambda name: name not in exporters):
+            outputs = self.stack_outputs(region, stack_name)
+            if output in outputs:
+                return outputs[output]
+        raise Exception(f'Stack {stack} in {region} has no output {output}')
+
+    def resolve(self, value, region, environment=None):
+        '''
+        Replace every ${Stack.Output} reference in a string
+        '''
+        if not isinstance(value, str):
+            return value
+        return REFERENCE.sub(
+            lambda match: self.lookup(region, match.group(1), match.group(2), environment),
+            value
+        )
+
+    def resolve_parameters(self, parameters, region):
+        '''
+        Resolve the ${Stack.Output} references of stack parameters
+
+        Args:
+            parameters: stack parameter key-values
+            region: aws region of the stack
+        Returns:
+            New dictionary of parameter key-values
+        '''
+        environment = parameters.get('Environment')
+        return {
+            key: self.resolve(value, region, environment)
+            for key, value in parameters.items()
+        }
+
+REGISTRY = OutputRegistry()
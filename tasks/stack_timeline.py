@@ -0,0 +1,327 @@
+'''
+Reconstruct per-resource provisioning timelines from stack events
+
+The events of the latest operation of each stack are turned into
+start/end intervals per resource. The critical path is followed
+back from the resource that finished last through the template
+dependencies that gated each resource. Timelines are printed as a
+text summary and written as Chrome trace JSON, which can be opened
+in chrome://tracing or https://ui.perfetto.dev.
+'''
+import sys
+import json
+import traceback
+import botocore
+import tasks.clients as clients
+import tasks.cloudformation as cfn
+import tasks.stack_graph as graph
+
+TRACE_FILE = 'stack_timeline.json'
+SLOWEST_RESOURCES = 5
+
+OPERATION_STATUSES = [
+    'CREATE_IN_PROGRESS',
+    'UPDATE_IN_PROGRESS',
+    'DELETE_IN_PROGRESS',
+    'IMPORT_IN_PROGRESS'
+]
+
+def format_duration(duration):
+    '''
+    Format seconds as e.g. 24m05s
+    '''
+    minutes, remainder = divmod(int(round(duration)), 60)
+    return f'{minutes}m{remainder:02d}s' if minutes else f'{remainder}s'
+
+def last_operation(events, stack_name):
+    '''
+    Keep only the events of the latest stack operation
+
+    Args:
+        events: stack events, oldest first
+        stack_name: name of the stack the events belong to
+    Returns:
+        Events from the last stack-level CREATE, UPDATE, DELETE
+        or IMPORT _IN_PROGRESS event on, oldest first
+    '''
+    start = 0
+    for index, event in enumerate(events):
+        if event['LogicalResourceId'] == stack_name \
+                and event['ResourceType'] == cfn.STACK_RESOURCE_TYPE \
+                and event['ResourceStatus'] in OPERATION_STATUSES:
+            start = index
+    return events[start:]
+
+def resource_intervals(events, stack_name):
+    '''
+    Build the start/end interval of every resource of one operation
+
+    A resource starts at its first event and ends at its last one,
+    so a resource that reports only a final status has no duration.
+
+    Args:
+        events: events of one stack operation, oldest first
+        stack_name: name of the stack, whose own events are left out
+    Returns:
+        Dictionary of logical resource id to a dictionary with
+        type, start, end, status and reason
+    '''
+    intervals = {}
+    for event in events:
+        if event['LogicalResourceId'] == stack_name \
+                and event['ResourceType'] == cfn.STACK_RESOURCE_TYPE:
+            continue
+        interval = intervals.setdefault(event['LogicalResourceId'], {
+            'type': event['ResourceType'],
+            'start': event['Timestamp'],
+            'reason': ''
+        })
+        interval['end'] = event['Timestamp']
+        interval['status'] = event['ResourceStatus']
+        if event.get('ResourceStatusReason') and event['ResourceStatus'].endswith('_FAILED'):
+            interval['reason'] = event['ResourceStatusReason']
+    return intervals
+
+def resource_dependencies(template):
+    '''
+    Find the resources each resource of a template waits for
+
+    Dependencies come from DependsOn, Ref, Fn::GetAtt and the
+    variables of Fn::Sub expressions.
+
+    Args:
+        template: parsed template dictionary
+    Returns:
+        Dictionary of logical resource id to the set of logical ids it depends on
+    '''
+    resources = template.get('Resources') or {}
+    dependencies = {}
+    for name, resource in resources.items():
+        depends_on = resource.get('DependsOn') or []
+        found = set([depends_on] if isinstance(depends_on, str) else depends_on)
+        nodes = [resource.get('Properties') or {}]
+        while nodes:
+            node = nodes.pop()
+            if isinstance(node, dict):
+                if isinstance(node.get('Ref'), str):
+                    found.add(node['Ref'])
+                if isinstance(node.get('Fn::GetAtt'), list):
+                    found.add(node['Fn::GetAtt'][0])
+                if 'Fn::Sub' in node:
+                    expression = node['Fn::Sub']
+                    expression = expression[0] if isinstance(expression, list) else expression
+                    if isinstance(expression, str):
+                        found.update(
+                            variable.split('.')[0]
+                            for variable in graph.SUB_VARIABLE.findall(expression)
+                        )
+                nodes.extend(node.values())
+            elif isinstance(node, list):
+                nodes.extend(node)
+        dependencies[name] = {
+            dependency for dependency in found if dependency in resources
+        } - {name}
+    return dependencies
+
+def critical_path(intervals, dependencies=None):
+    '''
+    Follow the resources that gated the end of an operation
+
+    Starting from the resource that finished last, each step moves
+    to the dependency that finished last. Without template
+    dependencies, the resource that finished last before the
+    current one started is taken instead.
+
+    Args:
+        intervals: result of resource_intervals
+        dependencies: result of resource_dependencies, or None
+    Returns:
+        List of logical resource ids, first to last
+    '''
+    if not intervals:
+        return []
+    current = max(intervals, key=lambda name: intervals[name]['end'])
+    path = [current]
+    while True:
+        if dependencies is not None:
+            candidates = [
+                name for name in dependencies.get(current, set())
+                if name in intervals and name not in path
+            ]
+        else:
+            candidates = [
+                name for name in intervals
+                if name not in path and intervals[name]['end'] <= intervals[current]['start']
+            ]
+        if not candidates:
+            return list(reversed(path))
+        current = max(candidates, key=lambda name: intervals[name]['end'])
+        path.append(current)
+
+def resource_notes(template):
+    '''
+    Describe the template settings that make a resource wait
+
+    Returns:
+        Dictionary of logical resource id to a short note
+    '''
+    notes = {}
+    for name, resource in (template.get('Resources') or {}).items():
+        signal = (resource.get('CreationPolicy') or {}).get('ResourceSignal')
+        if signal:
+            notes[name] = (f'CreationPolicy waits for {signal.get("Count", 1)} signals,'
+                           f' timeout {signal.get("Timeout", "PT5M")}')
+    return notes
+
+def stack_timeline(manager, stack_name):
+    '''
+    Read the events and template of a stack and analyze its last operation
+
+    Args:
+        manager: DeploymentManager of the stack region
+        stack_name: name of the stack
+    Returns:
+        Dictionary with stack_name, status, start, end, intervals,
+        critical_path and notes
+    '''
+    events = last_operation(manager.waiter.new_events(stack_name, None), stack_name)
+    try:
+        template_body = clients.call_with_backoff(
+            manager.cfn.get_template, StackName=stack_name, TemplateStage='Original'
+        )['TemplateBody']
+        template = graph.load_template(template_body) if isinstance(template_body, str) \
+            else template_body
+        dependencies = resource_dependencies(template)
+    except botocore.exceptions.ClientError as exc:
+        print(f'Template of {stack_name} could not be read, guessing dependencies. {exc}')
+        template = {}
+        dependencies = None
+
+    intervals = resource_intervals(events, stack_name)
+    return {
+        'stack_name': stack_name,
+        'status': events[-1]['ResourceStatus'] if events else None,
+        'start': events[0]['Timestamp'] if events else None,
+        'end': events[-1]['Timestamp'] if events else None,
+        'intervals': intervals,
+        'critical_path': critical_path(intervals, dependencies),
+        'notes': resource_notes(template)
+    }
+
+def seconds(start, end):
+    '''
+    Seconds between two event timestamps
+    '''
+    return (end - start).total_seconds()
+
+def text_summary(timeline, slowest=SLOWEST_RESOURCES):
+    '''
+    Summarize a stack timeline as text
+
+    Returns:
+        Summary lines: total duration, critical path and slowest resources
+    '''
+    if timeline['start'] is None:
+        return [f'{timeline["stack_name"]}: no events']
+    intervals = timeline['intervals']
+    total = seconds(timeline['start'], timeline['end'])
+
+    def describe(name):
+        interval = intervals[name]
+        duration = seconds(interval['start'], interval['end'])
+        share = duration / total * 100 if total else 0
+        note = timeline['notes'].get(name, interval['reason'])
+        offset = '+' + format_duration(seconds(timeline['start'], interval['start']))
+        return (f'{offset:>8}'
+                f' {format_duration(duration):>7} {share:5.1f}%'
+                f' {name} ({interval["type"]}) {interval["status"]}'
+                + (f' - {note}' if note else ''))
+
+    lines = [f'{timeline["stack_name"]}: {timeline["status"]} in {format_duration(total)}']
+    lines.append('  Critical path:')
+    lines.extend(f'    {describe(name)}' for name in timeline['critical_path'])
+    lines.append('  Slowest resources:')
+    lines.extend(
+        f'    {describe(name)}'
+        for name in sorted(
+            intervals,
+            key=lambda name: seconds(intervals[name]['start'], intervals[name]['end']),
+            reverse=True
+        )[:slowest]
+    )
+    return lines
+
+def chrome_trace(timelines):
+    '''
+    Convert stack timelines into Chrome trace events
+
+    Every stack is a process and every resource a thread, so
+    stacks deployed at the same time line up on one time axis.
+
+    Returns:
+        Chrome trace dictionary, ready for json.dump
+    '''
+    timelines = [timeline for timeline in timelines if timeline['start'] is not None]
+    if not timelines:
+        return {'traceEvents': [], 'displayTimeUnit': 'ms'}
+    origin = min(timeline['start'] for timeline in timelines)
+    events = []
+    for pid, timeline in enumerate(timelines, 1):
+        events.append({
+            'name': 'process_name', 'ph': 'M', 'pid': pid,
+            'args': {'name': timeline['stack_name']}
+        })
+        for tid, (name, interval) in enumerate(sorted(
+                timeline['intervals'].items(), key=lambda item: item[1]['start']), 1):
+            critical = name in timeline['critical_path']
+            events.append({
+                'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid,
+                'args': {'name': name}
+            })
+            events.append({
+                'name': name,
+                'cat': 'critical' if critical else interval['type'],
+                'ph': 'X',
+                'pid': pid,
+                'tid': tid,
+                'ts': int(seconds(origin, interval['start']) * 1000000),
+                'dur': int(seconds(interval['start'], interval['end']) * 1000000),
+                'args': {
+                    'type': interval['type'],
+                    'status': interval['status'],
+                    'critical_path': critical,
+                    'note': timeline['notes'].get(name, interval['reason'])
+                }
+            })
+    return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+def main(configs, trace_file=TRACE_FILE):
+    '''
+    Analyze the last operation of every stack in a deployment configuration
+
+    Args:
+        configs: deployment configuration file, e.g. configs/configs.yml
+        trace_file: where to write the Chrome trace JSON
+    Returns:
+        List of stack timelines
+    '''
+    timelines = []
+    for single_setup_data in cfn.load_yaml_file(configs):
+        stack_name = single_setup_data['parameters']['Environment'] + '-' \
+            + single_setup_data['resource_name']
+        try:
+            timeline = stack_timeline(cfn.DeploymentManager(single_setup_data), stack_name)
+        except Exception as exc: # pylint: disable=broad-except
+            print(f'Timeline of {stack_name} could not be read. {exc}')
+            traceback.print_exc()
+            continue
+        timelines.append(timeline)
+        print('\n'.join(text_summary(timeline)))
+
+    with open(trace_file, 'w') as trace:
+        json.dump(chrome_trace(timelines), trace)
+    print(f'Chrome trace written to {trace_file}')
+    return timelines
+
+if __name__ == '__main__':
+    main(*sys.argv[1:] or ['configs/configs.yml'])
@@ -3,47 +3,186 @@ Clean-up deployed aws resources
 '''
 import os
 import sys
+import json
 import traceback
-import cloudformation as cfn
-import keypair
-from cloudformation import load_yaml_file # pylint: disable=no-name-in-module
-
+from concurrent.futures import ThreadPoolExecutor
+import botocore
+import tasks.cloudformation as cfn
+import tasks.clients as clients
+import tasks.keypair as keypair
+import tasks.metrics as metrics
+import tasks.stack_graph as graph
+from tasks.cloudformation import load_yaml_file
 
 print('Loading teardown function ....')
 
-def main(configs):
+# delete_objects accepts at most 1000 keys per call
+DELETE_BATCH_SIZE = 1000
+BUCKET_WORKERS = 8
+
+def empty_bucket(bucket_name, region, max_workers=BUCKET_WORKERS):
+    '''
+    Delete every object version and delete marker of a bucket
+
+    Listing pages are handed to a thread pool as they arrive, so
+    batches of up to 1000 keys are deleted while the next page is
+    being listed. Buckets without versioning list their objects
+    with a null version id and are emptied the same way.
+
+    Args:
+        bucket_name: bucket to empty
+        region: bucket region
+        max_workers: maximum number of concurrent delete_objects calls
+    Returns:
+        Number of object versions deleted, 0 if the bucket does not exist
+    Raises:
+        Exception: If any key could not be deleted
+    '''
+    s3_client = clients.get_client('s3', region)
+
+    def delete(keys):
+        response = s3_client.delete_objects(
+            Bucket=bucket_name,
+            Delete={'Objects': keys, 'Quiet': True}
+        )
+        return len(keys), response.get('Errors', [])
+
+    futures = []
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        keys = []
+        paginator = s3_client.get_paginator('list_object_versions')
+        try:
+            for page in paginator.paginate(Bucket=bucket_name):
+                for version in page.get('Versions', []) + page.get('DeleteMarkers', []):
+                    keys.append({'Key': version['Key'], 'VersionId': version['VersionId']})
+                    if len(keys) == DELETE_BATCH_SIZE:
+                        futures.append(executor.submit(delete, keys))
+                        keys = []
+        except botocore.exceptions.ClientError as exc:
+            if exc.response['Error']['Code'] != 'NoSuchBucket':
+                raise
+            print(f'Bucket - {bucket_name} does not exist')
+        if keys:
+            futures.append(executor.submit(delete, keys))
+        results = [future.result() for future in futures]
+
+    errors = [error for _, batch_errors in results for error in batch_errors]
+    if errors:
+        raise Exception(f'Could not delete {len(errors)} objects from {bucket_name}: {errors[:5]}')
+    deleted = sum(count for count, _ in results)
+    print(f'Bucket - {bucket_name} {deleted} object versions removed')
+    return deleted
+
+def read_deployed_stack(single_setup_data):
+    '''
+    Read the deployed template and parameters of a stack to delete
+
+    Returns:
+        Stack description for the dependency graph, with an empty
+        template and deployed set to False when the stack does not exist
+    '''
+    environment = single_setup_data['parameters']['Environment']
+    stack_name = environment+'-'+single_setup_data['resource_name']
+    stack = {
+        'stack_name': stack_name,
+        'region': single_setup_data['region'],
+        'template_body': '{}',
+        'parameters': dict(single_setup_data['parameters']),
+        'setup_data': single_setup_data,
+        'deployed': False
+    }
+    client = cfn.regional_client(single_setup_data)
+    try:
+        deployed = clients.call_with_backoff(
+            client.describe_stacks, StackName=stack_name
+        )['Stacks'][0]
+        template_body = clients.call_with_backoff(
+            client.get_template, StackName=stack_name, TemplateStage='Original'
+        )['TemplateBody']
+    except botocore.exceptions.ClientError as exc:
+        if 'does not exist' not in exc.response['Error']['Message']:
+            raise
+        print(f'Stack does not exist:- {stack_name}')
+        return stack
+
+    stack['deployed'] = True
+    # JSON templates are returned already parsed
+    stack['template_body'] = template_body if isinstance(template_body, str) \
+        else json.dumps(template_body)
+    for parameter in deployed.get('Parameters', []):
+        stack['parameters'].setdefault(parameter['ParameterKey'], parameter.get('ParameterValue'))
+    return stack
+
+def delete_single_stack(stack):
+    '''
+    Empty the bucket of a deployed stack, if any, then delete the stack and wait
+    '''
+    single_setup_data = stack['setup_data']
+    print(f'Region to delete resource = {stack["region"]}')
+    print(f'Stack name to be deleted = {stack["stack_name"]}')
+
+    # Delete non-empty bucket objects
+    bucket_name = single_setup_data['parameters'].get('BucketName')
+    if bucket_name and stack.get('deployed'):
+        print(f'Bucket to delete objects = {bucket_name}')
+        empty_bucket(bucket_name, stack['region'])
+
+    stacks = cfn.DeploymentManager(single_setup_data)
+    stacks.delete_stack(stack['stack_name'])
+    print(f'Tearing down deployed stack {stack["stack_name"]} ...')
+
+def teardown_region(region, stacks, max_workers):
+    '''
+    Delete the stacks of one region, importers before exporters
+
+    Returns:
+        Dictionary of stack name to deletion result
+    '''
+    print(f'Region to delete resources = {region}')
+    dependents = graph.reverse_graph(graph.build_dependency_graph(stacks))
+    for stack_name, imported_by in dependents.items():
+        print(f'Stack {stack_name} is deleted after {sorted(imported_by)}')
+    return graph.run_graph(
+        dependents,
+        lambda stack_name: delete_single_stack(stacks[stack_name]),
+        max_workers
+    )
+
+def main(configs, max_workers=graph.MAX_WORKERS):
     '''
     clean-up deployed stacks
+
+    A stack is deleted once every stack importing its exports is
+    gone, independent stacks are deleted concurrently and all
+    regions are torn down at once.
     '''
     setup_data = load_yaml_file(configs)
     print('Listing configuration to delete Stacks in specified regions ...')
 
     try:
+        regions = {}
         for single_setup_data in setup_data:
+            stack = read_deployed_stack(single_setup_data)
+            regions.setdefault(stack['region'], {})[stack['stack_name']] = stack
+
+        with ThreadPoolExecutor(max_workers=len(regions) or 1) as executor:
+            futures = {
+                region: executor.submit(teardown_region, region, region_stacks, max_workers)
+                for region, region_stacks in regions.items()
+            }
+            results = {region: future.result() for region, future in futures.items()}
 
-        # Extract region and environemnt to deploy stack
-            stack_region = single_setup_data['region']
-            environment = single_setup_data['parameters']['Environment']
-            print(f'Region to delete resource = {stack_region}')
-            print(f'Environment to delete resource = {environment}')
-
-        # Extract resource name and region
-            resource_name = single_setup_data['resource_name']
-            stack_name = environment+'-'+resource_name
-            print(f'Stack name to be deleted = {stack_name}')
-
-        # Delete non-empty bucket objects
-            if stack_name == 'DEMO-ANCHORE-CLI-PIPELINE':
-                bucket_name = single_setup_data['parameters']['BucketName']
-                print(f'Bucket to delete objects = {bucket_name}')
-                os.system(f"aws s3 rm s3://{bucket_name} --recursive")
-                print(f'Bucket - {bucket_name} object removed')
-
-        # Delete Stacks
-            stacks = cfn.DeploymentManager(single_setup_data) # pylint: disable=no-member
-            stacks.delete_stack(stack_name)
-            print(f'Tearing down deployed stack {stack_name} ...')
+        for region, region_results in results.items():
+            for stack_name, result in region_results.items():
+                print(f'Stack {stack_name} in {region} = {result}')
+        if all(
+                result == graph.SUCCEEDED
+                for region_results in results.values()
+                for result in region_results.values()
+            ):
             print('Teardown Complete!!!')
+        else:
+            print('Stack Teardown Failed!!!')
 
     except Exception as exc: # pylint: disable=broad-except
         print(f'Function failed due to exception. {exc}')
@@ -53,6 +192,7 @@ def main(configs):
     # Delete keypair
     keypair.delete_keypair(os.environ.get('AWS_DEFAULT_REGION'), 'anchore_demo')
 
+    metrics.dump()
     return "Teardown Complete!!!"
 
 if __name__ == "__main__":
@@ -0,0 +1,212 @@
+'''
+Benchmark stack deployment and teardown offline
+
+Synthetic stacks, each importing an export of its parent stack,
+are deployed and torn down through deploy_stacks and teardown_stack
+against the in-repo cloudformation stand-in, which provisions
+resources in template dependency order with simulated latencies
+and can throttle calls above an account-wide rate. Calls go through
+the same client-side rate limiter as the shared clients. Wall time,
+API call counts and throttled calls are reported per stack count.
+
+Simulated latencies are seconds of the scaled-down clock, where
+WAITER_MIN_DELAY is replaced by POLL_DELAY. The other waiter and
+backoff delays, the account throttle rate and the client rate are
+real-world values scaled the same way. Bursts are numbers of calls
+and are not scaled.
+'''
+import io
+import os
+import sys
+import json
+import time
+import contextlib
+from unittest import mock
+import yaml
+import tasks.clients as clients
+import tasks.cloudformation as cloudformation
+import tasks.deploy_stacks as deploy_stacks
+import tasks.teardown_stack as teardown_stack
+import tasks.stack_graph as graph
+from tests.mocks import cfn
+
+SIZES = [4, 25, 50, 100, 200]
+FAN_OUT = 4
+REGION = 'us-east-2'
+ENVIRONMENT = 'BENCH'
+POLL_DELAY = 0.01
+# calls the account accepts at once above its throttle rate
+THROTTLE_BURST = 5
+RESULTS_FILE = 'benchmark_results.json'
+
+RESOURCE_LATENCIES = {
+    'AWS::IAM::Role': 0.02,
+    'AWS::EC2::SecurityGroup': 0.01,
+    'AWS::AutoScaling::LaunchConfiguration': 0.01,
+    'AWS::AutoScaling::AutoScalingGroup': 0.05
+}
+
+def synthetic_template(index, parent=None):
+    '''
+    Template of synthetic stack number index, importing the export of its parent
+    '''
+    vpc_id = {'Fn::ImportValue': {'Fn::Sub': f'${{Environment}}-STACK-{parent}'}} \
+        if parent is not None else 'vpc-0'
+    return yaml.safe_dump({
+        'Parameters': {'Environment': {'Type': 'String'}},
+        'Resources': {
+            'Role': {'Type': 'AWS::IAM::Role', 'Properties': {}},
+            'SecurityGroup': {
+                'Type': 'AWS::EC2::SecurityGroup',
+                'Properties': {'VpcId': vpc_id}
+            },
+            'LaunchConfiguration': {
+                'Type': 'AWS::AutoScaling::LaunchConfiguration',
+                'Properties': {
+                    'IamInstanceProfile': {'Ref': 'Role'},
+                    'SecurityGroups': [{'Ref': 'SecurityGroup'}]
+                }
+            },
+            'AutoScalingGroup': {
+                'Type': 'AWS::AutoScaling::AutoScalingGroup',
+                'Properties': {'LaunchConfigurationName': {'Ref': 'LaunchConfiguration'}}
+            }
+        },
+        'Outputs': {
+            'SecurityGroup': {
+                'Value': {'Ref': 'SecurityGroup'},
+                'Export': {'Name': {'Fn::Sub': f'${{Environment}}-STACK-{index}'}}
+            }
+        }
+    })
+
+def synthetic_stacks(count, fan_out=FAN_OUT):
+    '''
+    Stack descriptions of a tree of count stacks, fan_out children per stack
+
+    Returns:
+        Dictionary of stack name to a description as read by read_stack_config
+    '''
+    stacks = {}
+    for index in range(count):
+        parent = (index - 1) // fan_out if index else None
+        setup_data = {
+            'region': REGION,
+            'resource_name': f'STACK-{index}',
+            'parameters': {'Environment': ENVIRONMENT}
+        }
+        stack_name = f'{ENVIRONMENT}-STACK-{index}'
+        stacks[stack_name] = {
+            'stack_name': stack_name,
+            'environment': ENVIRONMENT,
+            'region': REGION,
+            'template_file': f'{stack_name}.yml',
+            'template_body': synthetic_template(index, parent),
+            'parameters': setup_data['parameters'],
+            'setup_data': setup_data
+        }
+    return stacks
+
+def run(count, max_workers=graph.MAX_WORKERS, throttle_rate=None, poll_delay=POLL_DELAY,
+        client_rate=None):
+    '''
+    Deploy and tear down count synthetic stacks against the stand-in
+
+    Args:
+        count: number of stacks
+        max_workers: stacks deployed or deleted at once
+        throttle_rate: account calls per second before throttling, None for no limit
+        poll_delay: scaled-down WAITER_MIN_DELAY
+        client_rate: client-side calls per second, None for no limiter
+
+    Returns:
+        Dictionary of wall times, API call counts, throttled calls
+        and stacks that did not succeed, for deploy and teardown
+    '''
+    scale = poll_delay / cloudformation.WAITER_MIN_DELAY
+    limiter = None
+    if client_rate:
+        limiter = clients.TokenBucket(
+            client_rate / scale, capacity=max(1.0, client_rate * clients.BURST_SECONDS)
+        )
+    client = cfn.FakeCloudFormation(
+        resource_latencies=RESOURCE_LATENCIES,
+        throttle_rate=throttle_rate / scale if throttle_rate else None,
+        throttle_burst=THROTTLE_BURST,
+        limiter=limiter
+    )
+    stacks = synthetic_stacks(count)
+    result = {
+        'stacks': count,
+        'max_workers': max_workers,
+        'throttle_rate': throttle_rate,
+        'client_rate': client_rate
+    }
+    phases = [
+        ('deploy', deploy_stacks.deploy_region),
+        ('teardown', teardown_stack.teardown_region)
+    ]
+    max_delay = cloudformation.WAITER_MAX_DELAY * scale
+    with mock.patch.object(cloudformation, 'regional_client', return_value=client), \
+            mock.patch.object(cloudformation, 'WAITER_MIN_DELAY', poll_delay), \
+            mock.patch.object(cloudformation, 'WAITER_MAX_DELAY', max_delay), \
+            mock.patch.object(clients, 'BACKOFF_BASE', clients.BACKOFF_BASE * scale), \
+            mock.patch.object(clients, 'BACKOFF_CAP', clients.BACKOFF_CAP * scale), \
+            contextlib.redirect_stdout(io.StringIO()):
+        for phase, action in phases:
+            client.calls.clear()
+            start = time.monotonic()
+            results = action(REGION, stacks, max_workers)
+            result[f'{phase}_seconds'] = round(time.monotonic() - start, 3)
+            calls = dict(client.calls)
+            result[f'{phase}_throttled'] = calls.pop('throttled', 0)
+            result[f'{phase}_calls'] = calls
+            result[f'{phase}_api_calls'] = sum(calls.values())
+            result[f'{phase}_failed'] = sum(
+                1 for stack_result in results.values() if stack_result != graph.SUCCEEDED
+            )
+    return result
+
+def main(sizes=None, max_workers=None, throttle_rate=None, client_rate=None):
+    '''
+    Benchmark entrypoint
+
+    Sizes, workers, the throttle rate and the client rate default to
+    BENCHMARK_SIZES (comma separated), BENCHMARK_WORKERS,
+    BENCHMARK_THROTTLE_RATE and BENCHMARK_CLIENT_RATE. The client rate
+    falls back to the cloudformation rate of the shared clients, and
+    0 turns the client-side limiter off.
+
+    Returns:
+        List of run results, also written to RESULTS_FILE
+    '''
+    sizes = sizes or [
+        int(size)
+        for size in os.environ.get('BENCHMARK_SIZES', ','.join(map(str, SIZES))).split(',')
+    ]
+    max_workers = max_workers or int(os.environ.get('BENCHMARK_WORKERS', graph.MAX_WORKERS))
+    if throttle_rate is None and os.environ.get('BENCHMARK_THROTTLE_RATE'):
+        throttle_rate = float(os.environ['BENCHMARK_THROTTLE_RATE'])
+    if client_rate is None:
+        client_rate = float(
+            os.environ.get('BENCHMARK_CLIENT_RATE') or clients.service_rate('cloudformation')
+        )
+
+    print(f'{"stacks":>6} {"deploy s":>9} {"calls":>6} {"throttled":>9} {"failed":>6}'
+          f' {"teardown s":>10} {"calls":>6} {"throttled":>9} {"failed":>6}')
+    results = []
+    for size in sizes:
+        result = run(size, max_workers, throttle_rate, client_rate=client_rate)
+        results.append(result)
+        print(f'{size:>6} {result["deploy_seconds"]:>9.2f} {result["deploy_api_calls"]:>6}'
+              f' {result["deploy_throttled"]:>9} {result["deploy_failed"]:>6}'
+              f' {result["teardown_seconds"]:>10.2f} {result["teardown_api_calls"]:>6}'
+              f' {result["teardown_throttled"]:>9} {result["teardown_failed"]:>6}')
+
+    with open(RESULTS_FILE, 'w') as results_file:
+        json.dump(results, results_file, indent=2)
+    print(f'Results written to {RESULTS_FILE}')
+    return results
+
+if __name__ == '__main__':
+    main([int(size) for size in sys.argv[1:]] or None)
@@ -3,6 +3,7 @@ Helper script for end-to-end testing
 '''
 import os
 import boto3
+from tasks import metrics
 
 class ManageAWSResources(object):
 	'''
@@ -13,7 +14,7 @@ class ManageAWSResources(object):
 		Declare function initialization variable
 		'''
 		self.region = os.environ['AWS_DEFAULT_REGION']
-		self.cfn = boto3.client('cloudformation', region_name=self.region)
+		self.cfn = metrics.instrument(boto3.client('cloudformation', region_name=self.region))
 
 	def get_stack_status(self, stack_name):
 		'''
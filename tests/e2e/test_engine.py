@@ -15,6 +15,9 @@ import json
 import requests
 import pytest
 import unittest
+from tasks import stack_outputs
+
+ENGINE_URL = 'http://${DEMO-ANCHORE-ALB.LoadBalancerDNSName}:8228/v1'
 
 class TestAnchoreEngine(unittest.TestCase):
     '''
@@ -23,7 +26,9 @@ class TestAnchoreEngine(unittest.TestCase):
     def setUp(self):
         self.anchore_user = os.environ.get('ANCHORE_CLI_USER', 'admin')
         self.anchore_pass = os.environ.get('ANCHORE_CLI_PASS', 'foobar')
-        self.anchore_url = os.environ.get('ANCHORE_CLI_URL', 'http://internal-DEMO-LoadB-TEHME0YAGU49-1824236530.us-east-2.elb.amazonaws.com:8228/v1')
+        self.anchore_url = os.environ.get('ANCHORE_CLI_URL') or stack_outputs.REGISTRY.resolve(
+            ENGINE_URL, os.environ.get('AWS_DEFAULT_REGION', 'us-east-2')
+        )
 
 
     def test_engine_version(self):
@@ -39,7 +44,9 @@ class TestAnchoreEngine(unittest.TestCase):
     def tearDown(self):
         self.anchore_user = os.environ.get('ANCHORE_CLI_USER', 'admin')
         self.anchore_pass = os.environ.get('ANCHORE_CLI_PASS', 'foobar')
-        self.anchore_url = os.environ.get('ANCHORE_CLI_URL', 'http://internal-DEMO-LoadB-TEHME0YAGU49-1824236530.us-east-2.elb.amazonaws.com:8228/v1')
+        self.anchore_url = os.environ.get('ANCHORE_CLI_URL') or stack_outputs.REGISTRY.resolve(
+            ENGINE_URL, os.environ.get('AWS_DEFAULT_REGION', 'us-east-2')
+        )
 
 
 
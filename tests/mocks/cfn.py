@@ -1,9 +1,15 @@
 '''
 Mock cloudformation boto3 API calls
 '''
+import time
+import threading
+from datetime import datetime, timedelta, timezone
+from collections import Counter
 import boto3
 import botocore
 import tests.config as config
+import tasks.stack_graph as graph
+import tasks.stack_timeline as stack_timeline
 from botocore.stub import Stubber
 
 def get_stack_status(stack_status_response, expected_params):
@@ -18,4 +24,251 @@ def get_stack_status(stack_status_response, expected_params):
     stubber.add_response('stack_status', stack_status_response, expected_params)
     stubber.activate()
     return client
-    
\ No newline at end of file
+    
+class FakeCloudFormation():
+	'''
+	Offline stand-in for the boto3 cloudformation client that
+	simulates per-stack deployment latencies through stack events
+
+	latencies: seconds per stack name
+	failures: stack name to the logical id of the resource that fails
+	resource_latencies: seconds per resource type; resources are then
+		provisioned in template dependency order with their own events
+	throttle_rate: account-wide calls per second, calls beyond a burst
+		of throttle_burst calls raise a Throttling error
+	throttle_burst: calls allowed at once, defaults to throttle_rate
+	limiter: client-side rate limiter every call waits for first,
+		like the before-send hook of the shared clients
+	'''
+	def __init__(self, latencies=None, failures=None, outputs=None, page_size=100,
+			resource_latencies=None, throttle_rate=None, throttle_burst=None, limiter=None):
+		self.latencies = latencies or {}
+		self.failures = failures or {}
+		self.outputs = outputs or {}
+		self.page_size = page_size
+		self.resource_latencies = resource_latencies
+		self.throttle_rate = throttle_rate
+		self.throttle_burst = throttle_burst or throttle_rate
+		self.limiter = limiter
+		self.tokens = self.throttle_burst
+		self.refilled = time.monotonic()
+		self.stacks = {}
+		self.events = {}
+		self.started = {}
+		self.timeline = {}
+		self.change_sets = {}
+		self.calls = Counter()
+		self.lock = threading.Lock()
+
+	def _call(self, operation):
+		if self.limiter is not None:
+			self.limiter.acquire()
+		with self.lock:
+			self.calls[operation] += 1
+			if self.throttle_rate is None:
+				return
+			now = time.monotonic()
+			self.tokens = min(self.throttle_burst, self.tokens + (now - self.refilled) * self.throttle_rate)
+			self.refilled = now
+			if self.tokens < 1:
+				self.calls['throttled'] += 1
+				raise botocore.exceptions.ClientError(
+					{'Error': {'Code': 'Throttling', 'Message': 'Rate exceeded'}},
+					operation
+				)
+			self.tokens -= 1
+
+	def _schedule(self, template_body, operation):
+		'''
+		Resource events of one operation as (offset, logical id, type, status),
+		resources start once their dependencies are done, in reverse for deletes
+		'''
+		if self.resource_latencies is None or not template_body:
+			return []
+		template = graph.load_template(template_body)
+		resources = template.get('Resources') or {}
+		dependencies = stack_timeline.resource_dependencies(template)
+		if operation == 'DELETE':
+			dependencies = graph.reverse_graph(dependencies)
+		ends = {}
+		schedule = []
+		while len(ends) < len(resources):
+			for name in sorted(resources):
+				if name not in ends and dependencies[name] <= set(ends):
+					start = max([ends[dependency] for dependency in dependencies[name]] or [0])
+					ends[name] = start + self.resource_latencies.get(resources[name]['Type'], 0)
+					schedule.append((start, name, resources[name]['Type'], f'{operation}_IN_PROGRESS'))
+					schedule.append((ends[name], name, resources[name]['Type'], f'{operation}_COMPLETE'))
+		return sorted(schedule, key=lambda event: event[0])
+
+	def _stack_id(self, StackName):
+		for stack_id, stack in self.stacks.items():
+			if StackName in (stack_id, stack['StackName']) and (
+					StackName == stack_id or stack['StackStatus'] != 'DELETE_COMPLETE'):
+				return stack_id
+		raise botocore.exceptions.ClientError(
+			{'Error': {'Code': 'ValidationError', 'Message': f'Stack with id {StackName} does not exist'}},
+			'DescribeStacks'
+		)
+
+	def _add_event(self, stack_id, logical_id, resource_type, status, reason='', timestamp=None):
+		stack_events = self.events.setdefault(stack_id, [])
+		stack_events.insert(0, {
+			'EventId': f'{stack_id}-{len(stack_events)}',
+			'StackId': stack_id,
+			'StackName': self.stacks[stack_id]['StackName'],
+			'LogicalResourceId': logical_id,
+			'ResourceType': resource_type,
+			'ResourceStatus': status,
+			'ResourceStatusReason': reason,
+			'Timestamp': timestamp or datetime.now(timezone.utc),
+		})
+
+	def _start(self, StackName, operation, **kwargs):
+		with self.lock:
+			try:
+				stack_id = self._stack_id(StackName)
+			except botocore.exceptions.ClientError:
+				stack_id = f'arn:aws:cloudformation:us-east-2:123456789012:stack/{StackName}/{len(self.stacks)}'
+				self.stacks[stack_id] = {'StackName': StackName, 'StackId': stack_id}
+			self.stacks[stack_id]['StackStatus'] = f'{operation}_IN_PROGRESS'
+			self.stacks[stack_id]['Operation'] = operation
+			self.stacks[stack_id]['Inputs'] = (kwargs.get('TemplateBody'), kwargs.get('Parameters'))
+			now = time.monotonic()
+			schedule = self._schedule(kwargs.get('TemplateBody'), operation)
+			duration = max([self.latencies.get(StackName, 0)] + [event[0] for event in schedule])
+			self.stacks[stack_id]['Schedule'] = schedule
+			self.stacks[stack_id]['StartedAt'] = datetime.now(timezone.utc)
+			self.started[StackName] = now
+			self.timeline[StackName] = (now, now + duration)
+			self._add_event(stack_id, StackName, 'AWS::CloudFormation::Stack', f'{operation}_IN_PROGRESS')
+			return stack_id
+
+	def _settle(self, stack_id):
+		stack = self.stacks[stack_id]
+		name = stack['StackName']
+		if not stack['StackStatus'].endswith('_IN_PROGRESS'):
+			return
+		elapsed = time.monotonic() - self.timeline[name][0]
+		while stack['Schedule'] and stack['Schedule'][0][0] <= elapsed:
+			offset, logical_id, resource_type, status = stack['Schedule'].pop(0)
+			if name in self.failures and status.endswith('_COMPLETE'):
+				continue
+			self._add_event(
+				stack_id, logical_id, resource_type, status,
+				timestamp=stack['StartedAt'] + timedelta(seconds=offset)
+			)
+		if time.monotonic() >= self.timeline[name][1]:
+			operation = stack['Operation']
+			if name in self.failures:
+				self._add_event(stack_id, self.failures[name], 'AWS::EC2::Instance', f'{operation}_FAILED', 'Simulated failure')
+				self._add_event(stack_id, name, 'AWS::CloudFormation::Stack', 'ROLLBACK_IN_PROGRESS')
+				stack['StackStatus'] = 'ROLLBACK_COMPLETE'
+			else:
+				stack['StackStatus'] = f'{operation}_COMPLETE'
+				self._add_event(stack_id, name, 'AWS::CloudFormation::Stack', f'{operation}_COMPLETE')
+
+	def describe_stacks(self, StackName):
+		self._call('describe_stacks')
+		with self.lock:
+			stack_id = self._stack_id(StackName)
+			self._settle(stack_id)
+			stack = self.stacks[stack_id]
+			return {'Stacks': [{
+				'StackName': stack['StackName'],
+				'StackId': stack_id,
+				'StackStatus': stack['StackStatus'],
+				'Parameters': list(stack['Inputs'][1] or []),
+				'Outputs': self._stack_outputs(stack)
+			}]}
+
+	def _stack_outputs(self, stack):
+		if stack['StackStatus'] not in ('CREATE_COMPLETE', 'UPDATE_COMPLETE'):
+			return []
+		return list(self.outputs.get(stack['StackName'], []))
+
+	def list_exports(self, NextToken=None):
+		self._call('list_exports')
+		with self.lock:
+			exports = []
+			for stack_id, stack in self.stacks.items():
+				self._settle(stack_id)
+				exports.extend(
+					{'ExportingStackId': stack_id, 'Name': output['ExportName'], 'Value': output['OutputValue']}
+					for output in self._stack_outputs(stack) if 'ExportName' in output
+				)
+		start = int(NextToken or 0)
+		response = {'Exports': exports[start:start + self.page_size]}
+		if start + self.page_size < len(exports):
+			response['NextToken'] = str(start + self.page_size)
+		return response
+
+	def get_template(self, StackName, TemplateStage='Original'):
+		self._call('get_template')
+		with self.lock:
+			stack = self.stacks[self._stack_id(StackName)]
+			return {'TemplateBody': stack['Inputs'][0]}
+
+	def describe_stack_events(self, StackName, NextToken=None):
+		self._call('describe_stack_events')
+		with self.lock:
+			stack_id = self._stack_id(StackName)
+			self._settle(stack_id)
+			return {'StackEvents': list(self.events.get(stack_id, []))}
+
+	def create_stack(self, StackName, **kwargs):
+		self._call('create_stack')
+		return {'StackId': self._start(StackName, 'CREATE', **kwargs)}
+
+	def update_stack(self, StackName, **kwargs):
+		self._call('update_stack')
+		with self.lock:
+			stack = self.stacks[self._stack_id(StackName)]
+		if stack['Inputs'] == (kwargs.get('TemplateBody'), kwargs.get('Parameters')):
+			raise botocore.exceptions.ClientError(
+				{'Error': {'Code': 'ValidationError', 'Message': 'No updates are to be performed.'}},
+				'UpdateStack'
+			)
+		return {'StackId': self._start(StackName, 'UPDATE', **kwargs)}
+
+	def delete_stack(self, StackName):
+		self._call('delete_stack')
+		with self.lock:
+			inputs = self.stacks[self._stack_id(StackName)]['Inputs']
+		self._start(StackName, 'DELETE', TemplateBody=inputs[0], Parameters=inputs[1])
+
+	def create_change_set(self, StackName, ChangeSetName, **kwargs):
+		self._call('create_change_set')
+		with self.lock:
+			stack = self.stacks[self._stack_id(StackName)]
+		if stack['Inputs'] == (kwargs.get('TemplateBody'), kwargs.get('Parameters')):
+			change_set = {'Status': 'FAILED', 'StatusReason': "The submitted information didn't contain changes."}
+		else:
+			# one change per template line
+			change_set = {'Status': 'CREATE_COMPLETE', 'Changes': [{'ResourceChange': {
+				'Action': 'Modify',
+				'LogicalResourceId': f'Resource{index}',
+				'ResourceType': 'AWS::EC2::VPC',
+				'Replacement': 'False'
+			}} for index, _ in enumerate(kwargs['TemplateBody'].splitlines())]}
+		change_set['Kwargs'] = kwargs
+		self.change_sets[(StackName, ChangeSetName)] = change_set
+
+	def describe_change_set(self, StackName, ChangeSetName, NextToken=None):
+		self._call('describe_change_set')
+		response = dict(self.change_sets[(StackName, ChangeSetName)])
+		if 'Changes' in response:
+			start = int(NextToken or 0)
+			response['Changes'] = response['Changes'][start:start + self.page_size]
+			if start + self.page_size < len(self.change_sets[(StackName, ChangeSetName)]['Changes']):
+				response['NextToken'] = str(start + self.page_size)
+		return response
+
+	def delete_change_set(self, StackName, ChangeSetName):
+		self._call('delete_change_set')
+		del self.change_sets[(StackName, ChangeSetName)]
+
+	def execute_change_set(self, StackName, ChangeSetName):
+		self._call('execute_change_set')
+		change_set = self.change_sets.pop((StackName, ChangeSetName))
+		self._start(StackName, 'UPDATE', **change_set['Kwargs'])
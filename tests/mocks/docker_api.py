@@ -0,0 +1,93 @@
+'''
+Mock docker APIClient streaming build and push output
+'''
+import time
+import threading
+from collections import Counter
+
+class FakeDockerAPI():
+	'''
+	Offline stand-in for docker.APIClient whose pushes take a fixed
+	time and report a given number of layers
+	'''
+	def __init__(self, push_latency=0.0, layers=2, layer_size=1048576, existing=0, fail_push=None, registry=None):
+		self.registry = registry
+		self.repo_digests = {}
+		self.push_latency = push_latency
+		self.layers = layers
+		self.layer_size = layer_size
+		self.existing = existing
+		self.fail_push = fail_push or []
+		self.in_flight = 0
+		self.max_in_flight = 0
+		self.calls = Counter()
+		self.tags = {}
+		self.available = set()
+		self.builds = []
+		self.lock = threading.Lock()
+
+	def login(self, **kwargs):
+		self.calls['login'] += 1
+		return {'Status': 'Login Succeeded'}
+
+	def inspect_image(self, image):
+		return {'Id': image, 'RepoDigests': self.repo_digests.get(image, [])}
+
+	def pull(self, repository, tag, stream=True, auth_config=None, decode=True):
+		self.calls['pull'] += 1
+		in_registry = self.registry is not None and (repository.split('/', 1)[1], tag) in self.registry.tags
+		if f'{repository}:{tag}' not in self.available and not in_registry:
+			yield {'error': f'manifest for {repository}:{tag} not found'}
+			return
+		yield {'status': 'Digest: sha256:abc'}
+
+	def build(self, path, tag, dockerfile, **kwargs):
+		self.calls['build'] += 1
+		self.builds.append(dict(kwargs, tag=tag))
+		yield {'stream': f'Step 1/2 : FROM {dockerfile}\n'}
+		yield {'aux': {'ID': 'sha256:' + tag.replace('/', '-').replace(':', '-')}}
+		yield {'stream': f'Successfully tagged {tag}\n'}
+
+	def tag(self, image, repository, tag, force=False):
+		self.calls['tag'] += 1
+		self.tags[f'{repository}:{tag}'] = image
+		return True
+
+	def push(self, repository, tag, stream=True, auth_config=None, decode=True):
+		with self.lock:
+			self.calls['push'] += 1
+			self.in_flight += 1
+			self.max_in_flight = max(self.max_in_flight, self.in_flight)
+		try:
+			yield {'status': f'The push refers to repository [{repository}]'}
+			if f'{repository}:{tag}' in self.fail_push:
+				yield {'error': 'denied: not authorized', 'errorDetail': {'message': 'denied'}}
+				return
+			for layer in range(self.layers):
+				layer_id = f'layer{layer}'
+				if layer < self.existing:
+					yield {'status': 'Layer already exists', 'id': layer_id}
+					continue
+				yield {'status': 'Preparing', 'id': layer_id}
+				yield {'status': 'Pushing', 'id': layer_id,
+					'progressDetail': {'current': self.layer_size // 2, 'total': self.layer_size}}
+				time.sleep(self.push_latency / max(self.layers, 1))
+				yield {'status': 'Pushing', 'id': layer_id,
+					'progressDetail': {'current': self.layer_size, 'total': self.layer_size}}
+				yield {'status': 'Pushed', 'id': layer_id}
+			yield {'status': f'{tag}: digest: sha256:abc size: 1234'}
+			yield {'progressDetail': {}, 'aux': {'Tag': tag, 'Digest': 'sha256:abc', 'Size': 1234}}
+			with self.lock:
+				self.available.add(f'{repository}:{tag}')
+				local_image = self.tags.get(f'{repository}:{tag}')
+				repo_digests = self.repo_digests.setdefault(local_image, [])
+				if f'{repository}@sha256:abc' not in repo_digests:
+					repo_digests.append(f'{repository}@sha256:abc')
+			if self.registry is not None:
+				self.registry.add_image(
+					repository.split('/', 1)[1], tag, 'sha256:abc',
+					['sha256:config'] + [f'sha256:layer{layer}' for layer in range(self.layers)]
+				)
+		finally:
+			with self.lock:
+				self.in_flight -= 1
@@ -0,0 +1,82 @@
+'''
+Mock ECR image and layer API calls
+'''
+import json
+import threading
+from collections import Counter
+import botocore
+
+class FakeECR():
+	'''
+	Offline stand-in for the boto3 ecr client holding manifests,
+	tags and layers per repository
+	'''
+	def __init__(self, missing_repositories=()):
+		self.missing_repositories = set(missing_repositories)
+		self.manifests = {}
+		self.tags = {}
+		self.layers = {}
+		self.calls = Counter()
+		self.lock = threading.Lock()
+
+	def _error(self, code, operation):
+		return botocore.exceptions.ClientError({'Error': {'Code': code, 'Message': code}}, operation)
+
+	def add_image(self, repository, tag, digest, layers):
+		'''
+		Store an image as a push would
+		'''
+		manifest = json.dumps({
+			'schemaVersion': 2,
+			'config': {'digest': layers[0]},
+			'layers': [{'digest': layer} for layer in layers[1:]]
+		})
+		with self.lock:
+			self.manifests[(repository, digest)] = manifest
+			self.tags[(repository, tag)] = digest
+			self.layers.setdefault(repository, set()).update(layers)
+
+	def get_authorization_token(self, **kwargs):
+		return {'authorizationData': [{'authorizationToken': 'QVdTOnNlY3JldA==', 'proxyEndpoint': ''}]}
+
+	def describe_images(self, registryId, repositoryName, imageIds):
+		self.calls['describe_images'] += 1
+		digest = imageIds[0]['imageDigest']
+		if (repositoryName, digest) not in self.manifests:
+			raise self._error('ImageNotFoundException', 'DescribeImages')
+		return {'imageDetails': [{'repositoryName': repositoryName, 'imageDigest': digest}]}
+
+	def batch_get_image(self, registryId, repositoryName, imageIds, **kwargs):
+		self.calls['batch_get_image'] += 1
+		if repositoryName in self.missing_repositories:
+			raise self._error('RepositoryNotFoundException', 'BatchGetImage')
+		images = []
+		for image_id in imageIds:
+			digest = image_id.get('imageDigest') or self.tags.get((repositoryName, image_id.get('imageTag')))
+			if (repositoryName, digest) in self.manifests:
+				images.append({
+					'imageId': {'imageDigest': digest},
+					'imageManifest': self.manifests[(repositoryName, digest)],
+					'imageManifestMediaType': 'application/vnd.docker.distribution.manifest.v2+json'
+				})
+		return {'images': images, 'failures': []}
+
+	def batch_check_layer_availability(self, registryId, repositoryName, layerDigests):
+		self.calls['batch_check_layer_availability'] += 1
+		available = self.layers.get(repositoryName, set())
+		return {'layers': [
+			{'layerDigest': layer, 'layerAvailability': 'AVAILABLE' if layer in available else 'UNAVAILABLE'}
+			for layer in layerDigests
+		], 'failures': []}
+
+	def put_image(self, registryId, repositoryName, imageManifest, imageTag, **kwargs):
+		self.calls['put_image'] += 1
+		digest = next(
+			digest for (repository, digest), manifest in self.manifests.items() if manifest == imageManifest
+		)
+		with self.lock:
+			if self.tags.get((repositoryName, imageTag)) == digest:
+				raise self._error('ImageAlreadyExistsException', 'PutImage')
+			self.manifests[(repositoryName, digest)] = imageManifest
+			self.tags[(repositoryName, imageTag)] = digest
+		return {'image': {'imageId': {'imageDigest': digest, 'imageTag': imageTag}}}
@@ -0,0 +1,95 @@
+'''
+Mock Anchore Engine API served through a requests transport adapter
+'''
+import json
+import time
+import threading
+from collections import Counter
+from urllib.parse import urlparse, parse_qs
+import requests
+from requests.adapters import BaseAdapter
+
+class FakeEngineAdapter(BaseAdapter):
+	'''
+	Offline stand-in for the engine v1 API that finishes each
+	image analysis after a per-tag latency
+
+	platform_digests: submitted digest to the digest the image is
+		analyzed as, like the platform manifest of a manifest list
+	'''
+	def __init__(self, latencies=None, failures=None, default_latency=0.0, policy_updated='2021-01-01T00:00:00Z',
+			platform_digests=None):
+		super().__init__()
+		self.platform_digests = platform_digests or {}
+		self.submitted = []
+		self.policy_updated = policy_updated
+		self.latencies = latencies or {}
+		self.failures = failures or []
+		self.default_latency = default_latency
+		self.images = {}
+		self.in_flight = 0
+		self.max_in_flight = 0
+		self.calls = Counter()
+		self.lock = threading.Lock()
+
+	def respond(self, request, status, body):
+		response = requests.Response()
+		response.status_code = status
+		response._content = json.dumps(body).encode()
+		response.headers['Content-Type'] = 'application/json'
+		response.request = request
+		response.url = request.url
+		return response
+
+	def send(self, request, **kwargs):
+		with self.lock:
+			self.in_flight += 1
+			self.max_in_flight = max(self.max_in_flight, self.in_flight)
+		try:
+			time.sleep(0.001)
+			return self.handle(request)
+		finally:
+			with self.lock:
+				self.in_flight -= 1
+
+	def handle(self, request):
+		url = urlparse(request.url)
+		parts = url.path.split('/')[2:]
+		self.calls[(request.method, parts[0] if len(parts) < 3 else parts[2])] += 1
+		if request.method == 'POST' and parts == ['images']:
+			image = json.loads(request.body)
+			self.submitted.append(image)
+			tag = image['tag']
+			digest = image.get('digest') or 'sha256:' + tag.replace(':', '-').replace('/', '-')
+			digest = self.platform_digests.get(digest, digest)
+			with self.lock:
+				self.images.setdefault(digest, {'tag': tag, 'submitted': time.monotonic()})
+			return self.respond(request, 200, [{'imageDigest': digest, 'analysis_status': 'not_analyzed'}])
+		if parts == ['policies']:
+			return self.respond(request, 200, [
+				{'policyId': 'default', 'active': True, 'last_updated': self.policy_updated}
+			])
+
+		digest = parts[1]
+		image = self.images.get(digest)
+		if image is None:
+			return self.respond(request, 404, {'message': 'image not found'})
+		if len(parts) == 2:
+			elapsed = time.monotonic() - image['submitted']
+			latency = self.latencies.get(image['tag'], self.default_latency)
+			if elapsed < latency:
+				status = 'analyzing'
+			elif image['tag'] in self.failures:
+				status = 'analysis_failed'
+			else:
+				status = 'analyzed'
+			return self.respond(request, 200, [{'imageDigest': digest, 'analysis_status': status}])
+		if parts[2] == 'vuln':
+			return self.respond(request, 200, {'vulnerabilities': [{'vuln': 'CVE-0000-0001', 'severity': 'High'}]})
+		if parts[2] == 'check':
+			tag = parse_qs(url.query)['tag'][0]
+			return self.respond(request, 200, [{digest: {tag: [{'status': 'pass'}]}}])
+		return self.respond(request, 404, {'message': 'not found'})
+
+	def close(self):
+		pass
@@ -0,0 +1,51 @@
+'''
+Mock S3 object version listing and batched deletes
+'''
+import threading
+from collections import Counter
+import botocore
+
+class FakeS3():
+	'''
+	Offline stand-in for the boto3 s3 client holding object
+	versions and delete markers of one bucket
+	'''
+	def __init__(self, versions=0, delete_markers=0, page_size=1000, failed_keys=None, exists=True):
+		self.exists = exists
+		self.versions = [{'Key': f'key-{number}', 'VersionId': f'v{number}'} for number in range(versions)]
+		self.delete_markers = [{'Key': f'marker-{number}', 'VersionId': f'd{number}'} for number in range(delete_markers)]
+		self.page_size = page_size
+		self.failed_keys = failed_keys or []
+		self.deleted = []
+		self.batches = []
+		self.calls = Counter()
+		self.lock = threading.Lock()
+
+	def get_paginator(self, operation):
+		return self
+
+	def paginate(self, Bucket):
+		self.calls['list_object_versions'] += 1
+		if not self.exists:
+			raise botocore.exceptions.ClientError(
+				{'Error': {'Code': 'NoSuchBucket', 'Message': 'The specified bucket does not exist'}},
+				'ListObjectVersions'
+			)
+		entries = [('Versions', version) for version in self.versions] + \
+			[('DeleteMarkers', marker) for marker in self.delete_markers]
+		for start in range(0, max(len(entries), 1), self.page_size):
+			page = {}
+			for kind, entry in entries[start:start + self.page_size]:
+				page.setdefault(kind, []).append(entry)
+			yield page
+
+	def delete_objects(self, Bucket, Delete):
+		with self.lock:
+			self.calls['delete_objects'] += 1
+			self.batches.append(len(Delete['Objects']))
+			self.deleted.extend(Delete['Objects'])
+		errors = [
+			{'Key': key['Key'], 'VersionId': key['VersionId'], 'Code': 'AccessDenied'}
+			for key in Delete['Objects'] if key['Key'] in self.failed_keys
+		]
+		return {'Errors': errors} if errors else {}
@@ -36,3 +36,23 @@ def mocked_ec2_cluster_template():
     test_obj = AnchoreEngine()
     test_obj.create_ec2_cluster_template()
     return True
+
+def mocked_rds_template():
+    test_obj = AnchoreEngine()
+    test_obj.create_rds_template()
+    return True
+
+def mocked_archive_template():
+    test_obj = AnchoreEngine()
+    test_obj.create_archive_template()
+    return True
+
+def mocked_ecs_services_template():
+    test_obj = AnchoreEngine()
+    test_obj.create_ecs_services_template()
+    return True
+
+def mocked_scan_events_template():
+    test_obj = AnchoreEngine()
+    test_obj.create_scan_events_template()
+    return True
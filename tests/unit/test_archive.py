@@ -0,0 +1,35 @@
+'''
+Test archive template creation, resource creation
+and resource functionality for Anchore Engine catalog archive
+'''
+import os 
+import unittest
+import pytest
+from anchore import archive, main
+from tests.mocks import schema
+import anchore.constants as constants
+
+class TestArchive(unittest.TestCase):
+	def setUp(self):
+		self.template = archive.ArchiveTemplate()
+
+	def test_add_descriptions(self):
+		template_file = self.template.add_descriptions("foobar")
+		self.assertEqual(template_file.to_yaml(), schema.MOCKED_DESCRIPTION)
+
+	def test_add_version(self):
+		template_file = self.template.add_version("2010-09-09")
+		self.assertEqual(template_file.to_yaml(), schema.MOCKED_VERSION)
+
+	def test_create_archive_template(self):
+		test_engine = main.AnchoreEngine()
+		self.assertEqual(test_engine.create_archive_template(), schema.mocked_archive_template())
+
+	def test_archive_bucket_is_private_and_retained(self):
+		self.template.add_archive_bucket()
+		bucket = self.template.cfn_template.to_dict()['Resources'][constants.ARCHIVE_BUCKET]
+		self.assertEqual(bucket['DeletionPolicy'], 'Retain')
+		self.assertTrue(bucket['Properties']['PublicAccessBlockConfiguration']['BlockPublicPolicy'])
+
+	def tearDown(self):
+		self.template = archive.ArchiveTemplate()
@@ -0,0 +1,51 @@
+'''
+Regression-test deployment performance against the offline
+cloudformation stand-in
+'''
+import unittest
+from unittest import mock
+from tasks import cloudformation, stack_timeline
+from tests import benchmark
+from tests.mocks import cfn
+
+class TestBenchmark(unittest.TestCase):
+	def test_deploy_and_teardown(self):
+		result = benchmark.run(9, max_workers=4)
+		self.assertEqual(result['deploy_failed'], 0)
+		self.assertEqual(result['teardown_failed'], 0)
+		self.assertEqual(result['deploy_calls']['create_stack'], 9)
+		self.assertEqual(result['teardown_calls']['delete_stack'], 9)
+		self.assertEqual(result['deploy_throttled'], 0)
+		# three levels of stacks, each taking about 0.08s of simulated resources
+		self.assertLess(result['deploy_seconds'], 9 * 0.08)
+		self.assertLess(result['deploy_api_calls'], 9 * 15)
+
+	def test_throttling_is_counted(self):
+		result = benchmark.run(25, max_workers=4, throttle_rate=1)
+		self.assertGreater(result['deploy_throttled'] + result['teardown_throttled'], 0)
+
+	def test_client_rate_limit_avoids_throttling(self):
+		result = benchmark.run(25, max_workers=4, throttle_rate=1, client_rate=0.8)
+		self.assertEqual(result['deploy_throttled'] + result['teardown_throttled'], 0)
+		self.assertEqual(result['deploy_failed'] + result['teardown_failed'], 0)
+
+	def test_synthetic_stacks_form_a_tree(self):
+		stacks = benchmark.synthetic_stacks(6, fan_out=2)
+		graph = benchmark.graph.build_dependency_graph(stacks)
+		self.assertEqual(graph['BENCH-STACK-0'], set())
+		self.assertEqual(graph['BENCH-STACK-1'], {'BENCH-STACK-0'})
+		self.assertEqual(graph['BENCH-STACK-3'], {'BENCH-STACK-1'})
+		self.assertEqual(graph['BENCH-STACK-5'], {'BENCH-STACK-2'})
+
+	def test_resources_are_provisioned_in_dependency_order(self):
+		client = cfn.FakeCloudFormation(resource_latencies=benchmark.RESOURCE_LATENCIES)
+		client.create_stack('BENCH-STACK-0', TemplateBody=benchmark.synthetic_template(0))
+		with mock.patch.object(cloudformation, 'regional_client', return_value=client), \
+				mock.patch.object(cloudformation, 'WAITER_MIN_DELAY', 0.01):
+			manager = cloudformation.DeploymentManager({'region': benchmark.REGION})
+			manager.waiter.wait('BENCH-STACK-0', 'BENCH-STACK-0', 'CREATE_COMPLETE')
+			timeline = stack_timeline.stack_timeline(manager, 'BENCH-STACK-0')
+		self.assertEqual(
+			timeline['critical_path'],
+			['Role', 'LaunchConfiguration', 'AutoScalingGroup']
+		)
@@ -0,0 +1,105 @@
+'''
+Test the shared boto3 client pool
+'''
+import time
+import unittest
+from unittest import mock
+import botocore
+from tasks import clients
+
+def throttling_error():
+	return botocore.exceptions.ClientError(
+		{'Error': {'Code': 'Throttling', 'Message': 'Rate exceeded'}},
+		'DescribeStacks'
+	)
+
+class TestClients(unittest.TestCase):
+	def setUp(self):
+		clients.clear_clients()
+
+	def test_get_client_is_cached_per_region_and_service(self):
+		client = clients.get_client('cloudformation', 'us-east-2')
+		self.assertIs(clients.get_client('cloudformation', 'us-east-2'), client)
+		self.assertIsNot(clients.get_client('cloudformation', 'us-west-2'), client)
+		self.assertIsNot(clients.get_client('ecr', 'us-east-2'), client)
+		self.assertEqual(client.meta.region_name, 'us-east-2')
+
+	def test_clients_retry_in_adaptive_mode(self):
+		client = clients.get_client('ecr', 'us-east-2')
+		self.assertEqual(client.meta.config.retries['mode'], 'adaptive')
+		self.assertEqual(client.meta.config.retries['total_max_attempts'], clients.MAX_ATTEMPTS)
+
+	def test_backoff_services_retry_in_one_layer(self):
+		client = clients.get_client('cloudformation', 'us-east-2')
+		self.assertEqual(client.meta.config.retries['total_max_attempts'], 1)
+
+	def test_caller_account_is_looked_up_once(self):
+		session = mock.Mock()
+		session.get_credentials.return_value.access_key = 'AKIAEXAMPLE'
+		session.client.return_value.get_caller_identity.return_value = {'Account': '123456789012'}
+		self.assertEqual(clients.caller_account(session, 'us-east-2'), '123456789012')
+		self.assertEqual(clients.caller_account(session, 'us-east-2'), '123456789012')
+		self.assertEqual(session.client.return_value.get_caller_identity.call_count, 1)
+
+	def test_limiter_is_keyed_by_caller_account(self):
+		with mock.patch.object(clients, 'caller_account', return_value='123456789012'):
+			for service in ['cloudformation', 's3']:
+				client = clients.get_client(service, 'us-east-2')
+				client.meta.events.emit(f'before-send.{service}.Operation', request=None)
+		self.assertEqual(set(clients.LIMITERS), {
+			('123456789012', 'us-east-2', 'cloudformation'),
+			('123456789012', 'us-east-2', 's3')
+		})
+
+	def test_limiter_is_shared_per_account_region_and_service(self):
+		limiter = clients.get_limiter('123456789012', 'us-east-2', 'ecr')
+		self.assertIs(clients.get_limiter('123456789012', 'us-east-2', 'ecr'), limiter)
+		self.assertIsNot(clients.get_limiter('123456789012', 'us-west-2', 'ecr'), limiter)
+		self.assertIsNot(clients.get_limiter('210987654321', 'us-east-2', 'ecr'), limiter)
+		self.assertEqual(limiter.rate, clients.SERVICE_RATES['ecr'])
+
+	def test_token_bucket_limits_rate(self):
+		bucket = clients.TokenBucket(100, capacity=1)
+		start = time.monotonic()
+		waits = [bucket.acquire() for _ in range(6)]
+		self.assertEqual(waits[0], 0)
+		self.assertGreaterEqual(time.monotonic() - start, 0.05)
+
+	def test_call_with_backoff_retries_throttling(self):
+		function = mock.Mock(side_effect=[throttling_error(), throttling_error(), 'response'])
+		with mock.patch.object(clients.time, 'sleep') as sleep:
+			self.assertEqual(clients.call_with_backoff(function, StackName='stack'), 'response')
+		function.assert_called_with(StackName='stack')
+		self.assertEqual(sleep.call_count, 2)
+		self.assertLessEqual(sleep.call_args_list[1][0][0], clients.BACKOFF_BASE * 2)
+
+	def test_call_with_backoff_retries_server_errors(self):
+		error = botocore.exceptions.ClientError(
+			{'Error': {'Code': 'InternalFailure'}, 'ResponseMetadata': {'HTTPStatusCode': 500}},
+			'DescribeStacks'
+		)
+		function = mock.Mock(side_effect=[error, botocore.exceptions.EndpointConnectionError(
+			endpoint_url='https://cloudformation.us-east-2.amazonaws.com'
+		), 'response'])
+		with mock.patch.object(clients.time, 'sleep'):
+			self.assertEqual(clients.call_with_backoff(function), 'response')
+		self.assertEqual(function.call_count, 3)
+
+	def test_call_with_backoff_gives_up(self):
+		error = botocore.exceptions.ClientError(
+			{'Error': {'Code': 'ValidationError', 'Message': 'Stack does not exist'}},
+			'DescribeStacks'
+		)
+		function = mock.Mock(side_effect=error)
+		with self.assertRaises(botocore.exceptions.ClientError):
+			clients.call_with_backoff(function)
+		self.assertEqual(function.call_count, 1)
+
+		function = mock.Mock(side_effect=throttling_error())
+		with mock.patch.object(clients.time, 'sleep'), \
+				self.assertRaises(botocore.exceptions.ClientError):
+			clients.call_with_backoff(function)
+		self.assertEqual(function.call_count, clients.BACKOFF_ATTEMPTS)
+
+	def tearDown(self):
+		clients.clear_clients()
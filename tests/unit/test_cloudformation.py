@@ -0,0 +1,191 @@
+'''
+Test cloudformation stack operations and the
+event-streaming stack waiter
+'''
+import os
+import tempfile
+import unittest
+from unittest import mock
+import boto3
+from botocore.stub import Stubber
+from tasks import cloudformation
+import tests.config as config
+from tests.mocks import cfn
+
+CONFIG = {'region': 'us-east-2', 'waiter': {'min_delay': 0.01, 'max_delay': 0.05, 'timeout': 5}}
+
+def stack_event(event_id, status, logical_id='DEMO-STACK', resource_type='AWS::CloudFormation::Stack'):
+	return {
+		'EventId': event_id,
+		'StackId': 'stack-id',
+		'StackName': 'DEMO-STACK',
+		'LogicalResourceId': logical_id,
+		'ResourceType': resource_type,
+		'ResourceStatus': status,
+		'Timestamp': '2019-10-30T10:00:00Z',
+	}
+
+class TestStackEventWaiter(unittest.TestCase):
+	def setUp(self):
+		self.client = boto3.client(
+			'cloudformation',
+			region_name='us-east-2',
+			aws_access_key_id=config.AWS_ACCESS_KEY_ID,
+			aws_secret_access_key=config.AWS_SECRET_ACCESS_KEY,
+			aws_session_token=config.AWS_SESSION_TOKEN,
+		)
+		self.stubber = Stubber(self.client)
+		self.waiter = cloudformation.StackEventWaiter(self.client, 0.01, 0.05, 5)
+
+	def test_new_events_stop_at_cursor(self):
+		self.stubber.add_response(
+			'describe_stack_events',
+			{'StackEvents': [stack_event('e4', 'UPDATE_IN_PROGRESS'), stack_event('e3', 'UPDATE_IN_PROGRESS')], 'NextToken': 'page-2'},
+			{'StackName': 'DEMO-STACK'}
+		)
+		self.stubber.add_response(
+			'describe_stack_events',
+			{'StackEvents': [stack_event('e2', 'UPDATE_IN_PROGRESS'), stack_event('e1', 'CREATE_COMPLETE')], 'NextToken': 'page-3'},
+			{'StackName': 'DEMO-STACK', 'NextToken': 'page-2'}
+		)
+		with self.stubber:
+			events = self.waiter.new_events('DEMO-STACK', 'e1')
+		self.assertEqual([event['EventId'] for event in events], ['e2', 'e3', 'e4'])
+
+	def test_wait_fails_fast_on_resource_failure(self):
+		self.stubber.add_response(
+			'describe_stack_events',
+			{'StackEvents': [
+				stack_event('e3', 'CREATE_IN_PROGRESS', 'Instance', 'AWS::EC2::Instance'),
+				stack_event('e2', 'CREATE_FAILED', 'Subnet', 'AWS::EC2::Subnet'),
+				stack_event('e1', 'CREATE_IN_PROGRESS'),
+			]},
+			{'StackName': 'stack-id'}
+		)
+		with self.stubber:
+			with self.assertRaises(Exception) as error:
+				self.waiter.wait('stack-id', 'DEMO-STACK', 'CREATE_COMPLETE')
+		self.assertIn('Subnet CREATE_FAILED', str(error.exception))
+
+	def test_wait_backs_off_while_quiet(self):
+		self.stubber.add_response(
+			'describe_stack_events',
+			{'StackEvents': [stack_event('e1', 'CREATE_IN_PROGRESS')]},
+			{'StackName': 'stack-id'}
+		)
+		for _ in range(3):
+			self.stubber.add_response(
+				'describe_stack_events',
+				{'StackEvents': [stack_event('e1', 'CREATE_IN_PROGRESS')]},
+				{'StackName': 'stack-id'}
+			)
+		self.stubber.add_response(
+			'describe_stack_events',
+			{'StackEvents': [stack_event('e2', 'CREATE_COMPLETE'), stack_event('e1', 'CREATE_IN_PROGRESS')]},
+			{'StackName': 'stack-id'}
+		)
+		with self.stubber, mock.patch.object(cloudformation.time, 'sleep') as sleep, \
+				mock.patch.object(cloudformation.random, 'uniform', side_effect=lambda low, high: high):
+			event = self.waiter.wait('stack-id', 'DEMO-STACK', 'CREATE_COMPLETE')
+		self.assertEqual(event['EventId'], 'e2')
+		delays = [call.args[0] for call in sleep.call_args_list]
+		self.assertEqual(delays[0], 0.01)
+		self.assertTrue(delays[1] < delays[2] < delays[3] <= 0.05)
+
+	def test_polling_delays_are_jittered(self):
+		delays = [cloudformation.jittered(1) for _ in range(20)]
+		self.assertTrue(all(0.5 <= delay <= 1 for delay in delays))
+		self.assertGreater(len(set(delays)), 1)
+
+class TestDeploymentManager(unittest.TestCase):
+	def setUp(self):
+		self.client = cfn.FakeCloudFormation()
+		patcher = mock.patch.object(cloudformation, 'regional_client', return_value=self.client)
+		patcher.start()
+		self.addCleanup(patcher.stop)
+		self.manager = cloudformation.DeploymentManager(CONFIG)
+
+	def test_create_or_update_stack(self):
+		self.manager.create_or_update_stack('DEMO-STACK', 'template', [])
+		self.assertEqual(self.manager.get_stack_status('DEMO-STACK'), 'CREATE_COMPLETE')
+		self.manager.create_or_update_stack('DEMO-STACK', 'template-v2', [])
+		self.assertEqual(self.manager.get_stack_status('DEMO-STACK'), 'UPDATE_COMPLETE')
+
+	def test_stack_that_cannot_be_updated_fails(self):
+		self.manager.create_or_update_stack('DEMO-STACK', 'template', [])
+		stack_id = self.client.describe_stacks(StackName='DEMO-STACK')['Stacks'][0]['StackId']
+		self.client.stacks[stack_id]['StackStatus'] = 'UPDATE_ROLLBACK_FAILED'
+		with self.assertRaisesRegex(Exception, 'UPDATE_ROLLBACK_FAILED'):
+			self.manager.create_or_update_stack('DEMO-STACK', 'template-v2', [])
+
+	def test_update_ignores_events_before_cursor(self):
+		self.client.failures['DEMO-STACK'] = 'Instance'
+		with self.assertRaises(Exception):
+			self.manager.create_stack('DEMO-STACK', 'template', [])
+		del self.client.failures['DEMO-STACK']
+		self.assertTrue(self.manager.update_stack('DEMO-STACK', 'template-v2', []))
+
+	def test_delete_stack(self):
+		self.manager.create_stack('DEMO-STACK', 'template', [])
+		self.assertTrue(self.manager.delete_stack('DEMO-STACK'))
+		self.assertFalse(self.manager.stack_exists('DEMO-STACK'))
+		self.assertFalse(self.manager.delete_stack('DEMO-STACK'))
+
+class TestIncrementalDeployment(unittest.TestCase):
+	def setUp(self):
+		self.client = cfn.FakeCloudFormation()
+		patcher = mock.patch.object(cloudformation, 'regional_client', return_value=self.client)
+		patcher.start()
+		self.addCleanup(patcher.stop)
+		self.state = tempfile.TemporaryDirectory()
+		self.state_file = os.path.join(self.state.name, 'stacks.json')
+		self.parameters = cloudformation.build_stack_parameters({'Environment': 'DEMO'})
+
+	def manager(self):
+		return cloudformation.DeploymentManager(CONFIG, cloudformation.FingerprintStore(self.state_file))
+
+	def test_template_fingerprint(self):
+		fingerprint = cloudformation.template_fingerprint('template', self.parameters)
+		self.assertEqual(fingerprint, cloudformation.template_fingerprint('template', self.parameters))
+		self.assertNotEqual(fingerprint, cloudformation.template_fingerprint('template-v2', self.parameters))
+		self.assertNotEqual(fingerprint, cloudformation.template_fingerprint(
+			'template',
+			cloudformation.build_stack_parameters({'Environment': 'PROD'})
+		))
+
+	def test_unchanged_stack_is_skipped(self):
+		self.manager().create_or_update_stack('DEMO-STACK', 'template', self.parameters)
+		self.client.calls.clear()
+		self.manager().create_or_update_stack('DEMO-STACK', 'template', self.parameters)
+		self.assertEqual(set(self.client.calls), {'describe_stacks'})
+
+	def test_changed_stack_uses_change_set(self):
+		self.manager().create_or_update_stack('DEMO-STACK', 'template', self.parameters)
+		self.manager().create_or_update_stack('DEMO-STACK', 'template-v2', self.parameters)
+		self.assertEqual(self.client.calls['execute_change_set'], 1)
+		self.assertEqual(self.client.calls['update_stack'], 0)
+		self.assertEqual(self.client.describe_stacks(StackName='DEMO-STACK')['Stacks'][0]['StackStatus'], 'UPDATE_COMPLETE')
+
+	def test_change_set_changes_are_paged(self):
+		self.client.page_size = 2
+		self.manager().create_or_update_stack('DEMO-STACK', 'template', self.parameters)
+		changes = self.manager().create_change_set(
+			'DEMO-STACK', 'a\nb\nc\nd\ne', self.parameters, 'DEMO-STACK-CHANGES'
+		)
+		self.assertEqual(
+			[change['ResourceChange']['LogicalResourceId'] for change in changes],
+			[f'Resource{index}' for index in range(5)]
+		)
+
+	def test_change_set_without_changes_records_fingerprint(self):
+		cloudformation.DeploymentManager(CONFIG).create_or_update_stack('DEMO-STACK', 'template', self.parameters)
+		self.manager().create_or_update_stack('DEMO-STACK', 'template', self.parameters)
+		self.assertEqual(self.client.calls['delete_change_set'], 1)
+		self.assertEqual(self.client.calls['execute_change_set'], 0)
+		self.assertEqual(
+			cloudformation.FingerprintStore(self.state_file).get('us-east-2', 'DEMO-STACK'),
+			cloudformation.template_fingerprint('template', self.parameters)
+		)
+
+	def tearDown(self):
+		self.state.cleanup()
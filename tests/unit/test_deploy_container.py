@@ -0,0 +1,136 @@
+'''
+Test concurrent image build and push against a mocked docker daemon
+'''
+import time
+import unittest
+from unittest import mock
+from tasks import deploy_container, ecr_deployer
+from tests.mocks import docker_api, ecr
+
+ACCOUNT_ID = '123456789012'
+
+def images(count, region='us-east-2'):
+	return [{
+		'remote_image': f'demo/app-{number}',
+		'tag': '1.0',
+		'dockerfile_path': '.',
+		'dockerfile': 'Dockerfile',
+		'region': region,
+		'account_id': ACCOUNT_ID
+	} for number in range(count)]
+
+class TestDeployContainer(unittest.TestCase):
+	def setUp(self):
+		self.registry = ecr.FakeECR()
+		self.docker = docker_api.FakeDockerAPI(push_latency=0.3, registry=self.registry)
+		self.deployers = []
+
+	def deployer(self, config):
+		deployer = ecr_deployer.ECRDeployer(config)
+		deployer._docker_api = self.docker
+		deployer.ecr = self.registry
+		self.deployers.append(deployer)
+		return deployer
+
+	def test_read_image_configs(self):
+		setup_data = [
+			{'region': 'us-east-2', 'resource_name': 'ANCHORE-ECR', 'images': images(2)},
+			{'region': 'us-west-2', 'account_id': ACCOUNT_ID, 'remote_image': 'demo/flat',
+				'tag': '1.0', 'dockerfile_path': '.', 'dockerfile': 'Dockerfile'},
+			{'region': 'us-east-2', 'resource_name': 'ANCHORE-VPC'},
+		]
+		configs = deploy_container.read_image_configs(setup_data)
+		self.assertEqual([image['remote_image'] for image in configs], ['demo/app-0', 'demo/app-1', 'demo/flat'])
+		self.assertEqual(configs[2]['region'], 'us-west-2')
+
+	def test_images_are_pushed_concurrently_with_one_login_per_registry(self):
+		start = time.monotonic()
+		results = deploy_container.deploy_images(images(12), max_workers=12, deployer_factory=self.deployer)
+		elapsed = time.monotonic() - start
+
+		self.assertLess(elapsed, 0.3 * 4)
+		self.assertEqual(len(self.deployers), 1)
+		self.assertEqual(self.docker.calls['login'], 1)
+		self.assertEqual(self.docker.calls['push'], 12)
+		self.assertEqual(self.registry.calls['put_image'], 12)
+		self.assertGreater(self.docker.max_in_flight, 1)
+		for result in results.values():
+			self.assertEqual(result.digest, 'sha256:abc')
+			self.assertEqual(result.bytes_pushed, 2 * 1048576)
+
+	def test_worker_limit_and_failed_push(self):
+		self.docker.fail_push = [f'{ACCOUNT_ID}.dkr.ecr.us-east-2.amazonaws.com/demo/app-1:1.0']
+		configs = images(3) + images(1, region='us-west-2')
+		results = deploy_container.deploy_images(configs, max_workers=2, deployer_factory=self.deployer)
+
+		self.assertLessEqual(self.docker.max_in_flight, 2)
+		self.assertEqual(len(self.deployers), 2)
+		self.assertIsInstance(results['demo/app-1:1.0'], ecr_deployer.docker.errors.APIError)
+		self.assertEqual(self.docker.tags[f'{ACCOUNT_ID}.dkr.ecr.us-east-2.amazonaws.com/demo/app-0:1.0'],
+			'sha256:demo-app-0-1.0')
+
+	def test_build_uses_and_refreshes_registry_cache(self):
+		repository = f'{ACCOUNT_ID}.dkr.ecr.us-east-2.amazonaws.com/demo/app-0'
+		deploy_container.deploy_images(images(1), deployer_factory=self.deployer)
+		self.assertNotIn('cache_from', self.docker.builds[0])
+		self.assertIn(('demo/app-0', 'buildcache'), self.registry.tags)
+
+		deploy_container.deploy_images(images(1), deployer_factory=self.deployer)
+		self.assertEqual(self.docker.builds[1]['cache_from'], [f'{repository}:buildcache'])
+		self.assertNotIn('buildargs', self.docker.builds[1])
+		self.assertEqual(self.docker.calls['push'], 1)
+
+	def test_cache_can_be_disabled(self):
+		config = dict(images(1)[0], cache_tag=None, cache_from=['demo/base:latest'])
+		deploy_container.deploy_images([config], deployer_factory=self.deployer)
+		self.assertEqual(self.docker.calls['pull'], 0)
+		self.assertEqual(self.docker.calls['push'], 1)
+		self.assertEqual(self.docker.builds[0]['cache_from'], ['demo/base:latest'])
+
+	def test_existing_manifest_is_only_retagged(self):
+		deployer = self.deployer({'account_id': ACCOUNT_ID, 'region': 'us-east-2'})
+		auth_config = deployer.ecr_login()
+		first = deployer.publish_image('sha256:local', 'demo/app', '1.0', auth_config)
+		second = deployer.publish_image('sha256:local', 'demo/app', '1.1', auth_config)
+
+		self.assertFalse(first.retagged)
+		self.assertTrue(second.retagged)
+		self.assertEqual(second.digest, 'sha256:abc')
+		self.assertEqual(self.docker.calls['push'], 1)
+		self.assertEqual(self.registry.tags[('demo/app', '1.1')], 'sha256:abc')
+
+	def test_manifest_is_copied_when_all_layers_exist(self):
+		deployer = self.deployer({'account_id': ACCOUNT_ID, 'region': 'us-east-2'})
+		auth_config = deployer.ecr_login()
+		deployer.publish_image('sha256:local', 'demo/app', '1.0', auth_config)
+		self.registry.layers['demo/copy'] = set(self.registry.layers['demo/app'])
+		self.registry.layers['demo/partial'] = {'sha256:config'}
+
+		self.assertTrue(deployer.publish_image('sha256:local', 'demo/copy', '1.0', auth_config).retagged)
+		self.assertFalse(deployer.publish_image('sha256:local', 'demo/partial', '1.0', auth_config).retagged)
+		self.assertEqual(self.docker.calls['push'], 2)
+
+	def test_existing_manifest_is_looked_up_once(self):
+		deployer = self.deployer({'account_id': ACCOUNT_ID, 'region': 'us-east-2'})
+		auth_config = deployer.ecr_login()
+		deployer.publish_image('sha256:local', 'demo/app', '1.0', auth_config)
+		self.registry.calls.clear()
+		self.assertTrue(deployer.publish_image('sha256:local', 'demo/app', '1.1', auth_config).retagged)
+		self.assertEqual(self.registry.calls['batch_get_image'], 1)
+		self.assertEqual(self.registry.calls['describe_images'], 0)
+
+	def test_missing_source_repository_falls_back_to_push(self):
+		deployer = self.deployer({'account_id': ACCOUNT_ID, 'region': 'us-east-2'})
+		auth_config = deployer.ecr_login()
+		deployer.publish_image('sha256:local', 'demo/app', '1.0', auth_config)
+		self.registry.missing_repositories.add('demo/app')
+		self.assertFalse(deployer.publish_image('sha256:local', 'demo/copy', '1.0', auth_config).retagged)
+		self.assertEqual(self.docker.calls['push'], 2)
+
+	def test_push_progress_counts_existing_layers(self):
+		progress = ecr_deployer.PushProgress('demo/app:1.0')
+		for chunk in docker_api.FakeDockerAPI(layers=3, existing=2).push('demo/app', '1.0'):
+			progress.update(chunk)
+		progress.finish()
+		self.assertEqual(progress.existing, {'layer0', 'layer1'})
+		self.assertEqual(list(progress.layers), ['layer2'])
@@ -0,0 +1,126 @@
+'''
+Test dependency-aware stack deployment ordering and
+concurrency against a stubbed cloudformation client
+'''
+import copy
+import tempfile
+import unittest
+from unittest import mock
+import yaml
+from anchore import main
+from tasks import deploy_stacks, stack_graph
+from tests.mocks import cfn
+
+CONFIGS = 'configs/configs.yml'
+
+class TestDeployStacks(unittest.TestCase):
+	def setUp(self):
+		patcher = mock.patch.object(deploy_stacks.cfn, 'WAITER_MIN_DELAY', 0.01)
+		patcher.start()
+		self.addCleanup(patcher.stop)
+		test_engine = main.AnchoreEngine()
+		test_engine.create_vpc_template()
+		test_engine.create_alb_template()
+		test_engine.create_ecs_template()
+		test_engine.create_ec2_cluster_template()
+		test_engine.create_rds_template()
+		test_engine.create_archive_template()
+		test_engine.create_scan_events_template()
+		self.setup_data = deploy_stacks.cfn.load_yaml_file(CONFIGS)
+		self.stacks = {}
+		for single_setup_data in self.setup_data:
+			stack = deploy_stacks.read_stack_config(single_setup_data)
+			self.stacks[stack['stack_name']] = stack
+
+	def test_build_dependency_graph(self):
+		graph = stack_graph.build_dependency_graph(self.stacks)
+		self.assertEqual(graph['DEMO-ANCHORE-VPC'], set())
+		self.assertEqual(graph['DEMO-ANCHORE-ALB'], {'DEMO-ANCHORE-VPC'})
+		self.assertEqual(graph['DEMO-ANCHORE-EC2-INSTANCE'], {'DEMO-ANCHORE-VPC'})
+		self.assertEqual(graph['DEMO-ANCHORE-RDS'], {'DEMO-ANCHORE-VPC'})
+		self.assertEqual(
+			graph['DEMO-ANCHORE-ECS'],
+			{'DEMO-ANCHORE-ALB', 'DEMO-ANCHORE-EC2-INSTANCE', 'DEMO-ANCHORE-RDS', 'DEMO-ANCHORE-ARCHIVE'}
+		)
+		self.assertEqual(graph['DEMO-ANCHORE-ARCHIVE'], set())
+		self.assertEqual(graph['DEMO-ANCHORE-SCAN-EVENTS'], {'DEMO-ANCHORE-ALB', 'DEMO-ANCHORE-VPC'})
+
+	def test_dependency_graph_is_regional(self):
+		self.stacks['DEMO-ANCHORE-VPC']['region'] = 'us-west-2'
+		graph = stack_graph.build_dependency_graph(self.stacks)
+		self.assertEqual(graph['DEMO-ANCHORE-ALB'], set())
+
+	def test_circular_dependency(self):
+		with self.assertRaises(Exception):
+			stack_graph.run_graph({'a': {'b'}, 'b': {'a'}}, print)
+
+	def test_failed_dependency_skips_dependents(self):
+		def action(name):
+			if name == 'a':
+				raise Exception('boom')
+		results = stack_graph.run_graph({'a': set(), 'b': {'a'}, 'c': {'b'}, 'd': set()}, action)
+		self.assertEqual(results, {
+			'a': stack_graph.FAILED,
+			'b': stack_graph.SKIPPED,
+			'c': stack_graph.SKIPPED,
+			'd': stack_graph.SUCCEEDED
+		})
+
+	def test_deploy_stack_runs_independent_stacks_in_parallel(self):
+		client = cfn.FakeCloudFormation({
+			'DEMO-ANCHORE-VPC': 0.1,
+			'DEMO-ANCHORE-ALB': 0.3,
+			'DEMO-ANCHORE-EC2-INSTANCE': 0.3,
+			'DEMO-ANCHORE-ECS': 0.1,
+		})
+		with mock.patch.object(deploy_stacks.cfn, 'regional_client', return_value=client):
+			self.assertTrue(deploy_stacks.deploy_stack(CONFIGS))
+
+		timeline = client.timeline
+		self.assertEqual(len(timeline), 7)
+		vpc_end = timeline['DEMO-ANCHORE-VPC'][1]
+		alb_start, alb_end = timeline['DEMO-ANCHORE-ALB']
+		ec2_start, ec2_end = timeline['DEMO-ANCHORE-EC2-INSTANCE']
+		self.assertGreaterEqual(alb_start, vpc_end)
+		self.assertGreaterEqual(ec2_start, vpc_end)
+		self.assertLess(max(alb_start, ec2_start), min(alb_end, ec2_end))
+		self.assertGreaterEqual(timeline['DEMO-ANCHORE-ECS'][0], max(alb_end, ec2_end))
+
+	def test_deploy_stack_respects_worker_limit(self):
+		client = cfn.FakeCloudFormation({
+			'DEMO-ANCHORE-ALB': 0.2,
+			'DEMO-ANCHORE-EC2-INSTANCE': 0.2,
+		})
+		with mock.patch.object(deploy_stacks.cfn, 'regional_client', return_value=client):
+			deploy_stacks.deploy_stack(CONFIGS, max_workers=1)
+
+		alb_start, alb_end = client.timeline['DEMO-ANCHORE-ALB']
+		ec2_start, ec2_end = client.timeline['DEMO-ANCHORE-EC2-INSTANCE']
+		self.assertTrue(alb_end <= ec2_start or ec2_end <= alb_start)
+
+	def test_deploy_stack_fans_out_regions(self):
+		west = copy.deepcopy(self.setup_data)
+		for single_setup_data in west:
+			single_setup_data['region'] = 'us-west-2'
+		with tempfile.NamedTemporaryFile('w', suffix='.yml') as configs:
+			yaml.safe_dump(self.setup_data + west, configs)
+			configs.flush()
+			clients = {
+				'us-east-2': cfn.FakeCloudFormation({'DEMO-ANCHORE-VPC': 0.2}),
+				'us-west-2': cfn.FakeCloudFormation({'DEMO-ANCHORE-VPC': 0.2}),
+			}
+			with mock.patch.object(
+					deploy_stacks.cfn,
+					'regional_client',
+					side_effect=lambda config: clients[config['region']]):
+				deploy_stacks.deploy_stack(configs.name)
+
+		east_start, east_end = clients['us-east-2'].timeline['DEMO-ANCHORE-VPC']
+		west_start, west_end = clients['us-west-2'].timeline['DEMO-ANCHORE-VPC']
+		self.assertLess(max(east_start, west_start), min(east_end, west_end))
+		for client in clients.values():
+			self.assertEqual(len(client.timeline), 7)
+			self.assertGreaterEqual(
+				client.timeline['DEMO-ANCHORE-ALB'][0],
+				client.timeline['DEMO-ANCHORE-VPC'][1]
+			)
@@ -7,6 +7,7 @@ import unittest
 import pytest
 from anchore import ec2_cluster, main
 from tests.mocks import schema
+import anchore.constants as constants
 
 class TestEC2Cluster(unittest.TestCase):
 	def setUp(self):
@@ -27,5 +28,48 @@ class TestEC2Cluster(unittest.TestCase):
 			schema.mocked_ec2_cluster_template()
 		)
 
+	def test_capacity_provider_replaces_step_scaling(self):
+		test_engine = main.AnchoreEngine()
+		test_engine.create_ec2_cluster_template()
+		template = test_engine.ec2_template.cfn_template.to_dict()
+		resources = template['Resources']
+		provider = resources[constants.CAPACITY_PROVIDER]
+		self.assertEqual(provider['Condition'], constants.MANAGED_SCALING)
+		self.assertEqual(
+			provider['Properties']['AutoScalingGroupProvider']['ManagedScaling']['Status'],
+			'ENABLED'
+		)
+		self.assertEqual(resources[constants.CAPACITY_PROVIDER_ASSOC]['Condition'], constants.MANAGED_SCALING)
+		for title in (constants.SUP, constants.SDP, constants.MHA, constants.CLA):
+			self.assertEqual(resources[title]['Condition'], constants.STEP_SCALING)
+		self.assertEqual(template['Parameters']['ManagedScaling']['Default'], 'false')
+
+	def test_scaling_conditions(self):
+		self.template.add_conditions()
+		conditions = self.template.cfn_template.to_dict()['Conditions']
+		managed = {'Fn::Equals': [{'Ref': 'ManagedScaling'}, 'true']}
+		self.assertEqual(conditions[constants.MANAGED_SCALING], managed)
+		self.assertEqual(conditions[constants.STEP_SCALING], {'Fn::Not': [managed]})
+
+	def test_scratch_volume(self):
+		self.template.add_parameters()
+		self.template.add_conditions()
+		self.template.add_launch_config()
+		template = self.template.cfn_template.to_dict()
+		mappings = template['Resources'][constants.INST_LC]['Properties']['BlockDeviceMappings']
+		condition, scratch, no_value = mappings[1]['Fn::If']
+		self.assertEqual(condition, constants.EBS_SCRATCH)
+		self.assertEqual(scratch['Ebs']['VolumeType'], 'gp3')
+		self.assertEqual(scratch['Ebs']['Throughput'], {'Ref': 'ScratchVolumeThroughput'})
+		self.assertEqual(no_value, {'Ref': 'AWS::NoValue'})
+		self.assertEqual(
+			template['Parameters']['ScratchVolumeType']['AllowedValues'],
+			['gp3', 'instance-store']
+		)
+
+	def test_scratch_volume_user_data(self):
+		self.assertIn('if [ -n "$SCRATCH_DEVICE" ]; then', constants.USERDATA)
+		self.assertIn('/var/lib/anchore-scratch ext4 defaults,noatime,nofail 0 2" >> /etc/fstab', constants.USERDATA)
+
 	def tearDown(self):
 		self.template = ec2_cluster.EC2ClusterTemplate()
@@ -7,6 +7,7 @@ import unittest
 import pytest
 from anchore import ecs, main
 from tests.mocks import schema
+import anchore.constants as constants
 
 class TestECS(unittest.TestCase):
 	def setUp(self):
@@ -24,5 +25,154 @@ class TestECS(unittest.TestCase):
 		test_engine = main.AnchoreEngine()
 		self.assertEqual (test_engine.create_ecs_template(), schema.mocked_ecs_template())
 
+	def test_create_ecs_services_template(self):
+		test_engine = main.AnchoreEngine()
+		self.assertEqual(test_engine.create_ecs_services_template(), schema.mocked_ecs_services_template())
+
+	def test_engine_service_uses_capacity_provider(self):
+		self.template.add_engine_parameters()
+		self.template.add_ecs_service()
+		template = self.template.cfn_template.to_dict()
+		service = template['Resources'][constants.SERVICE]['Properties']
+		condition, strategy, no_value = service['CapacityProviderStrategy']['Fn::If']
+		self.assertEqual(condition, constants.MANAGED_SCALING)
+		self.assertEqual(
+			strategy[0]['CapacityProvider'],
+			{'Fn::ImportValue': {'Fn::Sub': '${Environment}-CAPACITY-PROVIDER'}}
+		)
+		self.assertEqual(no_value, {'Ref': 'AWS::NoValue'})
+		self.assertEqual(
+			service['LaunchType'],
+			{'Fn::If': [constants.MANAGED_SCALING, {'Ref': 'AWS::NoValue'}, 'EC2']}
+		)
+		self.assertIn(constants.MANAGED_SCALING, template['Conditions'])
+
+	def test_add_engine_service(self):
+		self.template.add_parameters()
+		self.template.add_engine_service_parameters('policy_engine', constants.ENGINE_SERVICES['policy_engine'])
+		self.template.add_engine_service('policy_engine', 8087)
+		resources = self.template.cfn_template.to_dict()['Resources']
+		container = resources['PolicyEngineTask']['Properties']['ContainerDefinitions'][0]
+		self.assertEqual(resources['PolicyEngineTask']['Properties']['NetworkMode'], 'bridge')
+		self.assertEqual(container['PortMappings'], [{'ContainerPort': 8087, 'HostPort': 0, 'Protocol': 'tcp'}])
+		self.assertIn('ANCHORE_EXTERNAL_PORT=', container['Command'][-1])
+		self.assertNotIn('NetworkConfiguration', resources['PolicyEngineService']['Properties'])
+		self.assertEqual(container['Cpu'], {'Ref': 'PolicyEngineCpu'})
+		self.assertIn('service start policy_engine', container['Command'][-1])
+		self.assertEqual(resources['PolicyEngineService']['Properties']['LoadBalancers'], [])
+		self.assertEqual(resources['PolicyEngineService']['Properties']['DesiredCount'], {'Ref': 'PolicyEngineDesiredCount'})
+
+	def test_only_apiext_is_load_balanced(self):
+		self.template.add_engine_service('apiext', 8228)
+		service = self.template.cfn_template.to_dict()['Resources']['ApiextService']['Properties']
+		self.assertEqual(service['LoadBalancers'][0]['ContainerPort'], 8228)
+
+	def test_simplequeue_publishes_queue_depth(self):
+		self.template.add_engine_services_parameters()
+		self.template.add_engine_service('simplequeue', 8083, [self.template.queue_metrics_container(8083)])
+		containers = self.template.cfn_template.to_dict()['Resources']['SimplequeueTask']['Properties']['ContainerDefinitions']
+		self.assertEqual([container['Name'] for container in containers], ['anchore-simplequeue', 'queue-metrics'])
+		self.assertFalse(containers[1]['Essential'])
+		self.assertIn('anchore-simplequeue:8083/v1/queues/images_to_analyze/qlen', containers[1]['Command'][0])
+		self.assertEqual(containers[1]['Links'], ['anchore-simplequeue'])
+		self.assertIn('--metric-name AnalyzerQueueDepth', containers[1]['Command'][0])
+
+	def test_add_analyzer_autoscaling(self):
+		self.template.add_engine_services_parameters()
+		self.template.add_engine_service('analyzer', 8084)
+		self.template.add_analyzer_autoscaling()
+		resources = self.template.cfn_template.to_dict()['Resources']
+		target = resources[constants.ANALYZER_SCALABLE_TARGET]['Properties']
+		self.assertEqual(target['ScalableDimension'], 'ecs:service:DesiredCount')
+		self.assertEqual(target['MaxCapacity'], {'Ref': 'AnalyzerMaxCount'})
+		policy = resources[constants.ANALYZER_SCALING_POLICY]['Properties']
+		self.assertEqual(policy['PolicyType'], 'TargetTrackingScaling')
+		tracking = policy['TargetTrackingScalingPolicyConfiguration']
+		self.assertEqual(tracking['TargetValue'], {'Ref': 'AnalyzerTargetQueueDepth'})
+		self.assertEqual(tracking['CustomizedMetricSpecification']['MetricName'], constants.QUEUE_METRIC_NAME)
+		self.assertNotIn('LaunchType', resources['AnalyzerService']['Properties'])
+
+	def test_engine_uses_rds_database(self):
+		self.template.add_ecs_task()
+		containers = self.template.cfn_template.to_dict()['Resources'][constants.TASK]['Properties']['ContainerDefinitions']
+		self.assertEqual([container['Name'] for container in containers], ['anchore-engine'])
+		environment = {variable['Name']: variable['Value'] for variable in containers[0]['Environment']}
+		self.assertEqual(environment['ANCHORE_DB_HOST'], {'Fn::ImportValue': {'Fn::Sub': '${Environment}-DB-HOST'}})
+		self.assertEqual(environment['ANCHORE_DB_PORT'], {'Fn::ImportValue': {'Fn::Sub': '${Environment}-DB-PORT'}})
+
+	def test_add_pgbouncer_service(self):
+		self.template.add_pgbouncer_parameters()
+		self.template.add_pgbouncer_service()
+		template = self.template.cfn_template.to_dict()
+		for title in (constants.SD_NAMESPACE, constants.PGBOUNCER_TASK, constants.PGBOUNCER_SERVICE):
+			self.assertEqual(template['Resources'][title]['Condition'], constants.USE_PGBOUNCER)
+		container = template['Resources'][constants.PGBOUNCER_TASK]['Properties']['ContainerDefinitions'][0]
+		environment = {variable['Name']: variable['Value'] for variable in container['Environment']}
+		self.assertEqual(environment['POOL_MODE'], 'transaction')
+		self.assertEqual(environment['LISTEN_PORT'], str(constants.PGBOUNCER_PORT))
+		self.assertEqual(template['Resources'][constants.PGBOUNCER_TASK]['Properties']['NetworkMode'], 'awsvpc')
+		deployment = template['Resources'][constants.PGBOUNCER_SERVICE]['Properties']['DeploymentConfiguration']
+		self.assertEqual(deployment['MaximumPercent'], 100)
+		self.assertEqual(
+			template['Outputs']['PgBouncerEndpoint']['Export'],
+			{'Name': {'Fn::Sub': '${Environment}-PGBOUNCER-ENDPOINT'}}
+		)
+
+	def test_pooled_engine_service_connects_through_pgbouncer(self):
+		self.template.add_engine_service('catalog', 8082, pooled=True)
+		container = self.template.cfn_template.to_dict()['Resources']['CatalogTask']['Properties']['ContainerDefinitions'][0]
+		environment = {variable['Name']: variable['Value'] for variable in container['Environment']}
+		self.assertEqual(environment['ANCHORE_DB_HOST']['Fn::If'][0], constants.USE_PGBOUNCER)
+		self.assertEqual(environment['ANCHORE_DB_PORT']['Fn::If'][1], str(constants.PGBOUNCER_PORT))
+
+	def test_task_role_archive_access(self):
+		self.template.add_ecs_task_role(archive=True)
+		policies = self.template.cfn_template.to_dict()['Resources'][constants.TASK_ROLE]['Properties']['Policies']
+		archive_policy = policies[-1]
+		self.assertEqual(archive_policy['PolicyName'], 'AnchoreArchiveBucket')
+		object_statement = archive_policy['PolicyDocument']['Statement'][1]
+		self.assertIn('s3:PutObject', object_statement['Action'])
+
+	def test_task_role_without_archive(self):
+		self.template.add_ecs_task_role()
+		policies = self.template.cfn_template.to_dict()['Resources'][constants.TASK_ROLE]['Properties']['Policies']
+		self.assertNotIn('AnchoreArchiveBucket', [policy['PolicyName'] for policy in policies])
+
+	def test_analyzer_mounts_scratch_volume(self):
+		self.template.add_engine_service_parameters('analyzer', constants.ENGINE_SERVICES['analyzer'])
+		self.template.add_engine_service(
+			'analyzer', 8084,
+			environment=[ecs.analyzer_threads_environment('analyzer')],
+			scratch=True
+		)
+		template = self.template.cfn_template.to_dict()
+		task = template['Resources']['AnalyzerTask']['Properties']
+		self.assertEqual(task['Volumes'][0]['Host']['SourcePath'], constants.SCRATCH_HOST_PATH)
+		container = task['ContainerDefinitions'][0]
+		self.assertEqual(container['MountPoints'][0]['ContainerPath'], constants.SCRATCH_CONTAINER_PATH)
+		environment = {variable['Name']: variable['Value'] for variable in container['Environment']}
+		self.assertEqual(environment['ANCHORE_MAX_THREADS'], {'Ref': 'AnalyzerMaxThreads'})
+		self.assertEqual(template['Parameters']['AnalyzerMaxThreads']['Default'], '4')
+
+	def test_engine_task_sizing(self):
+		self.template.add_engine_parameters()
+		self.template.add_ecs_task()
+		container = self.template.cfn_template.to_dict()['Resources'][constants.TASK]['Properties']['ContainerDefinitions'][0]
+		self.assertEqual(container['Cpu'], {'Ref': 'EngineCpu'})
+		self.assertEqual(container['MountPoints'][0]['SourceVolume'], constants.SCRATCH_VOLUME)
+
+	def test_engine_uses_s3_archive(self):
+		test_engine = main.AnchoreEngine()
+		test_engine.create_ecs_template()
+		resources = test_engine.ecs_template.cfn_template.to_dict()['Resources']
+		container = resources[constants.TASK]['Properties']['ContainerDefinitions'][0]
+		environment = {variable['Name']: variable['Value'] for variable in container['Environment']}
+		self.assertEqual(
+			environment['ANCHORE_ARCHIVE_BUCKET'],
+			{'Fn::ImportValue': {'Fn::Sub': '${Environment}-ARCHIVE-BUCKET'}}
+		)
+		policies = resources[constants.TASK_ROLE]['Properties']['Policies']
+		self.assertEqual(policies[-1]['PolicyName'], 'AnchoreArchiveBucket')
+
 	def tearDown(self):
 		self.template = ecs.ECSTemplate()
@@ -0,0 +1,67 @@
+'''
+Test per-service Anchore Engine configuration overlays
+'''
+import os
+import tempfile
+import unittest
+import yaml
+from anchore import engine_config
+import anchore.constants as constants
+
+class TestEngineConfig(unittest.TestCase):
+	def setUp(self):
+		self.base = engine_config.load_engine_config()
+
+	def test_merge_config(self):
+		merged = engine_config.merge_config({'a': {'b': 1, 'c': 2}, 'd': 3}, {'a': {'b': 4}})
+		self.assertEqual(merged, {'a': {'b': 4, 'c': 2}, 'd': 3})
+
+	def test_service_config_enables_one_service(self):
+		config = engine_config.service_config(self.base, 'analyzer', {'services': {'analyzer': {'max_threads': 4}}})
+		enabled = [name for name, service in config['services'].items() if service['enabled']]
+		self.assertEqual(enabled, ['analyzer'])
+		self.assertEqual(config['services']['analyzer']['max_threads'], 4)
+		self.assertEqual(config['services']['analyzer']['port'], 8084)
+		self.assertTrue(self.base['services']['apiext']['enabled'])
+
+	def test_service_overrides_size_database_pool(self):
+		overrides = engine_config.service_overrides({
+			'DbPoolSize': 5,
+			'DbPoolMaxOverflow': 10,
+			'Config': {'services': {'analyzer': {'max_threads': 4}}}
+		})
+		config = engine_config.service_config(self.base, 'analyzer', overrides)
+		self.assertEqual(config['credentials']['database']['db_pool_size'], 5)
+		self.assertEqual(config['credentials']['database']['db_pool_max_overflow'], 10)
+		self.assertEqual(config['credentials']['database']['db_connect_args'], {'timeout': 120, 'ssl': False})
+		self.assertEqual(config['services']['analyzer']['max_threads'], 4)
+
+	def test_base_config_uses_s3_archive(self):
+		self.assertEqual(engine_config.merge_config(self.base, constants.ARCHIVE_CONFIG), self.base)
+
+	def test_write_service_configs(self):
+		with tempfile.TemporaryDirectory() as output_dir:
+			files = engine_config.write_service_configs(
+				{'apiext': {}, 'catalog': {}},
+				output_dir=output_dir
+			)
+			self.assertEqual(files, [
+				os.path.join(output_dir, 'apiext', 'config.yaml'),
+				os.path.join(output_dir, 'catalog', 'config.yaml'),
+			])
+			with open(files[0]) as config_file:
+				content = config_file.read()
+		self.assertIn('host_id: ${ANCHORE_HOST_ID}', content)
+		self.assertTrue(yaml.safe_load(content)['services']['apiext']['enabled'])
+
+	def test_committed_service_configs_are_current(self):
+		with tempfile.TemporaryDirectory() as output_dir:
+			for filename in engine_config.write_service_configs(
+					{service: engine_config.service_overrides(sizing) for service, sizing in constants.ENGINE_SERVICES.items()},
+					output_dir=output_dir):
+				committed = os.path.join(
+					constants.ENGINE_SERVICES_CONFIG_DIR,
+					os.path.relpath(filename, output_dir)
+				)
+				with open(filename) as generated, open(committed) as current:
+					self.assertEqual(generated.read().splitlines()[1:], current.read().splitlines()[1:])
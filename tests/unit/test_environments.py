@@ -0,0 +1,55 @@
+'''
+Test per-environment template variants
+'''
+import os
+import tempfile
+import unittest
+from anchore import main, environments
+from tasks.stack_graph import load_template
+
+class TestEnvironments(unittest.TestCase):
+	def setUp(self):
+		self.cwd = os.getcwd()
+		self.workdir = tempfile.TemporaryDirectory()
+		os.chdir(self.workdir.name)
+		self.engine = main.AnchoreEngine()
+
+	def test_builders_can_run_twice(self):
+		self.assertTrue(self.engine.create_vpc_template())
+		self.assertTrue(self.engine.create_vpc_template())
+		self.assertTrue(self.engine.create_ec2_cluster_template())
+		self.assertTrue(self.engine.create_ec2_cluster_template())
+
+	def test_variant_filename(self):
+		self.assertEqual(environments.variant_filename('anchore_vpc.yml', 'DEMO'), 'anchore_vpc_demo.yml')
+
+	def test_create_environment_templates(self):
+		files = self.engine.create_environment_templates('create_ec2_cluster_template', {
+			'DEMO': {'InstanceType': 'm4.large', 'ClusterSize': '2'},
+			'PROD': {'InstanceType': 'm5.2xlarge', 'ClusterSize': '6'},
+		})
+		self.assertEqual(files, ['anchore_ec2_cluster_demo.yml', 'anchore_ec2_cluster_prod.yml'])
+		with open('anchore_ec2_cluster.yml') as base_file:
+			base = load_template(base_file.read())
+		with open('anchore_ec2_cluster_prod.yml') as prod_file:
+			prod = load_template(prod_file.read())
+		self.assertEqual(prod['Parameters']['Environment']['Default'], 'PROD')
+		self.assertEqual(prod['Parameters']['InstanceType']['Default'], 'm5.2xlarge')
+		self.assertEqual(prod['Parameters']['ClusterSize']['Default'], '6')
+		self.assertNotIn('Default', base['Parameters']['InstanceType'])
+		self.assertEqual(prod['Resources'], base['Resources'])
+
+	def test_unknown_parameter(self):
+		template = {'Parameters': {'Environment': {'Type': 'String'}}, 'Resources': {}}
+		with self.assertRaises(Exception):
+			environments.template_variant(template, {'VPCCIDRBlock': '10.1.0.0/16'})
+
+	def test_variant_does_not_modify_base(self):
+		template = {'Parameters': {'Environment': {'Type': 'String'}}, 'Resources': {}}
+		variant = environments.template_variant(template, {'Environment': 'DEMO'})
+		self.assertEqual(variant['Parameters']['Environment']['Default'], 'DEMO')
+		self.assertNotIn('Default', template['Parameters']['Environment'])
+
+	def tearDown(self):
+		os.chdir(self.cwd)
+		self.workdir.cleanup()
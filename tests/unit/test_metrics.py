@@ -0,0 +1,99 @@
+'''
+Test AWS API call accounting through botocore event hooks
+'''
+import os
+import json
+import tempfile
+import unittest
+from unittest import mock
+import boto3
+import botocore
+from botocore.awsrequest import AWSResponse
+import tests.config as config
+from tasks import metrics
+
+DESCRIBE_STACKS = b'''<DescribeStacksResponse>
+<DescribeStacksResult><Stacks/></DescribeStacksResult>
+<ResponseMetadata><RequestId>1</RequestId></ResponseMetadata>
+</DescribeStacksResponse>'''
+
+THROTTLED = b'''<ErrorResponse>
+<Error><Type>Sender</Type><Code>Throttling</Code><Message>Rate exceeded</Message></Error>
+<RequestId>1</RequestId>
+</ErrorResponse>'''
+
+class RawResponse():
+	def __init__(self, body):
+		self.body = body
+
+	def stream(self, **kwargs):
+		yield self.body
+
+class TestMetrics(unittest.TestCase):
+	def setUp(self):
+		self.metrics = metrics.CallMetrics()
+		self.client = self.metrics.instrument(boto3.session.Session(
+			aws_access_key_id=config.AWS_ACCESS_KEY_ID,
+			aws_secret_access_key=config.AWS_SECRET_ACCESS_KEY,
+			aws_session_token=config.AWS_SESSION_TOKEN,
+		).client('cloudformation', region_name='us-east-2'))
+		self.responses = []
+		self.client.meta.events.register('before-send', self.send)
+		patcher = mock.patch('botocore.endpoint.time.sleep')
+		patcher.start()
+		self.addCleanup(patcher.stop)
+
+	def send(self, request, **kwargs):
+		status, body = self.responses.pop(0)
+		return AWSResponse(request.url, status, {}, RawResponse(body))
+
+	def stats(self, operation='DescribeStacks'):
+		return self.metrics.operations[('cloudformation', 'us-east-2', operation)]
+
+	def test_calls_and_latency_are_recorded(self):
+		self.responses = [(200, DESCRIBE_STACKS), (200, DESCRIBE_STACKS)]
+		self.client.describe_stacks()
+		self.client.describe_stacks()
+		stats = self.stats()
+		self.assertEqual((stats.calls, stats.retries, stats.throttles, stats.errors), (2, 0, 0, 0))
+		self.assertEqual(sum(stats.histogram), 2)
+		self.assertEqual(len(stats.samples), 2)
+
+	def test_throttled_attempts_are_retried_and_counted(self):
+		self.responses = [(400, THROTTLED), (400, THROTTLED), (200, DESCRIBE_STACKS)]
+		self.client.describe_stacks()
+		stats = self.stats()
+		self.assertEqual((stats.calls, stats.retries, stats.throttles, stats.errors), (1, 2, 2, 0))
+
+	def test_failed_calls_are_errors(self):
+		self.responses = [(400, THROTTLED)] * 10
+		with self.assertRaises(botocore.exceptions.ClientError):
+			self.client.describe_stacks()
+		stats = self.stats()
+		self.assertEqual(stats.calls, 1)
+		self.assertEqual(stats.errors, 1)
+		self.assertEqual(stats.throttles, stats.retries + 1)
+
+	def test_summary_and_emf(self):
+		self.responses = [(200, DESCRIBE_STACKS)]
+		self.client.describe_stacks()
+		lines = self.metrics.summary_lines()
+		self.assertEqual(lines[0], 'AWS API calls: 1 calls, 0 retries, 0 throttled, 0 errors')
+		self.assertIn('DescribeStacks', lines[2])
+
+		with tempfile.TemporaryDirectory() as directory:
+			emf = os.path.join(directory, 'metrics.jsonl')
+			self.metrics.dump(emf)
+			with open(emf, 'r') as emf_file:
+				records = [json.loads(line) for line in emf_file]
+		self.assertEqual(len(records), 1)
+		self.assertEqual(records[0]['Operation'], 'DescribeStacks')
+		self.assertEqual(records[0]['Calls'], 1)
+		self.assertEqual(records[0]['_aws']['CloudWatchMetrics'][0]['Namespace'], metrics.EMF_NAMESPACE)
+
+	def test_percentile(self):
+		stats = metrics.OperationStats()
+		for milliseconds in [5, 5, 5, 40, 20000]:
+			stats.add_latency(milliseconds)
+		self.assertEqual(stats.percentile(0.5), 10)
+		self.assertEqual(stats.percentile(0.99), 20000)
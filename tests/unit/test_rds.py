@@ -0,0 +1,64 @@
+'''
+Test rds template creation, resource creation
+and resource functionality for Anchore Engine database
+'''
+import os 
+import unittest
+import pytest
+from anchore import rds, main
+from tests.mocks import schema
+import anchore.constants as constants
+
+class TestRDS(unittest.TestCase):
+	def setUp(self):
+		self.template = rds.RDSTemplate()
+
+	def test_add_descriptions(self):
+		template_file = self.template.add_descriptions("foobar")
+		self.assertEqual(template_file.to_yaml(), schema.MOCKED_DESCRIPTION)
+
+	def test_add_version(self):
+		template_file = self.template.add_version("2010-09-09")
+		self.assertEqual(template_file.to_yaml(), schema.MOCKED_VERSION)
+
+	def test_create_rds_template(self):
+		test_engine = main.AnchoreEngine()
+		self.assertEqual(test_engine.create_rds_template(), schema.mocked_rds_template())
+
+	def test_database_in_private_subnets(self):
+		self.template.add_db_subnet_group()
+		self.template.add_db_instance()
+		resources = self.template.cfn_template.to_dict()['Resources']
+		self.assertEqual(
+			resources[constants.DB_SUBNET_GROUP]['Properties']['SubnetIds'],
+			[
+				{'Fn::ImportValue': {'Fn::Sub': '${Environment}-PRIVATE-SUBNET-1'}},
+				{'Fn::ImportValue': {'Fn::Sub': '${Environment}-PRIVATE-SUBNET-2'}},
+			]
+		)
+		instance = resources[constants.DB_INSTANCE]
+		self.assertEqual(instance['DeletionPolicy'], 'Snapshot')
+		self.assertFalse(instance['Properties']['PubliclyAccessible'])
+		self.assertEqual(instance['Properties']['DBParameterGroupName'], {'Ref': constants.DB_PARAMS})
+
+	def test_read_replicas_are_conditional(self):
+		self.template.add_parameters()
+		self.template.add_conditions()
+		self.template.add_read_replicas()
+		template = self.template.cfn_template.to_dict()
+		self.assertEqual(
+			template['Conditions']['HasReadReplica2'],
+			{'Fn::Equals': [{'Ref': 'ReadReplicaCount'}, '2']}
+		)
+		self.assertEqual(len(template['Conditions']['HasReadReplica1']['Fn::Or']), 2)
+		for number in range(1, constants.MAX_READ_REPLICAS + 1):
+			replica = template['Resources'][f'{constants.DB_REPLICA}{number}']
+			self.assertEqual(replica['Condition'], f'HasReadReplica{number}')
+			self.assertEqual(
+				replica['Properties']['SourceDBInstanceIdentifier'],
+				{'Ref': constants.DB_INSTANCE}
+			)
+			self.assertEqual(template['Outputs'][f'DatabaseReadHost{number}']['Condition'], f'HasReadReplica{number}')
+
+	def tearDown(self):
+		self.template = rds.RDSTemplate()
@@ -0,0 +1,58 @@
+'''
+Test parallel template rendering and the render cache
+'''
+import os
+import tempfile
+import unittest
+from unittest import mock
+from anchore import main, render_cache
+import anchore.constants as constants
+
+BUILDERS = [
+	'create_vpc_template',
+	'create_alb_template',
+	'create_ecs_template',
+	'create_ec2_cluster_template'
+]
+
+class TestRenderCache(unittest.TestCase):
+	def setUp(self):
+		self.cwd = os.getcwd()
+		self.workdir = tempfile.TemporaryDirectory()
+		os.chdir(self.workdir.name)
+		self.engine = main.AnchoreEngine()
+
+	def test_create_templates_renders_all(self):
+		self.assertEqual(self.engine.create_templates(BUILDERS, max_workers=2), BUILDERS)
+		for template in [constants.VPC_TEMPLATE, constants.ALB_TEMPLATE, constants.ECS_TEMPLATE, constants.EC2_INST_TEMPLATE]:
+			self.assertTrue(os.path.exists(template))
+
+	def test_unchanged_templates_are_not_rewritten(self):
+		self.engine.create_templates(BUILDERS, max_workers=2)
+		modified = os.stat(constants.VPC_TEMPLATE).st_mtime_ns
+		self.assertEqual(self.engine.create_templates(BUILDERS), [])
+		self.assertEqual(os.stat(constants.VPC_TEMPLATE).st_mtime_ns, modified)
+
+	def test_missing_template_is_restored_from_cache(self):
+		self.engine.create_templates(['create_vpc_template'])
+		with open(constants.VPC_TEMPLATE) as template:
+			rendered = template.read()
+		os.remove(constants.VPC_TEMPLATE)
+		self.assertEqual(self.engine.create_templates(['create_vpc_template']), [])
+		with open(constants.VPC_TEMPLATE) as template:
+			self.assertEqual(template.read(), rendered)
+
+	def test_changed_inputs_render_again(self):
+		self.engine.create_templates(['create_vpc_template'])
+		with mock.patch.object(render_cache.troposphere, '__version__', '0.0.0'):
+			self.assertEqual(self.engine.create_templates(['create_vpc_template']), ['create_vpc_template'])
+
+	def test_builder_key(self):
+		key = render_cache.builder_key('create_vpc_template', ['anchore.vpc'])
+		self.assertEqual(key, render_cache.builder_key('create_vpc_template', ['anchore.vpc']))
+		self.assertNotEqual(key, render_cache.builder_key('create_alb_template', ['anchore.vpc']))
+		self.assertNotEqual(key, render_cache.builder_key('create_vpc_template', ['anchore.alb']))
+
+	def tearDown(self):
+		os.chdir(self.cwd)
+		self.workdir.cleanup()
@@ -0,0 +1,64 @@
+'''
+Test the scan result cache and ECR digest resolution
+'''
+import io
+import json
+import tempfile
+import unittest
+from unittest import mock
+from botocore.stub import Stubber
+from tasks import clients, scan_cache
+from tasks.ecr_deployer import ECRDeployer
+
+DIGEST = 'sha256:' + 'a' * 64
+REGISTRY = '123456789012.dkr.ecr.us-east-2.amazonaws.com'
+
+class TestScanCache(unittest.TestCase):
+	def setUp(self):
+		self.directory = tempfile.TemporaryDirectory()
+		self.cache = scan_cache.ScanCache(self.directory.name, ttl=60)
+
+	def test_put_and_get(self):
+		self.assertIsNone(self.cache.get(DIGEST, 'default@1'))
+		self.cache.put(DIGEST, 'default@1', {'status': 'analyzed'})
+		self.assertEqual(self.cache.get(DIGEST, 'default@1'), {'status': 'analyzed'})
+		self.assertIsNone(self.cache.get(DIGEST, 'default@2'))
+
+	def test_stale_entry_is_ignored(self):
+		self.cache.put(DIGEST, 'none', {'status': 'analyzed'})
+		with mock.patch('time.time', return_value=scan_cache.time.time() + 120):
+			self.assertIsNone(self.cache.get(DIGEST, 'none'))
+
+	def test_s3_cache(self):
+		clients.clear_clients()
+		cache = scan_cache.ScanCache('s3://scan-cache/results', region='us-east-2')
+		key = f'results/{scan_cache.cache_key(DIGEST, "none")}'
+		entry = {'scanned_at': scan_cache.time.time(), 'result': {'status': 'analyzed'}}
+		with Stubber(cache.s3) as stubber:
+			stubber.add_client_error('get_object', 'NoSuchKey', http_status_code=404,
+				expected_params={'Bucket': 'scan-cache', 'Key': key})
+			stubber.add_response('get_object', {'Body': io.BytesIO(json.dumps(entry).encode())},
+				{'Bucket': 'scan-cache', 'Key': key})
+			self.assertIsNone(cache.get(DIGEST, 'none'))
+			self.assertEqual(cache.get(DIGEST, 'none'), {'status': 'analyzed'})
+		clients.clear_clients()
+
+	def test_resolve_ecr_digests(self):
+		deployer = ECRDeployer({'region': 'us-east-2', 'account_id': '123456789012'})
+		with Stubber(deployer.ecr) as stubber:
+			stubber.add_response('batch_get_image', {
+				'images': [{'imageId': {'imageTag': '1.0', 'imageDigest': DIGEST}}],
+				'failures': [{'imageId': {'imageTag': '2.0'}, 'failureCode': 'ImageNotFound'}]
+			}, {
+				'registryId': '123456789012',
+				'repositoryName': 'anchore/app',
+				'imageIds': [{'imageTag': '1.0'}, {'imageTag': '2.0'}]
+			})
+			digests = scan_cache.resolve_ecr_digests(
+				[f'{REGISTRY}/anchore/app:1.0', f'{REGISTRY}/anchore/app:2.0', 'nginx:1.0'],
+				lambda config: deployer
+			)
+		self.assertEqual(digests, {f'{REGISTRY}/anchore/app:1.0': DIGEST})
+
+	def tearDown(self):
+		self.directory.cleanup()
@@ -0,0 +1,108 @@
+'''
+Test concurrent image submission, analysis polling and
+result collection against a mocked Anchore Engine API
+'''
+import time
+import tempfile
+import unittest
+from unittest import mock
+from concurrent.futures import ThreadPoolExecutor
+from tasks import scan_client, scan_cache
+from tests.mocks import engine
+
+URL = 'http://engine.local:8228/v1'
+
+class TestScanClient(unittest.TestCase):
+	def setUp(self):
+		patcher = mock.patch.object(scan_client, 'POLL_MIN_DELAY', 0.05)
+		patcher.start()
+		self.addCleanup(patcher.stop)
+		patcher = mock.patch.object(scan_client, 'POLL_MAX_DELAY', 0.1)
+		patcher.start()
+		self.addCleanup(patcher.stop)
+		self.client = scan_client.EngineClient(URL, 'admin', 'foobar', pool_size=8)
+
+	def mount(self, adapter):
+		self.client.session.mount('http://', adapter)
+		return adapter
+
+	def test_scan_takes_as_long_as_slowest_analysis(self):
+		tags = [f'registry.local/app-{number}:1.0' for number in range(40)]
+		adapter = self.mount(engine.FakeEngineAdapter(
+			latencies={tags[0]: 0.6},
+			default_latency=0.3
+		))
+		start = time.monotonic()
+		results = scan_client.scan_images(self.client, tags, max_workers=8)
+		elapsed = time.monotonic() - start
+
+		self.assertLess(elapsed, 2)
+		self.assertEqual(list(results), tags)
+		self.assertTrue(all(result['status'] == scan_client.ANALYZED for result in results.values()))
+		self.assertEqual(len(results[tags[0]]['vulnerabilities']), 1)
+		self.assertLessEqual(adapter.max_in_flight, 8)
+		self.assertEqual(adapter.calls[('POST', 'images')], 40)
+
+	def test_policy_and_failed_analysis(self):
+		self.mount(engine.FakeEngineAdapter(failures=['registry.local/broken:1.0']))
+		results = scan_client.scan_images(
+			self.client,
+			['registry.local/app:1.0', 'registry.local/broken:1.0'],
+			policy=True
+		)
+		self.assertEqual(results['registry.local/app:1.0']['policy'], 'pass')
+		self.assertEqual(results['registry.local/broken:1.0']['status'], scan_client.ANALYSIS_FAILED)
+		self.assertNotIn('vulnerabilities', results['registry.local/broken:1.0'])
+
+	def test_wait_for_analysis_times_out(self):
+		self.mount(engine.FakeEngineAdapter(default_latency=60))
+		digest = self.client.add_image('registry.local/slow:1.0')
+		with ThreadPoolExecutor(max_workers=2) as executor:
+			statuses = scan_client.wait_for_analysis(self.client, [digest], executor, timeout=0.2)
+		self.assertEqual(statuses, {digest: scan_client.TIMED_OUT})
+
+	def test_admin_password_is_read_from_ssm(self):
+		ssm = mock.Mock()
+		ssm.get_parameter.return_value = {'Parameter': {'Value': 'secret'}}
+		with mock.patch.dict(scan_client.os.environ, {'ANCHORE_CLI_PASS_PARAMETER': '/anchore/admin-password'}), \
+				mock.patch.object(scan_client.clients, 'get_client', return_value=ssm):
+			self.assertEqual(scan_client.admin_password(), 'secret')
+		ssm.get_parameter.assert_called_once_with(Name='/anchore/admin-password', WithDecryption=True)
+
+	def test_read_manifest(self):
+		with mock.patch('builtins.open', mock.mock_open(read_data='# release\nnginx:1.0\n\nredis:6\n')):
+			self.assertEqual(scan_client.read_manifest('manifest.txt'), ['nginx:1.0', 'redis:6'])
+
+	def test_cached_images_are_not_submitted(self):
+		tags = ['registry.local/app:1.0', 'registry.local/api:1.0']
+		digests = {tag: 'sha256:' + tag.replace(':', '-').replace('/', '-') for tag in tags}
+		with tempfile.TemporaryDirectory() as directory:
+			cache = scan_cache.ScanCache(directory)
+			adapter = self.mount(engine.FakeEngineAdapter())
+			scan_client.scan_images(self.client, tags[:1], policy=True, cache=cache, digests=digests)
+			results = scan_client.scan_images(self.client, tags, policy=True, cache=cache, digests=digests)
+
+			self.assertTrue(results[tags[0]]['cached'])
+			self.assertNotIn('cached', results[tags[1]])
+			self.assertEqual(adapter.calls[('POST', 'images')], 2)
+
+			adapter.policy_updated = '2021-02-01T00:00:00Z'
+			results = scan_client.scan_images(self.client, tags, policy=True, cache=cache, digests=digests)
+			self.assertFalse(any(result.get('cached') for result in results.values()))
+
+	def test_manifest_list_is_cached_under_resolved_digest(self):
+		tag = 'registry.local/multiarch:1.0'
+		digests = {tag: 'sha256:manifest-list'}
+		with tempfile.TemporaryDirectory() as directory:
+			cache = scan_cache.ScanCache(directory)
+			adapter = self.mount(engine.FakeEngineAdapter(
+				platform_digests={'sha256:manifest-list': 'sha256:linux-amd64'}
+			))
+			result = scan_client.scan_images(self.client, [tag], cache=cache, digests=digests)[tag]
+			self.assertEqual(result['digest'], 'sha256:linux-amd64')
+			self.assertEqual(adapter.submitted[0]['digest'], 'sha256:manifest-list')
+			self.assertIn('created_at', adapter.submitted[0])
+
+			result = scan_client.scan_images(self.client, [tag], cache=cache, digests=digests)[tag]
+			self.assertTrue(result['cached'])
+			self.assertEqual(adapter.calls[('POST', 'images')], 1)
@@ -0,0 +1,73 @@
+'''
+Test ECR push scanning template creation, resource creation
+and resource functionality for Anchore Engine
+'''
+import unittest
+from anchore import scan_events, main
+from tests.mocks import schema
+import anchore.constants as constants
+
+class TestScanEvents(unittest.TestCase):
+	def setUp(self):
+		self.template = scan_events.ScanEventsTemplate()
+
+	def test_add_descriptions(self):
+		template_file = self.template.add_descriptions("foobar")
+		self.assertEqual(template_file.to_yaml(), schema.MOCKED_DESCRIPTION)
+
+	def test_add_version(self):
+		template_file = self.template.add_version("2010-09-09")
+		self.assertEqual(template_file.to_yaml(), schema.MOCKED_VERSION)
+
+	def test_create_scan_events_template(self):
+		test_engine = main.AnchoreEngine()
+		self.assertEqual(test_engine.create_scan_events_template(), schema.mocked_scan_events_template())
+
+	def test_push_rule_targets_scan_queue(self):
+		self.template.add_scan_queue()
+		self.template.add_push_rule()
+		resources = self.template.cfn_template.to_dict()['Resources']
+		rule = resources[constants.PUSH_RULE]['Properties']
+		self.assertEqual(rule['EventPattern']['detail']['action-type'], ['PUSH'])
+		self.assertEqual(rule['Targets'][0]['Arn'], {'Fn::GetAtt': [constants.SCAN_QUEUE, 'Arn']})
+		self.assertIn('RedrivePolicy', resources[constants.SCAN_QUEUE]['Properties'])
+
+	def test_scanner_function_is_optional(self):
+		self.template.add_parameters()
+		self.template.add_conditions()
+		self.template.add_scan_queue()
+		self.template.add_scanner_function()
+		resources = self.template.cfn_template.to_dict()['Resources']
+		for title in [constants.SCANNER_ROLE, constants.SCANNER_FUNCTION, constants.SCANNER_EVENT_SOURCE]:
+			self.assertEqual(resources[title]['Condition'], constants.HAS_SCANNER)
+		mapping = resources[constants.SCANNER_EVENT_SOURCE]['Properties']
+		self.assertEqual(mapping['FunctionResponseTypes'], ['ReportBatchItemFailures'])
+
+	def test_batch_size_fits_without_batching_window(self):
+		self.template.add_parameters()
+		parameters = self.template.cfn_template.to_dict()['Parameters']
+		self.assertEqual(parameters['ScanBatchWindow']['MinValue'], '0')
+		self.assertEqual(parameters['ScanBatchSize']['MaxValue'], '10')
+
+	def test_scanner_function_reaches_internal_engine(self):
+		self.template.add_parameters()
+		self.template.add_scan_queue()
+		self.template.add_scanner_function()
+		resources = self.template.cfn_template.to_dict()['Resources']
+		function = resources[constants.SCANNER_FUNCTION]['Properties']
+		self.assertEqual(
+			function['VpcConfig']['SecurityGroupIds'],
+			[{'Fn::ImportValue': {'Fn::Sub': '${Environment}-AppSecurityGroup'}}]
+		)
+		self.assertEqual(len(function['VpcConfig']['SubnetIds']), 2)
+		variables = function['Environment']['Variables']
+		self.assertNotIn('ANCHORE_CLI_PASS', variables)
+		self.assertEqual(variables['ANCHORE_CLI_PASS_PARAMETER'], {'Ref': 'AnchoreAdminPasswordParameter'})
+		role = resources[constants.SCANNER_ROLE]['Properties']
+		self.assertIn(
+			'arn:aws:iam::aws:policy/service-role/AWSLambdaVPCAccessExecutionRole',
+			role['ManagedPolicyArns']
+		)
+
+	def tearDown(self):
+		self.template = scan_events.ScanEventsTemplate()
@@ -0,0 +1,70 @@
+'''
+Test batch submission of pushed ECR images from the scan queue
+'''
+import json
+import unittest
+from unittest import mock
+from tasks import scan_client, scan_queue
+from tests.mocks import engine
+
+URL = 'http://engine.local:8228/v1'
+DIGEST = 'sha256:' + 'b' * 64
+
+def push_event(tag, digest=DIGEST, repository='demo/app'):
+	return json.dumps({
+		'account': '123456789012',
+		'region': 'us-east-2',
+		'time': '2021-01-01T00:00:00Z',
+		'detail-type': 'ECR Image Action',
+		'detail': {
+			'action-type': 'PUSH',
+			'result': 'SUCCESS',
+			'repository-name': repository,
+			'image-digest': digest,
+			'image-tag': tag
+		}
+	})
+
+class TestScanQueue(unittest.TestCase):
+	def setUp(self):
+		self.client = scan_client.EngineClient(URL, 'admin', 'foobar', pool_size=4)
+		self.adapter = engine.FakeEngineAdapter()
+		self.client.session.mount('http://', self.adapter)
+
+	def test_pushed_image(self):
+		image = scan_queue.pushed_image(push_event('1.0'))
+		self.assertEqual(image['tag'], '123456789012.dkr.ecr.us-east-2.amazonaws.com/demo/app:1.0')
+		self.assertEqual(image['digest'], DIGEST)
+		self.assertIsNone(scan_queue.pushed_image(push_event(None)))
+		self.assertIsNone(scan_queue.pushed_image('not json'))
+
+	def test_same_digest_is_submitted_once(self):
+		failed = scan_queue.submit_messages(self.client, [
+			('1', push_event('1.0')),
+			('2', push_event('latest')),
+			('3', push_event('1.0', digest='sha256:' + 'c' * 64, repository='demo/api')),
+		])
+		self.assertEqual(failed, [])
+		self.assertEqual(self.adapter.calls[('POST', 'images')], 2)
+		self.assertIn(DIGEST, self.adapter.images)
+
+	def test_handler_reports_failed_messages(self):
+		with mock.patch.object(scan_queue, '_CLIENT', self.client), \
+				mock.patch.object(self.client, 'add_image', side_effect=scan_client.requests.ConnectionError('down')):
+			response = scan_queue.handler({'Records': [
+				{'messageId': 'm1', 'body': push_event('1.0')},
+				{'messageId': 'm2', 'body': 'not json'},
+			]}, None)
+		self.assertEqual(response, {'batchItemFailures': [{'itemIdentifier': 'm1'}]})
+
+	def test_poll_queue_deletes_handled_messages(self):
+		sqs = mock.Mock()
+		sqs.receive_message.return_value = {'Messages': [
+			{'MessageId': 'm1', 'ReceiptHandle': 'r1', 'Body': push_event('1.0')},
+			{'MessageId': 'm2', 'ReceiptHandle': 'r2', 'Body': push_event('2.0', digest='sha256:' + 'd' * 64)},
+		]}
+		self.assertEqual(scan_queue.poll_queue(sqs, 'queue-url', self.client, wait_time=0), 2)
+		sqs.delete_message_batch.assert_called_once_with(
+			QueueUrl='queue-url',
+			Entries=[{'Id': '0', 'ReceiptHandle': 'r1'}, {'Id': '1', 'ReceiptHandle': 'r2'}]
+		)
@@ -0,0 +1,28 @@
+'''
+Test the scan queue lambda package build
+'''
+import os
+import zipfile
+import tempfile
+import unittest
+from tasks import scanner_package
+
+class TestScannerPackage(unittest.TestCase):
+	def setUp(self):
+		self.directory = tempfile.TemporaryDirectory()
+		self.addCleanup(self.directory.cleanup)
+
+	def build(self, name):
+		return scanner_package.build_package(os.path.join(self.directory.name, name), requirements=[])
+
+	def test_package_holds_handler_modules(self):
+		with zipfile.ZipFile(self.build('scanner.zip')) as package:
+			names = package.namelist()
+		self.assertIn('tasks/scan_queue.py', names)
+		self.assertIn('tasks/__init__.py', names)
+		self.assertFalse([name for name in names if '__pycache__' in name or name.endswith('.pyc')])
+
+	def test_package_key_follows_content(self):
+		first = scanner_package.package_key(self.build('first.zip'))
+		self.assertEqual(first, scanner_package.package_key(self.build('second.zip')))
+		self.assertRegex(first, r'^scanner-[0-9a-f]{16}\.zip$')
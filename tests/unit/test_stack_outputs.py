@@ -0,0 +1,127 @@
+'''
+Test resolving ${Stack.Output} references from cached stack exports
+'''
+import os
+import tempfile
+import unittest
+from unittest import mock
+import yaml
+from anchore import main
+from tasks import deploy_stacks, stack_outputs
+from tests.mocks import cfn
+
+CONFIGS = 'configs/configs.yml'
+REGION = 'us-east-2'
+
+OUTPUTS = {
+	'DEMO-ANCHORE-VPC': [
+		{'OutputKey': 'VPC', 'OutputValue': 'vpc-123', 'ExportName': 'DEMO-VPCID'},
+		{'OutputKey': 'PublicSubnet1', 'OutputValue': 'subnet-1', 'ExportName': 'DEMO-PUBLIC-SUBNET-1'},
+		{'OutputKey': 'PublicSubnet2', 'OutputValue': 'subnet-2', 'ExportName': 'DEMO-PUBLIC-SUBNET-2'},
+	],
+	'DEMO-ANCHORE-ALB': [
+		{'OutputKey': 'LoadBalancerDNSName', 'OutputValue': 'alb.example.com'},
+		{'OutputKey': 'TargetGroup', 'OutputValue': 'arn:targetgroup', 'ExportName': 'DEMO-TARGETGROUP-ARN'},
+	]
+}
+
+class TestStackOutputs(unittest.TestCase):
+	def setUp(self):
+		self.client = cfn.FakeCloudFormation(outputs=OUTPUTS, page_size=2)
+		for stack_name in OUTPUTS:
+			self.client.create_stack(stack_name)
+		patcher = mock.patch.object(stack_outputs.clients, 'get_client', return_value=self.client)
+		patcher.start()
+		self.addCleanup(patcher.stop)
+		self.registry = stack_outputs.OutputRegistry()
+
+	def test_exports_are_read_in_one_paginated_sweep(self):
+		exports = self.registry.region_exports(REGION)
+		self.assertEqual(exports['DEMO-TARGETGROUP-ARN'], ('arn:targetgroup', 'DEMO-ANCHORE-ALB'))
+		self.assertEqual(len(exports), 4)
+		self.assertEqual(self.client.calls['list_exports'], 2)
+
+	def test_resolve_parameters(self):
+		parameters = self.registry.resolve_parameters({
+			'Environment': 'DEMO',
+			'VpcId': '${ANCHORE-VPC.VPCID}',
+			'Subnets': '${DEMO-ANCHORE-VPC.DEMO-PUBLIC-SUBNET-1},${ANCHORE-VPC.PUBLIC-SUBNET-2}',
+			'Url': 'http://${ANCHORE-ALB.LoadBalancerDNSName}:8228/v1',
+			'ClusterSize': '2',
+		}, REGION)
+		self.assertEqual(parameters, {
+			'Environment': 'DEMO',
+			'VpcId': 'vpc-123',
+			'Subnets': 'subnet-1,subnet-2',
+			'Url': 'http://alb.example.com:8228/v1',
+			'ClusterSize': '2',
+		})
+		self.assertEqual(self.client.calls['list_exports'], 2)
+		self.assertEqual(self.client.calls['describe_stacks'], 1)
+
+	def test_unknown_output(self):
+		with self.assertRaises(Exception):
+			self.registry.resolve('${ANCHORE-VPC.Missing}', REGION, 'DEMO')
+
+	def test_cache_expires_and_is_invalidated(self):
+		self.registry.region_exports(REGION)
+		self.registry.region_exports(REGION)
+		self.assertEqual(self.client.calls['list_exports'], 2)
+		self.registry.invalidate(REGION)
+		self.registry.region_exports(REGION)
+		self.assertEqual(self.client.calls['list_exports'], 4)
+		self.registry.ttl = 0
+		self.registry.region_exports(REGION)
+		self.assertEqual(self.client.calls['list_exports'], 6)
+
+	def test_stack_references(self):
+		self.assertEqual(
+			stack_outputs.stack_references({'A': '${ANCHORE-ALB.X}-${ANCHORE-VPC.Y}', 'B': 'VPCID', 'C': 2}),
+			{'ANCHORE-ALB', 'ANCHORE-VPC'}
+		)
+
+class TestDeployWithReferences(unittest.TestCase):
+	def setUp(self):
+		patcher = mock.patch.object(deploy_stacks.cfn, 'WAITER_MIN_DELAY', 0.01)
+		patcher.start()
+		self.addCleanup(patcher.stop)
+		test_engine = main.AnchoreEngine()
+		test_engine.create_vpc_template()
+		test_engine.create_alb_template()
+		test_engine.create_ecs_template()
+		test_engine.create_ec2_cluster_template()
+		test_engine.create_rds_template()
+		test_engine.create_archive_template()
+		test_engine.create_scan_events_template()
+		setup_data = deploy_stacks.cfn.load_yaml_file(CONFIGS)
+		for single_setup_data in setup_data:
+			if single_setup_data['resource_name'] == 'ANCHORE-SCAN-EVENTS':
+				single_setup_data['parameters']['TargetGroup'] = '${ANCHORE-ALB.TargetGroup}'
+		self.directory = tempfile.TemporaryDirectory()
+		self.configs = os.path.join(self.directory.name, 'configs.yml')
+		with open(self.configs, 'w') as configs:
+			yaml.safe_dump(setup_data, configs)
+
+	def test_references_are_resolved_after_their_stack_is_deployed(self):
+		client = cfn.FakeCloudFormation(outputs=OUTPUTS)
+		with mock.patch.object(deploy_stacks.cfn, 'regional_client', return_value=client), \
+				mock.patch.object(stack_outputs.clients, 'get_client', return_value=client):
+			self.assertTrue(deploy_stacks.deploy_stack(self.configs))
+
+		stack = next(
+			stack for stack in client.stacks.values()
+			if stack['StackName'] == 'DEMO-ANCHORE-SCAN-EVENTS'
+		)
+		self.assertIn(
+			{'ParameterKey': 'TargetGroup', 'ParameterValue': 'arn:targetgroup'},
+			stack['Inputs'][1]
+		)
+		self.assertEqual(stack['StackStatus'], 'CREATE_COMPLETE')
+		self.assertGreaterEqual(
+			client.timeline['DEMO-ANCHORE-SCAN-EVENTS'][0],
+			client.timeline['DEMO-ANCHORE-ALB'][1]
+		)
+
+	def tearDown(self):
+		stack_outputs.REGISTRY.invalidate()
+		self.directory.cleanup()
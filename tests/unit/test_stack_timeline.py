@@ -0,0 +1,139 @@
+'''
+Test reconstructing resource timelines and the critical path
+from cloudformation stack events
+'''
+import os
+import json
+import tempfile
+import unittest
+from datetime import datetime, timedelta, timezone
+from unittest import mock
+from anchore import main
+from tasks import stack_timeline
+from tests.mocks import cfn
+
+STACK = 'DEMO-ANCHORE-EC2-INSTANCE'
+START = datetime(2020, 1, 1, tzinfo=timezone.utc)
+
+# (minute, logical id, type, status)
+EVENTS = [
+	(0, STACK, 'AWS::CloudFormation::Stack', 'CREATE_IN_PROGRESS'),
+	(0, 'InstanceRole', 'AWS::IAM::Role', 'CREATE_IN_PROGRESS'),
+	(0, 'InstanceSSHSecurityGroup', 'AWS::EC2::SecurityGroup', 'CREATE_IN_PROGRESS'),
+	(0, 'Cluster', 'AWS::ECS::Cluster', 'CREATE_IN_PROGRESS'),
+	(0.1, 'Cluster', 'AWS::ECS::Cluster', 'CREATE_COMPLETE'),
+	(0.1, 'InstanceSSHSecurityGroup', 'AWS::EC2::SecurityGroup', 'CREATE_COMPLETE'),
+	(0.3, 'InstanceRole', 'AWS::IAM::Role', 'CREATE_COMPLETE'),
+	(0.3, 'InstanceProfile', 'AWS::IAM::InstanceProfile', 'CREATE_IN_PROGRESS'),
+	(2.3, 'InstanceProfile', 'AWS::IAM::InstanceProfile', 'CREATE_COMPLETE'),
+	(2.3, 'LaunchConfiguration', 'AWS::AutoScaling::LaunchConfiguration', 'CREATE_IN_PROGRESS'),
+	(2.4, 'LaunchConfiguration', 'AWS::AutoScaling::LaunchConfiguration', 'CREATE_COMPLETE'),
+	(2.4, 'AutoScalingGroup', 'AWS::AutoScaling::AutoScalingGroup', 'CREATE_IN_PROGRESS'),
+	(24.4, 'AutoScalingGroup', 'AWS::AutoScaling::AutoScalingGroup', 'CREATE_COMPLETE'),
+	(24.4, 'CapacityProvider', 'AWS::ECS::CapacityProvider', 'CREATE_IN_PROGRESS'),
+	(24.5, 'CapacityProvider', 'AWS::ECS::CapacityProvider', 'CREATE_COMPLETE'),
+	(24.5, STACK, 'AWS::CloudFormation::Stack', 'CREATE_COMPLETE'),
+]
+
+def stack_events(stack_id):
+	'''
+	Build boto3-style stack events, newest first
+	'''
+	return [
+		{
+			'EventId': f'{stack_id}-{number}',
+			'StackId': stack_id,
+			'StackName': STACK,
+			'LogicalResourceId': logical_id,
+			'ResourceType': resource_type,
+			'ResourceStatus': status,
+			'ResourceStatusReason': '',
+			'Timestamp': START + timedelta(minutes=minute),
+		}
+		for number, (minute, logical_id, resource_type, status) in reversed(list(enumerate(EVENTS)))
+	]
+
+class TestStackTimeline(unittest.TestCase):
+	def setUp(self):
+		main.AnchoreEngine().create_ec2_cluster_template()
+		with open('anchore_ec2_cluster.yml', 'r') as template:
+			body = template.read()
+		self.client = cfn.FakeCloudFormation()
+		stack_id = self.client.create_stack(STACK, TemplateBody=body)['StackId']
+		self.client.stacks[stack_id]['StackStatus'] = 'CREATE_COMPLETE'
+		self.client.events[stack_id] = stack_events(stack_id)
+		patcher = mock.patch.object(stack_timeline.cfn, 'regional_client', return_value=self.client)
+		patcher.start()
+		self.addCleanup(patcher.stop)
+		self.manager = stack_timeline.cfn.DeploymentManager({'region': 'us-east-2'})
+
+	def test_resource_intervals(self):
+		timeline = stack_timeline.stack_timeline(self.manager, STACK)
+		intervals = timeline['intervals']
+		self.assertNotIn(STACK, intervals)
+		self.assertEqual(len(intervals), 7)
+		asg = intervals['AutoScalingGroup']
+		self.assertEqual(stack_timeline.seconds(asg['start'], asg['end']), 22 * 60)
+		self.assertEqual(asg['status'], 'CREATE_COMPLETE')
+		self.assertEqual(timeline['status'], 'CREATE_COMPLETE')
+
+	def test_critical_path_follows_template_dependencies(self):
+		timeline = stack_timeline.stack_timeline(self.manager, STACK)
+		self.assertEqual(timeline['critical_path'][-2:], ['AutoScalingGroup', 'CapacityProvider'])
+		self.assertIn('LaunchConfiguration', timeline['critical_path'])
+		self.assertNotIn('Cluster', timeline['critical_path'])
+		self.assertIn('PT30M', timeline['notes']['AutoScalingGroup'])
+
+	def test_critical_path_without_template(self):
+		timeline = stack_timeline.stack_timeline(self.manager, STACK)
+		path = stack_timeline.critical_path(timeline['intervals'])
+		self.assertEqual(path, [
+			'InstanceRole', 'InstanceProfile', 'LaunchConfiguration',
+			'AutoScalingGroup', 'CapacityProvider'
+		])
+
+	def test_text_summary_names_the_slowest_resource(self):
+		lines = stack_timeline.text_summary(stack_timeline.stack_timeline(self.manager, STACK))
+		self.assertEqual(lines[0], f'{STACK}: CREATE_COMPLETE in 24m30s')
+		slowest = lines[lines.index('  Slowest resources:') + 1]
+		self.assertIn('AutoScalingGroup', slowest)
+		self.assertIn('22m00s', slowest)
+		self.assertIn('timeout PT30M', slowest)
+
+	def test_chrome_trace(self):
+		trace = stack_timeline.chrome_trace([stack_timeline.stack_timeline(self.manager, STACK)])
+		spans = {event['name']: event for event in trace['traceEvents'] if event['ph'] == 'X'}
+		self.assertEqual(spans['AutoScalingGroup']['ts'], int(2.4 * 60 * 1000000))
+		self.assertEqual(spans['AutoScalingGroup']['dur'], 22 * 60 * 1000000)
+		self.assertEqual(spans['AutoScalingGroup']['cat'], 'critical')
+		self.assertNotEqual(spans['Cluster']['cat'], 'critical')
+		json.dumps(trace)
+
+	def test_only_last_operation_is_analyzed(self):
+		stack_id = next(iter(self.client.stacks))
+		self.client.events[stack_id] = [{
+			'EventId': 'update',
+			'StackId': stack_id,
+			'StackName': STACK,
+			'LogicalResourceId': STACK,
+			'ResourceType': 'AWS::CloudFormation::Stack',
+			'ResourceStatus': 'UPDATE_IN_PROGRESS',
+			'Timestamp': START + timedelta(hours=1),
+		}] + self.client.events[stack_id]
+		timeline = stack_timeline.stack_timeline(self.manager, STACK)
+		self.assertEqual(timeline['intervals'], {})
+		self.assertEqual(timeline['critical_path'], [])
+
+	def test_main_writes_trace(self):
+		with tempfile.TemporaryDirectory() as directory:
+			configs = os.path.join(directory, 'configs.yml')
+			trace_file = os.path.join(directory, 'trace.json')
+			with open(configs, 'w') as config:
+				config.write(
+					'- region: us-east-2\n  resource_name: ANCHORE-EC2-INSTANCE\n'
+					'  parameters:\n    Environment: DEMO\n'
+				)
+			timelines = stack_timeline.main(configs, trace_file)
+			with open(trace_file, 'r') as trace:
+				self.assertTrue(json.load(trace)['traceEvents'])
+		self.assertEqual(len(timelines), 1)
@@ -0,0 +1,99 @@
+'''
+Test reverse dependency order stack teardown and batched
+bucket emptying against stubbed aws clients
+'''
+import io
+import tempfile
+import unittest
+import contextlib
+from unittest import mock
+import yaml
+from anchore import main
+from tasks import deploy_stacks, teardown_stack
+from tests.mocks import cfn, s3
+
+CONFIGS = 'configs/configs.yml'
+
+class TestTeardownStack(unittest.TestCase):
+	def setUp(self):
+		patcher = mock.patch.object(deploy_stacks.cfn, 'WAITER_MIN_DELAY', 0.01)
+		patcher.start()
+		self.addCleanup(patcher.stop)
+		patcher = mock.patch.object(teardown_stack.keypair, 'delete_keypair')
+		patcher.start()
+		self.addCleanup(patcher.stop)
+		test_engine = main.AnchoreEngine()
+		test_engine.create_templates([
+			'create_vpc_template',
+			'create_alb_template',
+			'create_rds_template',
+			'create_archive_template',
+			'create_ecs_template',
+			'create_ec2_cluster_template',
+			'create_scan_events_template'
+		])
+
+	def test_stacks_are_deleted_in_reverse_dependency_order(self):
+		client = cfn.FakeCloudFormation({
+			'DEMO-ANCHORE-ALB': 0.2,
+			'DEMO-ANCHORE-EC2-INSTANCE': 0.2,
+			'DEMO-ANCHORE-RDS': 0.2,
+		})
+		with mock.patch.object(deploy_stacks.cfn, 'regional_client', return_value=client):
+			deploy_stacks.deploy_stack(CONFIGS)
+			teardown_stack.main(CONFIGS)
+
+		timeline = client.timeline
+		statuses = [stack['StackStatus'] for stack in client.stacks.values()]
+		self.assertEqual(statuses, ['DELETE_COMPLETE'] * 7)
+		alb_start, alb_end = timeline['DEMO-ANCHORE-ALB']
+		ec2_start, ec2_end = timeline['DEMO-ANCHORE-EC2-INSTANCE']
+		rds_start, rds_end = timeline['DEMO-ANCHORE-RDS']
+		self.assertGreaterEqual(alb_start, timeline['DEMO-ANCHORE-ECS'][1])
+		self.assertGreaterEqual(alb_start, timeline['DEMO-ANCHORE-SCAN-EVENTS'][1])
+		self.assertGreaterEqual(ec2_start, timeline['DEMO-ANCHORE-ECS'][1])
+		self.assertLess(max(alb_start, ec2_start, rds_start), min(alb_end, ec2_end, rds_end))
+		self.assertGreaterEqual(timeline['DEMO-ANCHORE-VPC'][0], max(alb_end, ec2_end, rds_end))
+
+	def test_missing_stacks_are_skipped(self):
+		client = cfn.FakeCloudFormation()
+		with mock.patch.object(deploy_stacks.cfn, 'regional_client', return_value=client):
+			self.assertEqual(teardown_stack.main(CONFIGS), 'Teardown Complete!!!')
+		self.assertEqual(client.calls['delete_stack'], 0)
+
+	def test_bucket_of_missing_stack_is_not_emptied(self):
+		client = cfn.FakeCloudFormation()
+		pipeline = {
+			'region': 'us-east-2',
+			'resource_name': 'ANCHORE-CLI-PIPELINE',
+			'template_file': 'examples/aws-codepipeline/pipeline.yml',
+			'parameters': {'Environment': 'DEMO', 'BucketName': 'demo-anchore-engine-pipeline-store'}
+		}
+		with tempfile.NamedTemporaryFile('w', suffix='.yml') as configs:
+			yaml.safe_dump([pipeline], configs)
+			configs.flush()
+			with mock.patch.object(deploy_stacks.cfn, 'regional_client', return_value=client), \
+					mock.patch.object(teardown_stack, 'empty_bucket') as empty_bucket, \
+					contextlib.redirect_stdout(io.StringIO()) as output:
+				teardown_stack.main(configs.name)
+		empty_bucket.assert_not_called()
+		self.assertIn('Teardown Complete!!!', output.getvalue())
+		self.assertNotIn('Stack Teardown Failed!!!', output.getvalue())
+
+	def test_empty_bucket_tolerates_missing_bucket(self):
+		bucket = s3.FakeS3(exists=False)
+		with mock.patch.object(teardown_stack.clients, 'get_client', return_value=bucket):
+			self.assertEqual(teardown_stack.empty_bucket('pipeline-store', 'us-east-2'), 0)
+
+	def test_empty_bucket_deletes_versions_in_batches(self):
+		bucket = s3.FakeS3(versions=2500, delete_markers=600, page_size=1000)
+		with mock.patch.object(teardown_stack.clients, 'get_client', return_value=bucket):
+			self.assertEqual(teardown_stack.empty_bucket('pipeline-store', 'us-east-2'), 3100)
+		self.assertEqual(sorted(bucket.batches), [100, 1000, 1000, 1000])
+		self.assertIn({'Key': 'marker-0', 'VersionId': 'd0'}, bucket.deleted)
+
+	def test_empty_bucket_reports_errors(self):
+		bucket = s3.FakeS3(versions=3, failed_keys=['key-1'])
+		with mock.patch.object(teardown_stack.clients, 'get_client', return_value=bucket):
+			with self.assertRaises(Exception):
+				teardown_stack.empty_bucket('pipeline-store', 'us-east-2')
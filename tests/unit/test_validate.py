@@ -0,0 +1,72 @@
+'''
+Test the import/export cross-check and report of the
+template validation stage
+'''
+import os
+import tempfile
+import unittest
+from tests import validate
+
+VPC = '''
+Parameters:
+  Environment:
+    Type: String
+Resources: {}
+Outputs:
+  VPC:
+    Value: vpc-1
+    Export:
+      Name: !Sub '${Environment}-VPCID'
+'''
+
+APP = '''
+Parameters:
+  Environment:
+    Type: String
+  Network:
+    Type: String
+    Default: VPCID
+Resources:
+  SecurityGroup:
+    Type: AWS::EC2::SecurityGroup
+    Properties:
+      VpcId: !ImportValue
+        Fn::Sub: '${Environment}-${Network}'
+      Tags:
+        - Value: !ImportValue
+            Fn::Sub: '${Environment}-MISSING'
+'''
+
+class TestValidate(unittest.TestCase):
+	def setUp(self):
+		self.directory = tempfile.TemporaryDirectory()
+		self.templates = []
+		for name, body in [('vpc.yml', VPC), ('app.yml', APP)]:
+			path = os.path.join(self.directory.name, name)
+			with open(path, 'w') as template:
+				template.write(body)
+			self.templates.append(path)
+
+	def test_imports_resolve_against_deployed_parameters(self):
+		findings = validate.check_imports(self.templates, {
+			path: {'Environment': 'DEMO'} for path in self.templates
+		})
+		self.assertEqual(findings[self.templates[0]], [])
+		self.assertEqual(
+			[finding['message'] for finding in findings[self.templates[1]]],
+			['DEMO-MISSING is not exported by any template']
+		)
+
+	def test_unresolved_names_match_any_export(self):
+		findings = validate.check_imports(self.templates, {})
+		self.assertEqual(len(findings[self.templates[1]]), 1)
+
+	def test_build_report(self):
+		lint = {self.templates[0]: [{'check': 'cfn-lint', 'rule': 'W1001', 'severity': validate.WARNING}]}
+		imports = validate.check_imports(self.templates, {})
+		report = validate.build_report(self.templates, lint, imports)
+		self.assertEqual(report['summary'], {validate.ERROR: 1, validate.WARNING: 1})
+		self.assertEqual(len(report['templates'][self.templates[0]]), 1)
+
+	def tearDown(self):
+		self.directory.cleanup()
@@ -2,51 +2,219 @@
 Lint cfn templates,
 Check cfn templates for security issues, and
 Validate cfn templates
+
+All templates are linted in-process through the cfn-lint API on a
+process pool, scanned by a single cfn_nag run and cross-checked for
+ImportValue names that no template exports. The findings are written
+to one structured report.
 '''
 import os
-import boto3
+import re
+import sys
+import glob
+import json
+import shutil
+import tempfile
+import subprocess # nosec
+from concurrent.futures import ProcessPoolExecutor
+from anchore.main import AnchoreEngine, TEMPLATE_BUILDERS
+from tasks.cloudformation import load_yaml_file
+import tasks.stack_graph as graph
+
+EXTRA_TEMPLATES = ['examples/aws-codepipeline/pipeline.yml']
+DEPLOYMENT_CONFIGS = ['configs/*.yml', 'examples/*/*_configs.yml']
+REPORT_FILE = 'validation_report.json'
+LINT_REGIONS = ['us-east-2']
+
+ERROR = 'error'
+WARNING = 'warning'
 
 def lint_cfn(template):
     '''
-    lint cfn template
+    lint cfn template with the cfn-lint python API
+
+    Runs in a worker process, so cfn-lint and its rules are
+    loaded once per worker rather than once per template.
+
+    Returns:
+        List of findings with rule, severity, message and line
+    '''
+    from cfnlint.api import lint # pylint: disable=import-outside-toplevel
+    with open(template, 'r') as template_file:
+        matches = lint(template_file.read(), regions=LINT_REGIONS)
+    return [
+        {
+            'check': 'cfn-lint',
+            'rule': match.rule.id,
+            'severity': ERROR if match.rule.id.startswith('E') else WARNING,
+            'message': match.message,
+            'line': match.linenumber
+        }
+        for match in matches
+    ]
+
+def cfn_security_scan(templates):
+    '''
+    Check all cfn templates for security issues in one cfn_nag run
+
+    Returns:
+        Dictionary of template to findings, empty when cfn_nag is not installed
     '''
-    print(f'BEGINS: Linting template - {template}')
-    os.system(f'cfn-lint {template}')
+    findings = {template: [] for template in templates}
+    if shutil.which('cfn_nag_scan') is None:
+        print('cfn_nag_scan not found, skipping security scan')
+        return findings
+    with tempfile.TemporaryDirectory() as scan_dir:
+        names = {}
+        for number, template in enumerate(templates):
+            name = f'{number}-{os.path.basename(template)}'
+            names[name] = template
+            shutil.copy(template, os.path.join(scan_dir, name))
+        result = subprocess.run( # nosec
+            ['cfn_nag_scan', '--input-path', scan_dir, '--output-format', 'json'],
+            stdout=subprocess.PIPE,
+            check=False
+        )
+    for file_result in json.loads(result.stdout or '[]'):
+        template = names[os.path.basename(file_result['filename'])]
+        for violation in file_result['file_results']['violations']:
+            findings[template].append({
+                'check': 'cfn_nag',
+                'rule': violation['id'],
+                'severity': ERROR if violation['type'] == 'FAIL' else WARNING,
+                'message': violation['message'],
+                'resources': violation.get('logical_resource_ids', [])
+            })
+    return findings
 
-def cfn_security_scan(template):
+def deployment_parameters():
     '''
-    Check cfn templates for security issues
+    Parameters each template is deployed with, from the deployment configs
+
+    Returns:
+        Dictionary of template file to parameter key-values
     '''
-    print(f'BEGINS: Checking cfn template - {template} for security issues')
-    os.system(f'cfn_nag_scan --input-path {template}')
+    parameters = {}
+    for pattern in DEPLOYMENT_CONFIGS:
+        for configs in sorted(glob.glob(pattern)):
+            for single_setup_data in load_yaml_file(configs) or []:
+                if 'template_file' in single_setup_data:
+                    parameters.setdefault(
+                        single_setup_data['template_file'],
+                        single_setup_data.get('parameters') or {}
+                    )
+    return parameters
 
-def validate_cfn(template):
+def template_parameters(body, deployed):
     '''
-    validate cfn template
+    Parameter defaults of a template overridden by its deployed values
     '''
-    print(f'BEGINS: Validating cfn template - {template} for accuracy')
-    client = boto3.client('cloudformation')
-    response = client.validate_template(TemplateBody=template)
-    return response
+    parameters = {
+        name: parameter['Default']
+        for name, parameter in (body.get('Parameters') or {}).items()
+        if 'Default' in parameter
+    }
+    parameters.update(deployed)
+    return parameters
 
-def main():
+def name_pattern(name):
     '''
-    cfn template validation entrypoint
+    Match an export name whose unresolved ${...} parts may be anything
     '''
-    templates = [
-        'anchore_vpc.yml',
-        'anchore_alb.yml',
-        'anchore_ecr.yml',
-        'anchore_ecs.yml',
-        'anchore_ec2_cluster.yml',
-        'examples/aws-codepipeline/pipeline.yml'
-    ]
+    return re.compile('^' + '.+'.join(
+        re.escape(part) for part in graph.SUB_VARIABLE.split(name)[::2]
+    ) + '$')
+
+def check_imports(templates, deployed=None):
+    '''
+    Cross-check every ImportValue against the exports of all templates
+
+    Names are resolved with the parameters each template is deployed
+    with, falling back to parameter defaults. Parts that still can not
+    be resolved match any export.
+
+    Returns:
+        Dictionary of template to findings for imports nobody exports
+    '''
+    deployed = deployment_parameters() if deployed is None else deployed
+    exports = {}
+    imports = {}
     for template in templates:
-        lint_cfn(template)
-        cfn_security_scan(template)
-        # validate_cfn(vpc)
-    return 
+        with open(template, 'r') as template_file:
+            body = graph.load_template(template_file.read())
+        parameters = template_parameters(body, deployed.get(template, {}))
+        for export in graph.template_exports(body, parameters):
+            exports.setdefault(export, []).append(template)
+        imports[template] = graph.template_imports(body, parameters)
 
-if __name__ == '__main__':
-    main()
+    findings = {}
+    for template, names in imports.items():
+        findings[template] = [
+            {
+                'check': 'imports',
+                'rule': 'ImportValue',
+                'severity': ERROR,
+                'message': f'{name} is not exported by any template'
+            }
+            for name in sorted(names)
+            if name not in exports and not any(
+                name_pattern(name).match(export) or name_pattern(export).match(name)
+                for export in exports
+            )
+        ]
+    duplicates = {name: owners for name, owners in exports.items() if len(owners) > 1}
+    for name, owners in duplicates.items():
+        for template in owners:
+            findings[template].append({
+                'check': 'imports',
+                'rule': 'Export',
+                'severity': WARNING,
+                'message': f'{name} is also exported by {sorted(set(owners) - {template})}'
+            })
+    return findings
+
+def build_report(templates, *results):
+    '''
+    Merge per-template findings into one report
+    '''
+    report = {'templates': {}, 'summary': {ERROR: 0, WARNING: 0}}
+    for template in templates:
+        findings = [finding for result in results for finding in result.get(template, [])]
+        report['templates'][template] = findings
+        for finding in findings:
+            report['summary'][finding['severity']] += 1
+    return report
+
+def main(max_workers=None):
+    '''
+    cfn template validation entrypoint
+
+    Returns:
+        True when no template has errors
+    '''
+    AnchoreEngine().create_templates(list(TEMPLATE_BUILDERS))
+    templates = [filename for _, filename, _ in TEMPLATE_BUILDERS.values()] + EXTRA_TEMPLATES
 
+    print(f'BEGINS: Linting {len(templates)} templates')
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        lint_results = dict(zip(templates, executor.map(lint_cfn, templates)))
+    print('BEGINS: Checking cfn templates for security issues')
+    security_results = cfn_security_scan(templates)
+    print('BEGINS: Cross-checking stack imports and exports')
+    import_results = check_imports(templates)
+
+    report = build_report(templates, lint_results, security_results, import_results)
+    with open(REPORT_FILE, 'w') as report_file:
+        json.dump(report, report_file, indent=2)
+
+    for template, findings in report['templates'].items():
+        print(f'{template}: {len(findings)} findings')
+        for finding in findings:
+            print(f'  [{finding["severity"]}] {finding["check"]} {finding["rule"]}'
+                  f' {finding["message"]}')
+    print(f'{report["summary"][ERROR]} errors, {report["summary"][WARNING]} warnings,'
+          f' report written to {REPORT_FILE}')
+    return report['summary'][ERROR] == 0
+
+if __name__ == '__main__':
+    sys.exit(0 if main() else 1)